@@ -37,7 +37,13 @@ setup(
         'Flask-Script',
         'Flask-Migrate',
         'beautifulsoup4',
+        'lxml',
     ],
+    extras_require={
+        'test': [
+            'aiosmtpd',
+        ],
+    },
     entry_points="""
     [console_scripts]
     flask-ctl = lunch_app.script:run
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Micro benchmarks of slow code paths.
+"""
+from collections import OrderedDict
+import datetime
+import timeit
+
+from bs4 import BeautifulSoup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .fixtures import KOZIOLEK_PAGE, TOMAS_PAGE
+from .main import app
+from .menu_import import food_row, INSERT_CHUNK
+from .models import CacheVersion, Food
+from .webcrawler import (
+    get_dania_dnia_from_pod_koziolek,
+    get_week_from_tomas,
+    lxml,
+    KOZIOLEK_MEALS,
+    TOMAS_MEALS,
+)
+
+
+def best_time(func, number, setup='pass'):
+    """
+    Returns shortest of number runs of func in seconds.
+    """
+    return min(timeit.repeat(func, setup=setup, number=1, repeat=number))
+
+
+def _read(file_path):
+    """
+    Returns content of saved page.
+    """
+    with open(file_path, 'rb') as page_file:
+        return page_file.read()
+
+
+def crawler_parsing(number=20, koziolek_page=KOZIOLEK_PAGE,
+                    tomas_page=TOMAS_PAGE):
+    """
+    Compares parsing of saved restaurant pages with whole document
+    parsed by html.parser and with pluggable parsers limited to menu nodes.
+    """
+    koziolek = _read(koziolek_page)
+    tomas = _read(tomas_page)
+    parsers = ['html.parser'] + (['lxml'] if lxml is not None else [])
+    results = OrderedDict()
+    for parser in parsers:
+        results['whole page, {}'.format(parser)] = best_time(
+            lambda: (
+                BeautifulSoup(koziolek, parser).find_all(KOZIOLEK_MEALS),
+                BeautifulSoup(tomas, parser).find_all(TOMAS_MEALS),
+            ),
+            number,
+        )
+    old_parser = app.config.get('CRAWLER_PARSER')
+    try:
+        for parser in parsers:
+            app.config['CRAWLER_PARSER'] = parser
+            results['menu nodes, {}'.format(parser)] = best_time(
+                lambda: (
+                    get_dania_dnia_from_pod_koziolek(koziolek),
+                    get_week_from_tomas(tomas),
+                ),
+                number,
+            )
+    finally:
+        app.config['CRAWLER_PARSER'] = old_parser
+    return results
+
+
+def food_insert(number=5, rows=1000):
+    """
+    Compares inserting Food rows one ORM object at a time with
+    bulk_insert_mappings and core inserts used by insert_foods.
+    Runs on in memory SQLite, so it does not touch app database.
+    """
+    engine = create_engine('sqlite://')
+    # committed ORM changes bump menu cache version
+    CacheVersion.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    day = datetime.date(2015, 2, 9)
+    foods = [
+        food_row('Tomas', 'Danie {}'.format(i), 10, 'daniednia', day, day)
+        for i in range(rows)
+    ]
+
+    def recreate_table():
+        """
+        Starts every run with empty table.
+        """
+        Food.__table__.drop(engine, checkfirst=True)
+        Food.__table__.create(engine)
+
+    def orm():
+        """
+        Adds ORM objects one by one.
+        """
+        for row in foods:
+            session.add(Food(**row))
+        session.commit()
+
+    def bulk_mappings():
+        """
+        Inserts rows with bulk_insert_mappings.
+        """
+        session.bulk_insert_mappings(Food, foods)
+        session.commit()
+
+    def core_executemany():
+        """
+        Inserts rows like insert_foods on SQLite.
+        """
+        session.execute(Food.__table__.insert(), foods)
+        session.commit()
+
+    def multi_row_insert():
+        """
+        Inserts rows like insert_foods on server databases.
+        """
+        for start in range(0, len(foods), INSERT_CHUNK):
+            session.execute(
+                Food.__table__.insert().values(
+                    foods[start:start + INSERT_CHUNK],
+                ),
+            )
+        session.commit()
+
+    results = OrderedDict()
+    for label, func in (
+            ('{} rows, ORM objects'.format(rows), orm),
+            ('{} rows, bulk_insert_mappings'.format(rows), bulk_mappings),
+            ('{} rows, core executemany'.format(rows), core_executemany),
+            ('{} rows, multi row INSERT'.format(rows), multi_row_insert),
+    ):
+        results[label] = best_time(func, number, setup=recreate_table)
+    session.close()
+    return results
+
+
+BENCHMARKS = OrderedDict([
+    ('crawlers', crawler_parsing),
+    ('food_insert', food_insert),
+])
+
+
+def run(name, number=20):
+    """
+    Prints results of benchmark compared to its first result.
+    """
+    results = BENCHMARKS[name](number)
+    baseline = next(iter(results.values()))
+    for label, seconds in results.items():
+        print('{:<40} {:>10.2f} ms {:>8.1f}x'.format(
+            label,
+            seconds * 1000,
+            baseline / seconds,
+        ))
+    return results
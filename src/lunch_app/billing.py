@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Monthly billing totals kept up to date with orders.
+"""
+from sqlalchemy import and_, event, extract, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, attributes
+
+from .main import db
+from .models import MonthlyBilling, Order
+
+BILLED_ATTRIBUTES = ('user_name', 'date', 'company', 'cost')
+
+
+def billing_key(user_name, date, company):
+    """
+    Returns key of MonthlyBilling row counting given order.
+    """
+    return user_name, date.year, date.month, company or ''
+
+
+def _add(deltas, key, count, cost):
+    """
+    Adds change of number of orders and cost to deltas.
+    """
+    delta = deltas.setdefault(key, [0, 0])
+    delta[0] += count
+    delta[1] += cost or 0
+
+
+def _old_value(order, name):
+    """
+    Returns value of order attribute loaded from db before the change.
+    """
+    history = attributes.get_history(order, name)
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(order, name)
+
+
+def _old_cost(order):
+    """
+    Returns negative cost of order as it is stored in db.
+    """
+    return -(_old_value(order, 'cost') or 0)
+
+
+def _old_key(order):
+    """
+    Returns billing key of order as it is stored in db.
+    """
+    return billing_key(*(
+        _old_value(order, name) for name in BILLED_ATTRIBUTES[:3]
+    ))
+
+
+def _new_key(order):
+    """
+    Returns billing key of order after the change.
+    """
+    return billing_key(order.user_name, order.date, order.company)
+
+
+def order_deltas(session):
+    """
+    Returns changes of billing caused by orders added, changed
+    and deleted in flushed session, keyed by billing key.
+    """
+    deltas = {}
+    for order in session.new:
+        if isinstance(order, Order) and order.date is not None:
+            _add(deltas, _new_key(order), 1, order.cost)
+    for order in session.deleted:
+        if isinstance(order, Order) and order.date is not None:
+            _add(deltas, _old_key(order), -1, _old_cost(order))
+    for order in session.dirty:
+        if not isinstance(order, Order) or not session.is_modified(order):
+            continue
+        if _old_value(order, 'date') is not None:
+            _add(deltas, _old_key(order), -1, _old_cost(order))
+        if order.date is not None:
+            _add(deltas, _new_key(order), 1, order.cost)
+    return {
+        key: delta for key, delta in deltas.items() if delta != [0, 0]
+    }
+
+
+def apply_deltas(connection, deltas):
+    """
+    Updates MonthlyBilling rows by deltas. Rows without orders left
+    are removed. Row created by other transaction between update and
+    insert is updated, without rolling back caller's transaction.
+    """
+    table = MonthlyBilling.__table__
+    for (user_name, year, month, company), (count, cost) in deltas.items():
+        where = and_(
+            table.c.user_name == user_name,
+            table.c.year == year,
+            table.c.month == month,
+            table.c.company == company,
+        )
+        update = table.update().where(where).values(
+            orders_count=table.c.orders_count + count,
+            total_cost=table.c.total_cost + cost,
+        )
+        updated = connection.execute(update).rowcount
+        if not updated and count > 0:
+            try:
+                with connection.begin_nested():
+                    connection.execute(table.insert().values(
+                        user_name=user_name,
+                        year=year,
+                        month=month,
+                        company=company,
+                        orders_count=count,
+                        total_cost=cost,
+                    ))
+            except IntegrityError:
+                # first order of the month was billed concurrently
+                connection.execute(update)
+        elif updated and count < 0:
+            connection.execute(
+                table.delete().where(and_(where, table.c.orders_count <= 0))
+            )
+
+
+def bill_order_rows(rows):
+    """
+    Adds orders inserted as dicts without ORM, e.g. by
+    bulk_insert_mappings, to billing in current transaction.
+    """
+    deltas = {}
+    for row in rows:
+        key = billing_key(row['user_name'], row['date'], row['company'])
+        _add(deltas, key, 1, row['cost'])
+    apply_deltas(db.session.connection(), deltas)
+
+
+def rebuild_monthly_billing():
+    """
+    Computes MonthlyBilling again from all orders and commits.
+    Returns number of billing rows.
+    """
+    table = MonthlyBilling.__table__
+    year = extract('year', Order.date)
+    month = extract('month', Order.date)
+    company = func.coalesce(Order.company, '')
+    totals = db.session.query(
+        Order.user_name,
+        year,
+        month,
+        company,
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.cost), 0),
+    ).filter(
+        and_(
+            Order.date.isnot(None),
+            Order.user_name.isnot(None),
+        )
+    ).group_by(Order.user_name, year, month, company)
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        [
+            table.c.user_name,
+            table.c.year,
+            table.c.month,
+            table.c.company,
+            table.c.orders_count,
+            table.c.total_cost,
+        ],
+        totals.statement,
+    ))
+    db.session.commit()
+    return db.session.query(func.count(MonthlyBilling.id)).scalar()
+
+
+def _bill_flushed_orders(session, flush_context):
+    """
+    Updates billing in the same transaction as flushed orders.
+    """
+    deltas = order_deltas(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    """
+    Listening with active history makes SQLAlchemy load value replaced
+    in expired order, so billing knows where the order was counted.
+    """
+
+
+def listen():
+    """
+    Registers session events keeping billing up to date.
+    """
+    if event.contains(Session, 'after_flush', _bill_flushed_orders):
+        return
+    for name in BILLED_ATTRIBUTES:
+        event.listen(
+            getattr(Order, name),
+            'set',
+            _load_old_value,
+            active_history=True,
+        )
+    event.listen(Session, 'after_flush', _bill_flushed_orders)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Process wide caches kept in sync between uWSGI workers.
+"""
+import datetime
+from hashlib import sha1
+from uuid import uuid4
+
+from flask import g, has_request_context
+from sqlalchemy import and_, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from .main import db
+from .metrics import cache_lookup
+from .models import CacheVersion, MailText, OrderingInfo, Food, Order
+
+
+def _read_tokens():
+    """
+    Returns version tokens of all caches. Read once per request.
+    """
+    if has_request_context() and 'cache_tokens' in g:
+        return g.cache_tokens
+    tokens = dict(db.session.query(CacheVersion.name, CacheVersion.token))
+    if has_request_context():
+        g.cache_tokens = tokens
+    return tokens
+
+
+class SharedVersion(object):
+    """
+    Version token telling processes that cached data is outdated.
+    Stored in db, so uWSGI workers and flask-ctl daemons changing
+    data see each other's changes.
+    """
+
+    def __init__(self, name):
+        """
+        Inits version with its name in db.
+        """
+        self.name = name
+
+    def get(self):
+        """
+        Returns current version token.
+        """
+        token = _read_tokens().get(self.name)
+        if token is None:
+            return self.bump()
+        return token
+
+    def bump(self, bind=None):
+        """
+        Changes version token so all processes reload cached data.
+        Committed on its own connection of bind, app's engine is used
+        by default.
+        """
+        token = uuid4().hex
+        table = CacheVersion.__table__
+        update = table.update().where(
+            table.c.name == self.name,
+        ).values(token=token)
+        with (bind or db.engine).begin() as connection:
+            if not connection.execute(update).rowcount:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(
+                            table.insert().values(name=self.name, token=token)
+                        )
+                except IntegrityError:
+                    # other process created version meanwhile
+                    connection.execute(update)
+        if has_request_context() and 'cache_tokens' in g:
+            g.cache_tokens[self.name] = token
+        return token
+
+
+class CachedRow(object):
+    """
+    Read only copy of db row which can outlive db session.
+    """
+
+    def __init__(self, row):
+        """
+        Copies all columns of row.
+        """
+        for column in row.__table__.columns:
+            setattr(self, column.key, getattr(row, column.key))
+
+
+class SingletonCache(object):
+    """
+    Cache of single row settings tables.
+    """
+
+    def __init__(self, version):
+        """
+        Inits empty cache.
+        """
+        self.version = version
+        self.rows = {}
+        self.rows_version = None
+
+    def get(self, model):
+        """
+        Returns cached copy of model's first row or None.
+        """
+        version = self.version.get()
+        if version != self.rows_version:
+            self.rows = {}
+            self.rows_version = version
+        cache_lookup('settings', model in self.rows)
+        if model not in self.rows:
+            row = model.query.order_by(model.id).first()
+            self.rows[model] = CachedRow(row) if row is not None else None
+        return self.rows[model]
+
+    def invalidate(self, bind=None):
+        """
+        Drops cached rows in all processes using db of bind.
+        """
+        self.version.bump(bind)
+
+
+class DailyMenu(object):
+    """
+    Foods available on given day grouped by type and company.
+    """
+
+    def __init__(self, foods):
+        """
+        Splits foods into standard menu and daily foods of each company.
+        """
+        self.standard = []
+        self.daily_foods = []
+        self.companies = {}
+        for food in foods:
+            if food.o_type == 'menu':
+                self.standard.append(food)
+            else:
+                self.daily_foods.append(food)
+                self.companies.setdefault(food.company, []).append(food)
+
+    def daily(self, company):
+        """
+        Returns foods of company which are not from standard menu.
+        """
+        return self.companies.get(company, [])
+
+
+class DailyMenuCache(object):
+    """
+    Cache of foods available on given day.
+    """
+
+    def __init__(self, version):
+        """
+        Inits empty cache.
+        """
+        self.version = version
+        self.menus = {}
+        self.menus_version = None
+
+    def get(self, day):
+        """
+        Returns cached menu of given day.
+        """
+        version = self.version.get()
+        if version != self.menus_version:
+            self.menus = {}
+            self.menus_version = version
+        menu = self.menus.get(day)
+        cache_lookup('menu', menu is not None)
+        if menu is None:
+            day_from = datetime.datetime.combine(day, datetime.time(23, 59))
+            day_to = datetime.datetime.combine(day, datetime.time(0, 0))
+            foods = Food.query.filter(
+                and_(
+                    Food.date_available_from <= day_from,
+                    Food.date_available_to >= day_to,
+                )
+            ).order_by(Food.id).all()
+            menu = DailyMenu([CachedRow(food) for food in foods])
+            # menus of past days are not needed any more
+            self.menus = {day: menu}
+        return menu
+
+    def invalidate(self, bind=None):
+        """
+        Drops cached menus in all processes using db of bind.
+        """
+        self.version.bump(bind)
+
+
+class RenderedSnapshot(object):
+    """
+    Rendered page kept until data it shows changes.
+    """
+
+    def __init__(self, version):
+        """
+        Inits empty snapshot.
+        """
+        self.version = version
+        self.key = None
+        self.etag = None
+        self.body = None
+
+    def get(self, key, render):
+        """
+        Returns ETag and body of page for key, render is called
+        only when data changed since last call.
+        """
+        version = self.version.get()
+        cache_lookup('orders_snapshot', (version, key) == self.key)
+        if (version, key) != self.key:
+            self.body = render()
+            # same in all workers, as version token is shared
+            self.etag = sha1(
+                '{}:{}'.format(version, key).encode(),
+            ).hexdigest()
+            self.key = (version, key)
+        return self.etag, self.body
+
+    def invalidate(self, bind=None):
+        """
+        Drops snapshots in all processes using db of bind.
+        """
+        self.version.bump(bind)
+
+
+settings_cache = SingletonCache(SharedVersion('settings_version'))
+menu_cache = DailyMenuCache(SharedVersion('menu_version'))
+orders_snapshot = RenderedSnapshot(SharedVersion('orders_version'))
+CACHED_MODELS = {
+    MailText: settings_cache,
+    OrderingInfo: settings_cache,
+    Food: menu_cache,
+    Order: orders_snapshot,
+}
+
+
+def get_mail_text():
+    """
+    Returns cached mail texts.
+    """
+    return settings_cache.get(MailText)
+
+
+def get_ordering_info():
+    """
+    Returns cached ordering availability.
+    """
+    return settings_cache.get(OrderingInfo)
+
+
+def get_menu(day):
+    """
+    Returns cached foods available on given day.
+    """
+    return menu_cache.get(day)
+
+
+def get_orders_snapshot(day, render):
+    """
+    Returns ETag and cached page with orders of given day.
+    """
+    return orders_snapshot.get(day, render)
+
+
+def _cached_row_changed(mapper, connection, target):
+    """
+    Marks caches of rows modified by session.
+    """
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_caches', set()).add(
+            CACHED_MODELS[type(target)]
+        )
+
+
+def _invalidate_after_commit(session):
+    """
+    Invalidates caches of rows changed by committed session.
+    """
+    for cache in session.info.pop('changed_caches', ()):
+        cache.invalidate(session.get_bind())
+
+
+def _forget_after_rollback(session):
+    """
+    Forgets changes which were rolled back.
+    """
+    session.info.pop('changed_caches', None)
+
+
+for cached_model in CACHED_MODELS:
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(cached_model, event_name, _cached_row_changed)
+event.listen(Session, 'after_commit', _invalidate_after_commit)
+event.listen(Session, 'after_rollback', _forget_after_rollback)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Optimistic concurrency control of versioned rows.
+"""
+import random
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+
+from .main import app, db
+
+RETRY_ATTEMPTS = 5
+# seconds, grows with every attempt and is randomized so writers spread out
+RETRY_DELAY = 0.01
+
+
+class ConflictError(Exception):
+    """
+    Row kept being changed by other transactions.
+    """
+
+
+def _is_conflict(error):
+    """
+    Returns true when transaction failed because of other transaction,
+    SQLite refuses to wait for lock longer than its timeout.
+    """
+    if isinstance(error, StaleDataError):
+        return True
+    return isinstance(error, OperationalError) and \
+        'database is locked' in str(error.orig)
+
+
+def retry_on_conflict(change, attempts=None, session=None):
+    """
+    Runs change and commits. When other transaction updated the same
+    versioned row meanwhile or held the database locked for too long,
+    rolls back and runs change again on fresh rows. Returns result
+    of change.
+    """
+    session = session or db.session
+    attempts = attempts or app.config.get(
+        'CONFLICT_RETRY_ATTEMPTS',
+        RETRY_ATTEMPTS,
+    )
+    for attempt in range(attempts):
+        try:
+            result = change()
+            session.commit()
+            return result
+        except Exception as error:
+            # rollback expires loaded rows, next attempt reads them again
+            session.rollback()
+            if not _is_conflict(error):
+                raise
+            time.sleep(random.uniform(0, RETRY_DELAY * (attempt + 1)))
+    raise ConflictError(
+        'Data was changed by someone else, please try again.'
+    )
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Order events streamed to dashboards as server-sent events.
+"""
+import json
+import threading
+import time
+
+from sqlalchemy import func
+
+from .cache import orders_snapshot
+from .main import app, db
+from .models import OrderEvent
+
+STREAM_TIMEOUT = 25
+POLL_INTERVAL = 1
+# db is checked at least this often even when shared version did not change
+MAX_POLL_DELAY = 10
+KEEPALIVE = 15
+BATCH_SIZE = 100
+# every open stream holds a uWSGI thread, threads above this limit are
+# left for other requests, see [uwsgi] in buildout.cfg
+MAX_STREAMS = 4
+# browsers over the limit reconnect after this many milliseconds
+BUSY_RETRY = 30000
+
+
+class StreamSlots(object):
+    """
+    Counts streams open in this process.
+    """
+
+    def __init__(self):
+        """
+        Inits counter without open streams.
+        """
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def acquire(self, limit):
+        """
+        Takes slot and returns True, or False when limit is reached.
+        """
+        with self.lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def release(self):
+        """
+        Frees slot of closed stream.
+        """
+        with self.lock:
+            self.count -= 1
+
+
+stream_slots = StreamSlots()
+
+
+def order_data(order):
+    """
+    Returns order fields shown on dashboards.
+    """
+    return {
+        'id': order.id,
+        'user_name': order.user_name,
+        'company': order.company,
+        'arrival_time': order.arrival_time,
+        'description': order.description,
+        'cost': order.cost,
+        'date': order.date.isoformat() if order.date else None,
+    }
+
+
+def log_order_event(kind, order):
+    """
+    Adds event about order to session, so it is committed together
+    with the order. New orders are flushed to get their id.
+    """
+    if order.id is None:
+        db.session.flush()
+    event = OrderEvent()
+    event.kind = kind
+    event.order_id = order.id
+    event.data = json.dumps(order_data(order))
+    db.session.add(event)
+    return event
+
+
+def last_event_id():
+    """
+    Returns id of newest event or 0.
+    """
+    return db.session.query(func.max(OrderEvent.id)).scalar() or 0
+
+
+def format_event(event):
+    """
+    Returns event in server-sent events format.
+    """
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event.id,
+        event.kind,
+        event.data,
+    )
+
+
+def stream_order_events(cursor, timeout=None):
+    """
+    Yields events newer than cursor until timeout, browser reconnects
+    afterwards with Last-Event-ID. Workers share the order version,
+    so db is queried only when orders were changed. When process
+    already has ORDER_EVENTS_MAX_STREAMS open, browser is told to
+    reconnect later, so streams do not take all threads.
+    """
+    limit = app.config.get('ORDER_EVENTS_MAX_STREAMS', MAX_STREAMS)
+    if not stream_slots.acquire(limit):
+        yield 'retry: {}\n\n'.format(
+            app.config.get('ORDER_EVENTS_BUSY_RETRY', BUSY_RETRY),
+        )
+        return
+    try:
+        for chunk in _order_events(cursor, timeout):
+            yield chunk
+    finally:
+        stream_slots.release()
+
+
+def _order_events(cursor, timeout):
+    """
+    Yields events newer than cursor until timeout.
+    """
+    timeout = app.config.get('ORDER_EVENTS_TIMEOUT', STREAM_TIMEOUT) \
+        if timeout is None else timeout
+    interval = app.config.get('ORDER_EVENTS_POLL_INTERVAL', POLL_INTERVAL)
+    deadline = time.time() + timeout
+    version = None
+    last_poll = last_output = time.time()
+    yield 'retry: 3000\n\n'
+    while True:
+        current_version = orders_snapshot.version.get()
+        now = time.time()
+        if current_version != version or now - last_poll >= MAX_POLL_DELAY:
+            version = current_version
+            last_poll = now
+            events = OrderEvent.query.filter(
+                OrderEvent.id > cursor,
+            ).order_by(OrderEvent.id).limit(BATCH_SIZE).all()
+            # do not keep transaction open between polls
+            db.session.rollback()
+            for event in events:
+                cursor = event.id
+                last_output = now
+                yield format_event(event)
+            if len(events) == BATCH_SIZE:
+                # more events are waiting
+                version = None
+                continue
+        if now >= deadline:
+            return
+        if now - last_output >= KEEPALIVE:
+            last_output = now
+            yield ': keepalive\n\n'
+        time.sleep(interval)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Streaming exports of orders and finance data.
+"""
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import and_, extract, func
+
+from .main import db
+from .models import Order, Finance
+from .utils import month_begin_end
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+}
+YIELD_PER = 500
+ORDER_HEADER = (
+    'id',
+    'date',
+    'user_name',
+    'company',
+    'arrival_time',
+    'description',
+    'cost',
+)
+USER_TOTALS_HEADER = (
+    'user_name',
+    'year',
+    'month',
+    'number_of_orders',
+    'total_cost',
+    'did_user_pay',
+)
+
+
+def period(year, month=None):
+    """
+    Returns first and last moment of month or whole year.
+    """
+    if month is not None:
+        return month_begin_end(year, month)
+    return (
+        datetime.datetime(year, 1, 1, 0, 0, 0),
+        datetime.datetime(year, 12, 31, 23, 59, 59),
+    )
+
+
+def _stream(query):
+    """
+    Returns rows of query fetched in batches, server side cursor is used
+    where database supports it.
+    """
+    return query.execution_options(stream_results=True).yield_per(YIELD_PER)
+
+
+def order_rows(year, month=None, company=None):
+    """
+    Yields orders of month or year as tuples in ORDER_HEADER order.
+    """
+    query = Order.in_range(
+        *period(year, month),
+        query=db.session.query(
+            Order.id,
+            Order.date,
+            Order.user_name,
+            Order.company,
+            Order.arrival_time,
+            Order.description,
+            Order.cost,
+        )
+    )
+    if company:
+        query = query.filter(Order.company == company)
+    return _stream(query.order_by(Order.date, Order.id))
+
+
+def user_total_rows(year, month=None):
+    """
+    Yields number of orders, cost and payment status of every user
+    in every month of period as tuples in USER_TOTALS_HEADER order.
+    """
+    order_month = extract('month', Order.date)
+    orders = Order.in_range(
+        *period(year, month),
+        query=db.session.query(
+            Order.user_name.label('user_name'),
+            order_month.label('month'),
+            func.count(Order.id).label('number_of_orders'),
+            func.sum(Order.cost).label('total_cost'),
+        )
+    ).group_by(Order.user_name, order_month).subquery()
+    paid = db.session.query(
+        Finance.user_name.label('user_name'),
+        Finance.month.label('month'),
+    ).filter(
+        and_(
+            Finance.year == year,
+            Finance.did_user_pay,
+        )
+    ).distinct().subquery()
+    query = db.session.query(
+        orders.c.user_name,
+        orders.c.month,
+        orders.c.number_of_orders,
+        orders.c.total_cost,
+        paid.c.user_name,
+    ).outerjoin(
+        paid,
+        and_(
+            paid.c.user_name == orders.c.user_name,
+            paid.c.month == orders.c.month,
+        ),
+    ).order_by(orders.c.month, orders.c.user_name)
+    for user_name, row_month, count, cost, paid_user in _stream(query):
+        yield (
+            user_name,
+            year,
+            int(row_month),
+            count,
+            cost or 0,
+            paid_user is not None,
+        )
+
+
+def csv_lines(header, rows, batch=YIELD_PER):
+    """
+    Yields CSV text of header and rows in chunks of batch rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % batch == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _json_value(value):
+    """
+    Serializes dates in JSON export.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(value)
+
+
+def json_lines(header, rows):
+    """
+    Yields JSON list of objects made of header and rows one by one.
+    """
+    separator = '[\n'
+    for row in rows:
+        yield separator + json.dumps(
+            dict(zip(header, row)),
+            default=_json_value,
+        )
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+def export_lines(export_format, header, rows):
+    """
+    Yields export of rows in given format.
+    """
+    if export_format == 'csv':
+        return csv_lines(header, rows)
+    return json_lines(header, rows)
@@ -2,10 +2,19 @@
 Fixtures for database.
 """
 from datetime import datetime, date, timedelta
+from os import path
 
 from .main import db
 from .models import Order, Food, User, Finance, MailText, OrderingInfo
 
+# saved restaurant pages, for crawler tests and benchmarks
+TOMAS_PAGE = path.abspath(
+    path.join(path.dirname(__file__), '../../etc/mock_tomas.html')
+)
+KOZIOLEK_PAGE = path.abspath(
+    path.join(path.dirname(__file__), '../../etc/mock_koziolek.html')
+)
+
 
 def allow_ordering():
     """
@@ -113,3 +122,57 @@ def fill_db():
     db.session.add(meal_1)
     db.session.add(meal_2)
     db.session.commit()
+
+
+LOADTEST_DOMAIN = 'loadtest.local'
+LOADTEST_FOODS = (
+    ('Tomas', 'Loadtest zupa pomidorowa', 4, 'daniednia'),
+    ('Tomas', 'Loadtest schabowy z ziemniakami', 10, 'daniednia'),
+    ('Pod Koziołkiem', 'Loadtest pierogi ruskie', 11, 'daniednia'),
+    ('Pod Koziołkiem', 'Loadtest zupa ogórkowa', 2, 'daniednia'),
+)
+
+
+def loadtest_username(number):
+    """
+    Returns username of synthetic load test user.
+    """
+    return 'loadtest{}@{}'.format(number, LOADTEST_DOMAIN)
+
+
+def fill_loadtest_db(number_of_users):
+    """
+    Fill the database with synthetic users and today's meals for
+    load test, first user is admin. Existing records are kept.
+    """
+    if OrderingInfo.query.first() is None:
+        allow_ordering()
+    existing = {
+        username for username, in db.session.query(User.username).filter(
+            User.username.like('%@' + LOADTEST_DOMAIN),
+        )
+    }
+    for number in range(number_of_users):
+        username = loadtest_username(number)
+        if username in existing:
+            continue
+        user = User()
+        user.email = username
+        user.username = username
+        user.admin = number == 0
+        db.session.add(user)
+    has_foods = Food.query.filter(
+        Food.description.like('Loadtest %'),
+        Food.date_available_to >= datetime.now(),
+    ).first() is not None
+    if not has_foods:
+        for company, description, cost, o_type in LOADTEST_FOODS:
+            meal = Food()
+            meal.company = company
+            meal.description = description
+            meal.cost = cost
+            meal.date_available_from = datetime.now() - timedelta(1)
+            meal.date_available_to = datetime.now() + timedelta(1)
+            meal.o_type = o_type
+            db.session.add(meal)
+    db.session.commit()
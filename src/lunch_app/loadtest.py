@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Load test replaying lunchtime traffic of many simulated users.
+"""
+from collections import Counter, OrderedDict
+import http.client
+import math
+import random
+import threading
+import time
+from timeit import default_timer
+from urllib.parse import urlencode, urlsplit
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+from .cache import menu_cache, orders_snapshot
+from .fixtures import (
+    LOADTEST_DOMAIN,
+    LOADTEST_FOODS,
+    fill_loadtest_db,
+    loadtest_username,
+)
+from .main import app, db
+from .models import Food, MonthlyBilling, Order, OrderEvent, User
+
+LOGIN_HEADER = 'X-Loadtest-User'
+# only load generators on these addresses may log in by header
+LOADTEST_ALLOWED_IPS = ('127.0.0.1', '::1')
+REQUEST_TIMEOUT = 30
+# label, method, path, weight, sent by admin
+SCENARIO = (
+    ('GET /order', 'GET', '/order', 30, False),
+    ('POST /order', 'POST', '/order', 15, False),
+    ('GET /random_meal/0', 'GET', '/random_meal/0', 20, False),
+    ('GET /tv', 'GET', '/tv', 25, False),
+    ('GET /day_summary', 'GET', '/day_summary', 10, True),
+)
+PERCENTILES = (50, 95, 99)
+DASHBOARD_LABEL = 'GET /order_events'
+# threads of uWSGI process in buildout.cfg
+SERVER_THREADS = 8
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+    Local server request handler without access log.
+    """
+
+    def log_request(self, *args, **kwargs):
+        """
+        Skips access log line, printing it would slow down the server.
+        """
+
+
+class WorkerServer(ThreadedWSGIServer):
+    """
+    Local server handling at most threads requests at once, like
+    uWSGI process. Other connections wait until a thread is free.
+    """
+
+    def __init__(self, host, port, app, threads, **kwargs):
+        """
+        Inits server with pool of threads.
+        """
+        ThreadedWSGIServer.__init__(self, host, port, app, **kwargs)
+        self.workers = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        """
+        Waits for free thread before handling accepted connection.
+        """
+        self.workers.acquire()
+        ThreadedWSGIServer.process_request(self, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """
+        Handles connection and frees its thread.
+        """
+        try:
+            ThreadedWSGIServer.process_request_thread(
+                self,
+                request,
+                client_address,
+            )
+        finally:
+            self.workers.release()
+
+
+def load_user(request):
+    """
+    Returns synthetic user named in login header or None.
+    Real users can not be impersonated and header is accepted only
+    from LOADTEST_ALLOWED_IPS, not forwarded by proxy.
+    """
+    if request.remote_addr not in app.config.get(
+            'LOADTEST_ALLOWED_IPS', LOADTEST_ALLOWED_IPS):
+        return None
+    if 'X-Forwarded-For' in request.headers:
+        # proxy on the same host forwards requests from anywhere
+        return None
+    username = request.headers.get(LOGIN_HEADER, '')
+    if not username.endswith('@' + LOADTEST_DOMAIN):
+        return None
+    return User.query.filter(User.username == username).first()
+
+
+def percentile(values, percent):
+    """
+    Returns nearest rank percentile of sorted values or None.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class LoadResults(object):
+    """
+    Latencies and errors of requests collected from many threads.
+    """
+
+    def __init__(self):
+        """
+        Inits empty results.
+        """
+        self.lock = threading.Lock()
+        self.latencies = OrderedDict(
+            (label, []) for label, _, _, _, _ in SCENARIO
+        )
+        self.errors = Counter()
+
+    def record(self, label, seconds, ok):
+        """
+        Stores latency of request, failed requests are counted separately.
+        """
+        with self.lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            if not ok:
+                self.errors[label] += 1
+
+    def report(self, elapsed):
+        """
+        Returns number of requests, errors, throughput and latency
+        percentiles in seconds keyed by route.
+        """
+        report = OrderedDict()
+        for label, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            row = OrderedDict([
+                ('requests', len(latencies)),
+                ('errors', self.errors[label]),
+                ('throughput', len(latencies) / elapsed),
+            ])
+            for percent in PERCENTILES:
+                row['p{}'.format(percent)] = percentile(latencies, percent)
+            report[label] = row
+        return report
+
+
+def _order_data(rnd):
+    """
+    Returns order form data of random meal.
+    """
+    company, description, cost, _ = rnd.choice(LOADTEST_FOODS)
+    return urlencode({
+        'description': description,
+        'cost': cost,
+        'company': company,
+        'arrival_time': rnd.choice(('12:00', '13:00')),
+    })
+
+
+def simulate_user(number, url, duration, results, think_time=0):
+    """
+    Sends requests of random routes of scenario as synthetic user
+    for duration seconds. Dashboard reuses ETag of /tv like browser does.
+    """
+    deadline = default_timer() + duration
+    rnd = random.Random(number)
+    target = urlsplit(url)
+    prefix = target.path.rstrip('/')
+    weights = [weight for _, _, _, weight, _ in SCENARIO]
+    etags = {}
+    while default_timer() < deadline:
+        label, method, path, _, admin = rnd.choices(SCENARIO, weights)[0]
+        headers = {
+            LOGIN_HEADER: loadtest_username(0 if admin else number),
+        }
+        body = None
+        if method == 'POST':
+            body = _order_data(rnd)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if path in etags:
+            headers['If-None-Match'] = etags[path]
+        connection = http.client.HTTPConnection(
+            target.hostname,
+            target.port,
+            timeout=REQUEST_TIMEOUT,
+        )
+        start = default_timer()
+        try:
+            connection.request(method, prefix + path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+            if response.getheader('ETag'):
+                etags[path] = response.getheader('ETag')
+        except (OSError, http.client.HTTPException):
+            ok = False
+        finally:
+            connection.close()
+        results.record(label, default_timer() - start, ok)
+        if think_time:
+            time.sleep(rnd.uniform(0, 2 * think_time))
+
+
+def simulate_dashboard(number, url, duration, results):
+    """
+    Keeps order events stream open for duration seconds like dashboard,
+    reconnecting after retry time sent by server. Time to the first
+    line of stream is recorded.
+    """
+    deadline = default_timer() + duration
+    target = urlsplit(url)
+    headers = {LOGIN_HEADER: loadtest_username(number)}
+    while default_timer() < deadline:
+        retry = 3.0
+        connection = http.client.HTTPConnection(
+            target.hostname,
+            target.port,
+            timeout=REQUEST_TIMEOUT,
+        )
+        start = default_timer()
+        try:
+            connection.request(
+                'GET',
+                target.path.rstrip('/') + '/order_events',
+                headers=headers,
+            )
+            response = connection.getresponse()
+            line = response.readline()
+            results.record(
+                DASHBOARD_LABEL,
+                default_timer() - start,
+                response.status < 400,
+            )
+            if line.startswith(b'retry:'):
+                retry = int(line.split(b':')[1]) / 1000.0
+            # stop reading when load ends, server ends stream by timeout
+            connection.sock.settimeout(max(deadline - default_timer(), 0.1))
+            while response.readline():
+                pass
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            connection.close()
+        time.sleep(max(min(retry, deadline - default_timer()), 0))
+
+
+def remove_loadtest_data():
+    """
+    Deletes synthetic users with their orders and meals.
+    """
+    usernames = db.session.query(User.username).filter(
+        User.username.like('%@' + LOADTEST_DOMAIN),
+    ).subquery()
+    order_ids = db.session.query(Order.id).filter(
+        Order.user_name.in_(usernames),
+    ).subquery()
+    OrderEvent.query.filter(OrderEvent.order_id.in_(order_ids)).delete(
+        synchronize_session=False,
+    )
+    # query deletes skip session events, billing is removed with orders
+    MonthlyBilling.query.filter(
+        MonthlyBilling.user_name.in_(usernames),
+    ).delete(synchronize_session=False)
+    Order.query.filter(Order.user_name.in_(usernames)).delete(
+        synchronize_session=False,
+    )
+    Food.query.filter(Food.description.like('Loadtest %')).delete(
+        synchronize_session=False,
+    )
+    User.query.filter(User.username.like('%@' + LOADTEST_DOMAIN)).delete(
+        synchronize_session=False,
+    )
+    db.session.commit()
+    # versions are stored in db, so server processes reload too
+    menu_cache.invalidate()
+    orders_snapshot.invalidate()
+
+
+def run_loadtest(users=20, duration=30, url=None, think_time=0.5,
+                 keep_data=False, dashboards=0, threads=SERVER_THREADS):
+    """
+    Loads app with simulated users and dashboards streaming order
+    events for duration seconds and returns report. Without url app
+    is served by local server with threads like one uWSGI process.
+    Server given by url needs LOADTEST_LOGIN enabled and address
+    of this machine in LOADTEST_ALLOWED_IPS.
+    """
+    fill_loadtest_db(max(users, dashboards))
+    server = None
+    if not url:
+        app.config['LOADTEST_LOGIN'] = True
+        server = WorkerServer(
+            '127.0.0.1',
+            0,
+            app,
+            threads,
+            handler=QuietRequestHandler,
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_port)
+    results = LoadResults()
+    start = default_timer()
+    try:
+        threads = [
+            threading.Thread(
+                target=simulate_user,
+                args=(number, url, duration, results, think_time),
+            )
+            for number in range(users)
+        ] + [
+            threading.Thread(
+                target=simulate_dashboard,
+                args=(number, url, duration, results),
+            )
+            for number in range(dashboards)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        elapsed = default_timer() - start
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if not keep_data:
+            remove_loadtest_data()
+    return results.report(elapsed)
+
+
+def print_report(report):
+    """
+    Prints report as table with latencies in milliseconds.
+    """
+    print('{:<22} {:>8} {:>7} {:>8} {:>9} {:>9} {:>9}'.format(
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+    ))
+    for label, row in report.items():
+        print('{:<22} {:>8} {:>7} {:>8.1f} {} {} {}'.format(
+            label,
+            row['requests'],
+            row['errors'],
+            row['throughput'],
+            *(
+                '{:>9}'.format('-') if row[key] is None
+                else '{:>9.1f}'.format(row[key] * 1000)
+                for key in ('p50', 'p95', 'p99')
+            )
+        ))
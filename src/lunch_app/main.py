@@ -40,6 +40,17 @@ def init_social_login():
         except (TypeError, ValueError):
             pass
 
+    @login_manager.request_loader
+    def load_loadtest_user(request):
+        """
+        Get synthetic load test user named in request header.
+        Works only when LOADTEST_LOGIN is enabled.
+        """
+        if not app.config.get('LOADTEST_LOGIN'):
+            return None
+        from .loadtest import load_user
+        return load_user(request)
+
     @app.before_request
     def global_user():
         """
@@ -66,6 +77,7 @@ def init_api():
     """
     from . import resources
     api.add_resource(resources.Order, '/api/v1/order')
+    api.add_resource(resources.OrderBulk, '/api/v1/order/bulk')
 
 
 def init_admin():
@@ -80,6 +92,32 @@ def init_admin():
     admin.add_view(AdminModelViewWithAuth(models.Finance, db.session))
 
 
+def init_billing():
+    """
+    Keep monthly billing up to date with orders.
+    """
+    from . import billing
+    billing.listen()
+
+
+def init_profiling():
+    """
+    Profile requests on demand.
+    """
+    from .profiling import ProfilerMiddleware, start_admin_profiler
+    if not isinstance(app.wsgi_app, ProfilerMiddleware):
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app)
+        app.before_request(start_admin_profiler)
+
+
+def init_metrics():
+    """
+    Record latency of requests, queries, mail and crawlers.
+    """
+    from . import metrics
+    metrics.listen()
+
+
 def init():
     """
     Configure some elements of application.
@@ -90,6 +128,9 @@ def init():
     init_social_login()
     init_api()
     init_admin()
+    init_billing()
+    init_profiling()
+    init_metrics()
     mail.init_app(app)
 
 
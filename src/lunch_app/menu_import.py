@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Importing restaurant menus into Food table.
+"""
+import datetime
+import logging
+
+from sqlalchemy import and_
+
+from .cache import menu_cache
+from .main import app, db
+from .models import Food
+from .scheduler import run_scheduled, WORKING_DAYS
+from .webcrawler import crawl_all
+
+log = logging.getLogger(__name__)
+
+IMPORT_TIMES = ('07:30', '10:00')
+IMPORT_WEEKDAYS = WORKING_DAYS
+# rows in one INSERT, keeps SQLite under its limit of bound parameters
+INSERT_CHUNK = 150
+
+
+def _day_start(day):
+    """
+    Returns midnight of given day.
+    """
+    return datetime.datetime.combine(day, datetime.time(0, 0))
+
+
+def food_row(company, description, cost, o_type, date_from, date_to):
+    """
+    Returns Food row as dict ready for bulk insert.
+    """
+    return {
+        'company': company,
+        'description': description,
+        'cost': cost,
+        'o_type': o_type,
+        'date_available_from': _day_start(date_from),
+        'date_available_to': _day_start(date_to),
+    }
+
+
+def koziolek_foods(food, day):
+    """
+    Returns Food rows of meals of a day from Pod Koziołkiem.
+    """
+    return [
+        food_row(
+            "Pod Koziołkiem",
+            "Danie dnia Koziołek: " + meal,
+            2 if 'zupa' in meal.lower() else 11,
+            "daniednia",
+            day,
+            day,
+        )
+        for meal in food.values()
+    ]
+
+
+def tomas_foods(foods, monday):
+    """
+    Returns Food rows of week of meals from Tomas starting on monday.
+    """
+    rows = [
+        food_row(
+            "Tomas",
+            meal,
+            12,
+            "tygodniowe",
+            monday,
+            monday + datetime.timedelta(days=4),
+        )
+        for meal in foods['diet']
+    ]
+    for i in range(1, 6):
+        food = foods['dzien_{}'.format(i)]
+        day = monday + datetime.timedelta(days=i-1)
+        for key, cost in (('zupy', 4), ('dania', 10), ('zupa_i_dania', 12)):
+            rows.extend(
+                food_row("Tomas", meal, cost, "daniednia", day, day)
+                for meal in food[key]
+            )
+    return rows
+
+
+def insert_foods(rows):
+    """
+    Inserts Food rows without ORM objects and commits.
+    Server databases get multi row INSERT statements, so chunk of rows
+    takes one round trip. Returns number of inserted foods.
+    """
+    if not rows:
+        return 0
+    if db.engine.dialect.name == 'sqlite':
+        # no round trips to save, executemany beats long statements
+        db.session.execute(Food.__table__.insert(), rows)
+    else:
+        for start in range(0, len(rows), INSERT_CHUNK):
+            db.session.execute(
+                Food.__table__.insert().values(
+                    rows[start:start + INSERT_CHUNK],
+                ),
+            )
+    db.session.commit()
+    # core insert does not trigger mapper events
+    menu_cache.invalidate()
+    return len(rows)
+
+
+def _food_key(row):
+    """
+    Returns values identifying the same food on the same days.
+    """
+    return (
+        row['company'],
+        row['description'],
+        row['date_available_from'],
+        row['date_available_to'],
+    )
+
+
+def store_foods(rows):
+    """
+    Inserts foods which are not in db yet.
+    Returns number of inserted foods.
+    """
+    if not rows:
+        return 0
+    existing = db.session.query(
+        Food.company,
+        Food.description,
+        Food.date_available_from,
+        Food.date_available_to,
+    ).filter(
+        and_(
+            Food.company.in_(list({row['company'] for row in rows})),
+            Food.date_available_from.in_(
+                list({row['date_available_from'] for row in rows})
+            ),
+        )
+    )
+    known = {tuple(food) for food in existing}
+    new_rows = []
+    for row in rows:
+        key = _food_key(row)
+        if key not in known:
+            known.add(key)
+            new_rows.append(row)
+    return insert_foods(new_rows)
+
+
+def import_menus(day=None):
+    """
+    Crawls all restaurants and stores their menus.
+    Weekly Tomas menu is stored from monday of day's week.
+    Returns number of inserted foods and errors keyed by company.
+    """
+    day = day or datetime.date.today()
+    monday = day - datetime.timedelta(days=day.weekday())
+    menus, errors = crawl_all()
+    rows = []
+    if 'Pod Koziołkiem' in menus:
+        rows.extend(koziolek_foods(menus['Pod Koziołkiem'], day))
+    if 'Tomas' in menus:
+        rows.extend(tomas_foods(menus['Tomas'], monday))
+    number_of_foods = store_foods(rows)
+    log.info('Imported %s foods', number_of_foods)
+    for company, error in errors.items():
+        log.error('Importing menu of %s failed: %s', company, error)
+    return number_of_foods, errors
+
+
+def run_scheduler(once=False):
+    """
+    Imports menus at MENU_IMPORT_TIMES on MENU_IMPORT_WEEKDAYS until stopped.
+    """
+    if once:
+        return import_menus()
+    return run_scheduled(
+        import_menus,
+        app.config.get('MENU_IMPORT_TIMES', IMPORT_TIMES),
+        app.config.get('MENU_IMPORT_WEEKDAYS', IMPORT_WEEKDAYS),
+    )
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Runtime metrics exposed in Prometheus text format.
+"""
+import atexit
+from contextlib import contextmanager
+import glob
+import json
+import os
+import threading
+from timeit import default_timer
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .main import app
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds between writes of worker's metrics to METRICS_DIR
+FLUSH_INTERVAL = 5
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# name: (type, help, buckets of histograms)
+METRICS = {
+    'lunch_http_requests_total': (
+        'counter',
+        'Finished HTTP requests.',
+        None,
+    ),
+    'lunch_http_request_duration_seconds': (
+        'histogram',
+        'Time spent handling HTTP requests.',
+        LATENCY_BUCKETS,
+    ),
+    'lunch_sql_queries_per_request': (
+        'histogram',
+        'SQL queries executed while handling HTTP request.',
+        QUERY_BUCKETS,
+    ),
+    'lunch_sql_queries_total': (
+        'counter',
+        'Executed SQL queries.',
+        None,
+    ),
+    'lunch_sql_query_seconds_total': (
+        'counter',
+        'Time spent executing SQL queries.',
+        None,
+    ),
+    'lunch_smtp_send_duration_seconds': (
+        'histogram',
+        'Time spent sending mail messages over SMTP.',
+        LATENCY_BUCKETS,
+    ),
+    'lunch_crawler_fetch_duration_seconds': (
+        'histogram',
+        'Time spent fetching restaurant web pages.',
+        LATENCY_BUCKETS,
+    ),
+    'lunch_cache_requests_total': (
+        'counter',
+        'Cache lookups, hit ratio is hit / (hit + miss).',
+        None,
+    ),
+}
+
+
+class Registry(object):
+    """
+    Metrics of this process. With directory set they are periodically
+    written to file of the process, so metrics of all uWSGI workers
+    and daemons can be merged by whichever worker is scraped.
+    """
+
+    def __init__(self):
+        """
+        Inits empty registry.
+        """
+        self.lock = threading.Lock()
+        self.values = {}
+        self.pid = os.getpid()
+        self.flushed = default_timer()
+
+    def _reset_after_fork(self):
+        """
+        Forgets metrics copied from parent process.
+        """
+        if os.getpid() != self.pid:
+            self.values = {}
+            self.pid = os.getpid()
+
+    def inc(self, name, labels, value=1):
+        """
+        Adds value to counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._reset_after_fork()
+            self.values[key] = self.values.get(key, 0) + value
+        self.flush_if_due()
+
+    def observe(self, name, labels, value):
+        """
+        Adds value to histogram. Stored as cumulative bucket counts
+        followed by sum and count.
+        """
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._reset_after_fork()
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(buckets) + 2)
+            for number, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[number] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        self.flush_if_due()
+
+    def snapshot(self):
+        """
+        Returns copy of metrics of this process.
+        """
+        with self.lock:
+            self._reset_after_fork()
+            return {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in self.values.items()
+            }
+
+    def path(self, directory):
+        """
+        Returns path of file with metrics of this process.
+        """
+        return os.path.join(directory, '{}.json'.format(os.getpid()))
+
+    def flush(self, directory=None):
+        """
+        Writes metrics of this process to its file in directory.
+        """
+        directory = directory or app.config.get('METRICS_DIR')
+        if not directory:
+            return
+        self.flushed = default_timer()
+        data = [
+            [name, list(labels), value]
+            for (name, labels), value in self.snapshot().items()
+        ]
+        os.makedirs(directory, exist_ok=True)
+        path = self.path(directory)
+        with open(path + '.tmp', 'w') as output:
+            json.dump(data, output)
+        # readers never see half written file
+        os.replace(path + '.tmp', path)
+
+    def flush_if_due(self):
+        """
+        Writes metrics when last write is older than flush interval.
+        """
+        interval = app.config.get('METRICS_FLUSH_INTERVAL', FLUSH_INTERVAL)
+        if default_timer() - self.flushed >= interval:
+            self.flush()
+
+    def collect(self, directory=None):
+        """
+        Returns metrics of this process merged with metrics written
+        by other processes to directory.
+        """
+        directory = directory or app.config.get('METRICS_DIR')
+        values = self.snapshot()
+        if not directory:
+            return values
+        own_path = self.path(directory)
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            if path == own_path:
+                continue
+            try:
+                with open(path) as source:
+                    data = json.load(source)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                if name not in METRICS:
+                    continue
+                _merge(values, (name, tuple(map(tuple, labels))), value)
+        return values
+
+
+def _merge(values, key, value):
+    """
+    Adds counter or histogram value to values.
+    """
+    current = values.get(key)
+    if current is None:
+        values[key] = value
+    elif isinstance(current, list):
+        values[key] = [old + new for old, new in zip(current, value)]
+    else:
+        values[key] = current + value
+
+
+def _escape(value):
+    """
+    Escapes label value.
+    """
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n',
+    )
+
+
+def _labels(labels):
+    """
+    Returns labels in exposition format.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in labels
+    ) + '}'
+
+
+def _number(value):
+    """
+    Returns number in exposition format.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def exposition(values):
+    """
+    Returns metrics in Prometheus text format.
+    """
+    lines = []
+    for name in sorted(METRICS):
+        metric_type, help_text, buckets = METRICS[name]
+        series = sorted(
+            (labels, value) for (key_name, labels), value in values.items()
+            if key_name == name
+        )
+        if not series:
+            continue
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for labels, value in series:
+            if metric_type == 'counter':
+                lines.append('{}{} {}'.format(
+                    name, _labels(labels), _number(value),
+                ))
+                continue
+            for bound, count in zip(buckets + ('+Inf',), value[:-2] +
+                                    [value[-1]]):
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    _labels(labels + (('le', _number(bound)),)),
+                    count,
+                ))
+            lines.append('{}_sum{} {}'.format(
+                name, _labels(labels), _number(value[-2]),
+            ))
+            lines.append('{}_count{} {}'.format(
+                name, _labels(labels), value[-1],
+            ))
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Observes duration of block in histogram. Label status is ok unless
+    block changes it in yielded labels, or error when block raises.
+    """
+    labels.setdefault('status', 'ok')
+    start = default_timer()
+    try:
+        yield labels
+    except Exception:
+        labels['status'] = 'error'
+        raise
+    finally:
+        registry.observe(name, labels, default_timer() - start)
+
+
+def cache_lookup(cache, hit):
+    """
+    Counts hit or miss of cache.
+    """
+    registry.inc(
+        'lunch_cache_requests_total',
+        {'cache': cache, 'result': 'hit' if hit else 'miss'},
+    )
+
+
+def _endpoint():
+    """
+    Returns endpoint of current request, or none outside of requests.
+    """
+    if not has_request_context():
+        return 'none'
+    return request.endpoint or 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    """
+    Remembers start of query.
+    """
+    conn.info.setdefault('metrics_query_start', []).append(default_timer())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """
+    Counts query and its time, also in request being handled.
+    """
+    elapsed = default_timer() - conn.info['metrics_query_start'].pop()
+    labels = {'endpoint': _endpoint()}
+    registry.inc('lunch_sql_queries_total', labels)
+    registry.inc('lunch_sql_query_seconds_total', labels, elapsed)
+    if has_request_context():
+        g.metrics_queries = g.get('metrics_queries', 0) + 1
+
+
+def _forget_failed_query(context):
+    """
+    Drops start of query which raised.
+    """
+    if context.connection is not None:
+        starts = context.connection.info.get('metrics_query_start')
+        if starts:
+            starts.pop()
+
+
+def start_request_timer():
+    """
+    Remembers start of request.
+    """
+    g.metrics_start = default_timer()
+    g.metrics_queries = 0
+
+
+def record_request(response):
+    """
+    Observes latency and number of queries of finished request.
+    """
+    _record_request(response.status_code)
+    return response
+
+
+def record_failed_request(error):
+    """
+    Observes request ended by unhandled exception.
+    """
+    if error is not None:
+        _record_request(500)
+
+
+def _record_request(status):
+    """
+    Observes request once.
+    """
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    endpoint = _endpoint()
+    registry.inc('lunch_http_requests_total', {
+        'endpoint': endpoint,
+        'method': request.method,
+        'status': status,
+    })
+    registry.observe(
+        'lunch_http_request_duration_seconds',
+        {'endpoint': endpoint},
+        default_timer() - start,
+    )
+    registry.observe(
+        'lunch_sql_queries_per_request',
+        {'endpoint': endpoint},
+        g.get('metrics_queries', 0),
+    )
+
+
+def listen():
+    """
+    Starts recording of requests and queries.
+    """
+    if event.contains(Engine, 'before_cursor_execute',
+                      _before_cursor_execute):
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _forget_failed_query)
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+    app.teardown_request(record_failed_request)
+    atexit.register(registry.flush)
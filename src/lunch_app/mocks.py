@@ -2,8 +2,16 @@
 """
 mock for tests
 """
+from email.utils import formatdate
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock
-from os import path
+import socket
+import threading
+import time
+
+from .fixtures import KOZIOLEK_PAGE, TOMAS_PAGE
+from .main import app, mail
 
 MOCK_ADMIN = Mock()
 MOCK_ADMIN.is_admin.return_value = True
@@ -125,16 +133,118 @@ MOCK_DATA_TOMAS.return_value = {
     }
 }
 
-MOCK_WWW_TOMAS = Mock()
-MOCK_WWW_TOMAS.return_value = open(
-    path.abspath(
-        path.join(path.dirname(__file__), '../../etc/mock_tomas.html')
-    )
-)
-
-MOCK_WWW_KOZIOLEK = Mock()
-MOCK_WWW_KOZIOLEK.return_value = open(
-    path.abspath(
-        path.join(path.dirname(__file__), '../../etc/mock_koziolek.html')
-    )
-)
+MOCK_WWW_TOMAS = TOMAS_PAGE
+MOCK_WWW_KOZIOLEK = KOZIOLEK_PAGE
+
+
+class LocalHTTPServer(object):
+    """
+    Local HTTP server serving given file with ETag and Last-Modified
+    validators. Counts requests and answers conditional GET with 304.
+    """
+
+    def __init__(self, file_path, delay=0):
+        """
+        Prepares server on free local port, delay slows down every response.
+        """
+        with open(file_path, 'rb') as served_file:
+            self.content = served_file.read()
+        self.etag = '"{}"'.format(sha1(self.content).hexdigest())
+        self.last_modified = formatdate(usegmt=True)
+        self.delay = delay
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serves content of file.
+            """
+
+            def do_GET(self):
+                """
+                Sends file or 304 when client has the current version.
+                """
+                server.requests.append(dict(self.headers))
+                time.sleep(server.delay)
+                if self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', len(server.content))
+                self.send_header('ETag', server.etag)
+                self.send_header('Last-Modified', server.last_modified)
+                self.end_headers()
+                self.wfile.write(server.content)
+
+            def log_message(self, *args):
+                """
+                Keeps test output clean.
+                """
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        """
+        Starts server.
+        """
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Stops server.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class LocalSMTPServer(object):
+    """
+    Local SMTP server collecting messages in memory, requires aiosmtpd.
+    While active app sends mails to it instead of configured server.
+    """
+
+    def __init__(self):
+        """
+        Prepares server on free local port.
+        """
+        from aiosmtpd.controller import Controller
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.messages = []
+        self.controller = Controller(self, hostname='127.0.0.1', port=self.port)
+        self.mail_state = None
+
+    async def handle_DATA(self, server, session, envelope):
+        """
+        Stores received message.
+        """
+        self.messages.append(envelope)
+        return '250 OK'
+
+    def __enter__(self):
+        """
+        Starts server and points app mail to it.
+        """
+        self.controller.start()
+        self.mail_state = app.extensions['mail']
+        app.extensions['mail'] = mail.init_mail({
+            'MAIL_SERVER': '127.0.0.1',
+            'MAIL_PORT': self.port,
+            'MAIL_DEFAULT_SENDER': 'lunch@localhost',
+        })
+        return self
+
+    def __exit__(self, *exc_info):
+        """
+        Stops server and restores app mail.
+        """
+        app.extensions['mail'] = self.mail_state
+        self.controller.stop()
@@ -8,15 +8,15 @@ from datetime import datetime
 
 from flask.ext.login import UserMixin
 
-from sqlalchemy import Column
+from sqlalchemy import Column, UniqueConstraint, and_
 from sqlalchemy.types import (
     Integer, String, Boolean,
     Unicode, DateTime, Float,
-    PickleType,
+    Text,
 )
-from sqlalchemy.ext.mutable import MutableDict
 
 from .main import db
+from .utils import day_begin_end, month_begin_end
 
 
 class User(db.Model, UserMixin):
@@ -57,6 +57,13 @@ class Order(db.Model):
     Order model for lunch app db.
     """
     __tablename__ = 'order'
+    __table_args__ = (
+        db.Index(
+            'ix_order_date_company_arrival_time',
+            'date', 'company', 'arrival_time',
+        ),
+        db.Index('ix_order_user_name_date', 'user_name', 'date'),
+    )
     id = Column(Integer, primary_key=True)
     description = Column(String(800), unique=False)
     cost = Column(Float)
@@ -87,6 +94,44 @@ class Order(db.Model):
         """
         return '<Order %r>' % self.id
 
+    @classmethod
+    def in_range(cls, date_from, date_to, query=None):
+        """
+        Returns query for orders made between given dates.
+        Optional query allows to select columns or aggregates instead
+        of whole orders.
+        """
+        query = cls.query if query is None else query
+        return query.filter(
+            and_(
+                cls.date >= date_from,
+                cls.date <= date_to,
+            )
+        )
+
+    @classmethod
+    def for_day(cls, day, query=None):
+        """
+        Returns query for orders made on given day.
+        """
+        return cls.in_range(*day_begin_end(day), query=query)
+
+    @classmethod
+    def for_month(cls, year, month, query=None):
+        """
+        Returns query for orders made in given month.
+        """
+        return cls.in_range(*month_begin_end(year, month), query=query)
+
+    @classmethod
+    def for_user_in_range(cls, user_name, date_from, date_to, query=None):
+        """
+        Returns query for user orders made between given dates.
+        """
+        return cls.in_range(date_from, date_to, query=query).filter(
+            cls.user_name == user_name,
+        )
+
 
 class Food(db.Model):
     """
@@ -112,6 +157,27 @@ class Finance(db.Model):
     month = Column(Integer)
     year = Column(Integer)
     did_user_pay = Column(Boolean, default=False)
+    version_id = Column(Integer, nullable=False)
+    __mapper_args__ = {'version_id_col': version_id}
+
+
+class MonthlyBilling(db.Model):
+    """
+    Number and cost of user's orders from company in month,
+    kept up to date with orders by billing module.
+    """
+    __tablename__ = 'monthly_billing'
+    __table_args__ = (
+        UniqueConstraint('user_name', 'year', 'month', 'company'),
+        db.Index('ix_monthly_billing_year_month', 'year', 'month'),
+    )
+    id = Column(Integer, primary_key=True)
+    user_name = Column(String(80), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    company = Column(String(80), nullable=False, default='')
+    orders_count = Column(Integer, nullable=False, default=0)
+    total_cost = Column(Float, nullable=False, default=0)
 
 
 class MailText(db.Model):
@@ -130,6 +196,15 @@ class MailText(db.Model):
     ordering_is_blocked_text = Column(String(800))
 
 
+class CacheVersion(db.Model):
+    """
+    Version token of cached data, shared by all processes.
+    """
+    __tablename__ = 'cache_version'
+    name = Column(String(50), primary_key=True)
+    token = Column(String(32), nullable=False)
+
+
 class OrderingInfo(db.Model):
     """
     Ordering availability control.
@@ -137,6 +212,8 @@ class OrderingInfo(db.Model):
     __tablename__ = 'ordering_info'
     id = Column(Integer, primary_key=True)
     is_allowed = Column(Boolean, default=True)
+    version_id = Column(Integer, nullable=False)
+    __mapper_args__ = {'version_id_col': version_id}
 
 
 class Pizza(db.Model):
@@ -147,6 +224,51 @@ class Pizza(db.Model):
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=datetime.utcnow)
     pizza_ordering_is_allowed = Column(Boolean, default=False)
-    ordered_pizzas = Column(MutableDict.as_mutable(PickleType))
-    users_already_ordered = Column(String(5000))
     who_created = Column(String(100))
+    version_id = Column(Integer, nullable=False)
+    __mapper_args__ = {'version_id_col': version_id}
+
+
+class PizzaOrder(db.Model):
+    """
+    Pizza ordered by user during pizza event, one per user.
+    """
+    __tablename__ = 'pizza_order'
+    __table_args__ = (
+        UniqueConstraint('event_id', 'user_name'),
+    )
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, db.ForeignKey('pizza.id'), nullable=False)
+    user_name = Column(String(100), nullable=False)
+    pizza = Column(String(1000))
+    size = Column(String(20))
+    date = Column(DateTime, default=datetime.utcnow)
+
+
+class MailOutbox(db.Model):
+    """
+    Mail messages waiting to be sent by mail worker.
+    """
+    __tablename__ = 'mail_outbox'
+    id = Column(Integer, primary_key=True)
+    subject = Column(String(400))
+    sender = Column(String(200))
+    recipients = Column(Text)
+    body = Column(Text)
+    created = Column(DateTime, default=datetime.utcnow)
+    send_after = Column(DateTime, default=datetime.utcnow, index=True)
+    attempts = Column(Integer, default=0)
+    sent = Column(DateTime, index=True)
+    last_error = Column(String(800))
+
+
+class OrderEvent(db.Model):
+    """
+    Log of order changes streamed to dashboards, id is the cursor.
+    """
+    __tablename__ = 'order_event'
+    id = Column(Integer, primary_key=True)
+    created = Column(DateTime, default=datetime.utcnow)
+    kind = Column(String(20))
+    order_id = Column(Integer)
+    data = Column(Text)
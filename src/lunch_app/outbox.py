@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Outgoing mail queue.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import logging
+import smtplib
+import time
+
+from flask.ext.mail import Message
+from sqlalchemy import and_
+
+from .main import app, db, mail
+from .metrics import timed
+from .models import MailOutbox
+
+log = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60
+BATCH_SIZE = 50
+BULK_BATCH_SIZE = 20
+
+
+def _outbox_record(msg):
+    """
+    Adds message to outbox without committing.
+    """
+    queued = MailOutbox()
+    queued.subject = msg.subject
+    queued.sender = msg.sender
+    queued.recipients = '\n'.join(msg.recipients)
+    queued.body = msg.body
+    db.session.add(queued)
+    return queued
+
+
+def queue_mail(msg):
+    """
+    Stores message in outbox, it will be sent by mail worker once
+    caller commits.
+    """
+    queued = _outbox_record(msg)
+    db.session.flush()
+    return queued
+
+
+def send_mail(msg):
+    """
+    Sends message or queues it when MAIL_OUTBOX is enabled, queued
+    message has to be committed by caller.
+    """
+    if app.config.get('MAIL_OUTBOX'):
+        queue_mail(msg)
+    else:
+        with timed('lunch_smtp_send_duration_seconds'):
+            mail.send(msg)
+
+
+def _send_over_connection(messages):
+    """
+    Sends messages using one SMTP connection.
+    Yields error of each message as soon as it is sent, None for
+    sent ones.
+    """
+    done = 0
+    try:
+        with mail.connect() as connection:
+            for msg in messages:
+                try:
+                    with timed('lunch_smtp_send_duration_seconds'):
+                        connection.send(msg)
+                except Exception as error:  # pylint: disable=broad-except
+                    # e.g. BadHeaderError, one bad message must not
+                    # stop the others
+                    error_of_message = error
+                else:
+                    error_of_message = None
+                done += 1
+                yield error_of_message
+    except (smtplib.SMTPException, OSError) as error:
+        # could not connect, every not sent message failed
+        for _ in range(len(messages) - done):
+            yield error
+
+
+def send_bulk(messages, batch_size=None):
+    """
+    Sends messages in batches, each batch over one SMTP connection.
+    Messages are only queued when MAIL_OUTBOX is enabled, then caller
+    has to commit them. Returns status of every message keyed by its
+    recipients.
+    """
+    status = OrderedDict()
+    if app.config.get('MAIL_OUTBOX'):
+        for msg in messages:
+            _outbox_record(msg)
+            status[', '.join(msg.recipients)] = {
+                'status': 'queued',
+                'error': None,
+            }
+        db.session.flush()
+        return status
+    batch_size = batch_size or app.config.get(
+        'MAIL_BULK_BATCH_SIZE',
+        BULK_BATCH_SIZE,
+    )
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        for msg, error in zip(batch, _send_over_connection(batch)):
+            if error is not None:
+                log.warning(
+                    'Sending mail to %s failed: %s',
+                    ', '.join(msg.recipients),
+                    error,
+                )
+            status[', '.join(msg.recipients)] = {
+                'status': 'sent' if error is None else 'failed',
+                'error': str(error) if error is not None else None,
+            }
+    return status
+
+
+def _message(queued):
+    """
+    Builds message from outbox record.
+    """
+    return Message(
+        queued.subject,
+        recipients=queued.recipients.split('\n'),
+        body=queued.body,
+        sender=queued.sender,
+    )
+
+
+def _failed(queued, error):
+    """
+    Schedules next attempt of sending message using exponential backoff.
+    """
+    queued.attempts += 1
+    queued.last_error = str(error)[:800]
+    delay = app.config.get('MAIL_OUTBOX_RETRY_DELAY', RETRY_DELAY)
+    queued.send_after = datetime.utcnow() + timedelta(
+        seconds=delay * 2 ** (queued.attempts - 1),
+    )
+    log.warning(
+        'Sending mail %s failed (attempt %s): %s',
+        queued.id,
+        queued.attempts,
+        error,
+    )
+
+
+def send_queued(limit=None):
+    """
+    Sends messages which are due using one SMTP connection. Result of
+    every message is committed right after sending it, so sent messages
+    are not sent again when worker stops in the middle of batch.
+    Returns number of messages sent.
+    """
+    limit = limit or app.config.get('MAIL_OUTBOX_BATCH_SIZE', BATCH_SIZE)
+    max_attempts = app.config.get('MAIL_OUTBOX_MAX_ATTEMPTS', MAX_ATTEMPTS)
+    due = MailOutbox.query.filter(
+        and_(
+            MailOutbox.sent.is_(None),
+            MailOutbox.send_after <= datetime.utcnow(),
+            MailOutbox.attempts < max_attempts,
+        )
+    ).order_by(MailOutbox.id).limit(limit).all()
+    if not due:
+        return 0
+    number_of_sent = 0
+    errors = _send_over_connection([_message(queued) for queued in due])
+    for queued, error in zip(due, errors):
+        if error is None:
+            queued.sent = datetime.utcnow()
+            number_of_sent += 1
+        else:
+            _failed(queued, error)
+        db.session.commit()
+    return number_of_sent
+
+
+def run_worker(interval=5, once=False):
+    """
+    Sends queued messages until stopped, sleeps when outbox is empty.
+    """
+    while True:
+        try:
+            number_of_sent = send_queued()
+        except Exception:  # pylint: disable=broad-except
+            # database or connection trouble, messages stay queued
+            log.exception('Sending queued mail failed')
+            db.session.rollback()
+            if once:
+                raise
+            number_of_sent = 0
+        if once:
+            return number_of_sent
+        if not number_of_sent:
+            time.sleep(interval)
@@ -9,6 +9,13 @@ from flask.ext.login import current_user
 from flask.ext.admin.contrib.sqla import ModelView
 
 
+def is_admin(user):
+    """
+    Return True when user is logged in admin.
+    """
+    return not user.is_anonymous() and user.is_admin()
+
+
 def user_is_admin(func):
     """
     Wraper for if users is admin decorator
@@ -18,7 +25,7 @@ def user_is_admin(func):
         """
         Checks if users is admin decorator
         """
-        if current_user.is_anonymous() or not current_user.is_admin():
+        if not is_admin(current_user):
             flash("You shell not pass")
             abort(401)
         else:
@@ -35,4 +42,4 @@ class AdminModelViewWithAuth(ModelView):
         """
         Return True when user can access Admin.
         """
-        return not current_user.is_anonymous() and current_user.is_admin()
+        return is_admin(current_user)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Profiling of single requests with cProfile.
+"""
+from collections import Counter
+import cProfile
+import datetime
+import os
+import pstats
+import re
+from timeit import default_timer
+
+from flask import request
+from flask.ext.login import current_user
+from werkzeug.wsgi import ClosingIterator
+
+from .permissions import is_admin
+
+PROFILE_HEADER = 'X-Profile'
+PROFILER_KEY = 'lunch_app.profiler'
+# set once profiler requested in header is enabled for admin
+PROFILING_KEY = 'lunch_app.profiling'
+# set by callers profiling the whole request themselves
+PROFILED_KEY = 'lunch_app.profiled'
+PROFILE_DIR = os.path.join('var', 'profiles')
+# stacks shorter than that are left out of collapsed output, in seconds
+MIN_STACK_TIME = 0.000001
+
+
+class ProfilerMiddleware(object):
+    """
+    Runs requests under cProfile and saves the results. Every request
+    is profiled when PROFILE_REQUESTS is enabled, otherwise only
+    requests of admins sending PROFILE_HEADER. Response is not
+    buffered, profiler is stopped when server closes it, so streamed
+    responses are profiled while they are sent.
+    """
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get(PROFILED_KEY):
+            return self.wsgi_app(environ, start_response)
+        profiler = cProfile.Profile()
+        if self.app.config.get('PROFILE_REQUESTS'):
+            profiler.enable()
+        elif 'HTTP_' + PROFILE_HEADER.upper().replace('-', '_') in environ:
+            # enabled by start_admin_profiler once user is known
+            environ[PROFILER_KEY] = profiler
+        else:
+            return self.wsgi_app(environ, start_response)
+        start = default_timer()
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except Exception:
+            profiler.disable()
+            raise
+        if not self.app.config.get('PROFILE_REQUESTS') and \
+                not environ.get(PROFILING_KEY):
+            # header was sent by user who is not admin
+            return response
+
+        def stop():
+            """
+            Saves profile of request once response is sent.
+            """
+            profiler.disable()
+            save_profile(
+                profiler,
+                self.app.config.get('PROFILE_DIR', PROFILE_DIR),
+                environ['REQUEST_METHOD'],
+                environ.get('PATH_INFO', '/'),
+                default_timer() - start,
+            )
+
+        # streamed responses are generated while being read
+        return ClosingIterator(response, stop)
+
+
+def start_admin_profiler():
+    """
+    Enables profiler requested in header when current user is admin.
+    """
+    profiler = request.environ.get(PROFILER_KEY)
+    if profiler is not None and is_admin(current_user):
+        request.environ[PROFILING_KEY] = True
+        profiler.enable()
+
+
+def _label(function):
+    """
+    Returns short name of function from pstats key.
+    """
+    filename, line, name = function
+    if filename == '~':
+        return name
+    return '{}:{}({})'.format(os.path.basename(filename), line, name)
+
+
+def collapsed_stacks(stats):
+    """
+    Returns Counter of call stacks joined with semicolons mapped to
+    microseconds spent in the last function. cProfile records only
+    callers of every function, so time of function is split among
+    its callers in proportion to time spent under each of them.
+    """
+    children = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            children.setdefault(caller, []).append((function, cumulative))
+    stacks = Counter()
+
+    def walk(function, path, time):
+        """
+        Adds time of function and its callees called along path.
+        """
+        _, _, own, cumulative, _ = stats[function]
+        share = time / cumulative if cumulative else 0
+        path = path + (_label(function),)
+        stacks[';'.join(path)] += int(own * share * 1000000)
+        for child, child_time in children.get(function, ()):
+            child_time *= share
+            if child_time >= MIN_STACK_TIME and \
+                    _label(child) not in path:
+                walk(child, path, child_time)
+
+    for function, (_, _, _, cumulative, callers) in stats.items():
+        if not callers:
+            walk(function, (), cumulative)
+    return Counter({
+        stack: time for stack, time in stacks.items() if time > 0
+    })
+
+
+def save_profile(profiler, directory, method, path, elapsed):
+    """
+    Writes pstats and collapsed stacks of profiled request to directory.
+    Returns path of pstats file, collapsed stacks file has the same
+    name ending with .collapsed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{}-{}ms'.format(
+        datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        method,
+        re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or 'index',
+        int(elapsed * 1000),
+    )
+    filename = os.path.join(directory, name + '.prof')
+    profiler.dump_stats(filename)
+    stats = pstats.Stats(profiler).stats
+    with open(os.path.join(directory, name + '.collapsed'), 'w') as output:
+        for stack, time in sorted(collapsed_stacks(stats).items()):
+            output.write('{} {}\n'.format(stack, time))
+    return filename
+
+
+def profile_request(app, url, method='GET', data=None, username=None):
+    """
+    Makes request through test client of app under cProfile, logged in
+    as user with given username, and saves the results. Returns response
+    status code, path of pstats file and Stats.
+    """
+    from flask.ext.login import _create_identifier
+    from .models import User
+    client = app.test_client()
+    if username:
+        user = User.query.filter(User.username == username).first()
+        if user is None:
+            raise ValueError('No user {}.'.format(username))
+        with app.test_request_context():
+            identifier = _create_identifier()
+        with client.session_transaction() as session:
+            session['user_id'] = user.id
+            session['_fresh'] = True
+            session['_id'] = identifier
+    profiler = cProfile.Profile()
+    start = default_timer()
+    profiler.enable()
+    try:
+        response = client.open(
+            url,
+            method=method,
+            data=data,
+            environ_base={PROFILED_KEY: True},
+        )
+        response.get_data()
+    finally:
+        profiler.disable()
+    filename = save_profile(
+        profiler,
+        app.config.get('PROFILE_DIR', PROFILE_DIR),
+        method,
+        url.split('?')[0],
+        default_timer() - start,
+    )
+    return response.status_code, filename, pstats.Stats(profiler)
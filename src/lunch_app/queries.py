@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Aggregated queries for lunch app views.
+"""
+from calendar import month_name
+
+from sqlalchemy import and_, func
+
+from .main import db
+from .models import Order, User, Finance, MonthlyBilling, PizzaOrder
+
+
+class OrdersSummary(object):
+    """
+    Orders grouped by company, arrival time and description.
+    """
+
+    def __init__(self, rows):
+        """
+        Builds summary from (company, arrival_time, description,
+        number of orders, cost) rows.
+        """
+        self.groups = {}
+        for company, arrival_time, description, count, cost in rows:
+            group = self.groups.setdefault(
+                (company, arrival_time),
+                {'meals': {}, 'count': 0, 'cost': 0},
+            )
+            description = description.strip('\n').strip('\r')
+            group['meals'][description] = \
+                group['meals'].get(description, 0) + count
+            group['count'] += count
+            group['cost'] += cost or 0
+
+    def group(self, company, arrival_time):
+        """
+        Returns meals, number of orders and cost for company and arrival time.
+        """
+        return self.groups.get(
+            (company, arrival_time),
+            {'meals': {}, 'count': 0, 'cost': 0},
+        )
+
+    def cost(self):
+        """
+        Returns cost of all orders in summary.
+        """
+        return sum(group['cost'] for group in self.groups.values())
+
+
+def group_orders(date_from, date_to):
+    """
+    Returns summary of orders from given period grouped by company,
+    arrival time and description in one query.
+    """
+    rows = Order.in_range(
+        date_from,
+        date_to,
+        query=db.session.query(
+            Order.company,
+            Order.arrival_time,
+            Order.description,
+            func.count(Order.id),
+            func.sum(Order.cost),
+        ),
+    ).group_by(
+        Order.company,
+        Order.arrival_time,
+        Order.description,
+    ).all()
+    return OrdersSummary(rows)
+
+
+def monthly_billing(year, month, username=None):
+    """
+    Returns number of orders, cost and payment status of every user
+    who ordered something in given month, keyed by username.
+    Reads monthly billing, so it does not depend on number of orders.
+    """
+    orders = db.session.query(
+        MonthlyBilling.user_name.label('user_name'),
+        func.sum(MonthlyBilling.orders_count).label('number_of_orders'),
+        func.sum(MonthlyBilling.total_cost).label('month_cost'),
+    ).filter(
+        and_(
+            MonthlyBilling.year == year,
+            MonthlyBilling.month == month,
+        )
+    )
+    if username is not None:
+        orders = orders.filter(MonthlyBilling.user_name == username)
+    orders = orders.group_by(MonthlyBilling.user_name).subquery()
+    paid = db.session.query(
+        Finance.user_name.label('user_name'),
+    ).filter(
+        and_(
+            Finance.month == month,
+            Finance.year == year,
+            Finance.did_user_pay,
+        )
+    ).distinct().subquery()
+    rows = db.session.query(
+        orders.c.user_name,
+        orders.c.number_of_orders,
+        orders.c.month_cost,
+        paid.c.user_name,
+    ).join(
+        User, User.username == orders.c.user_name,
+    ).outerjoin(
+        paid, paid.c.user_name == orders.c.user_name,
+    ).all()
+    finance_data = {}
+    for user_name, number_of_orders, month_cost, paid_user in rows:
+        if not month_cost:
+            # user didn't bought anything
+            continue
+        finance_data[user_name] = {
+            'username': user_name,
+            'number_of_orders': number_of_orders,
+            'month_cost': month_cost,
+            'did_user_pay': paid_user is not None,
+        }
+    return finance_data
+
+
+def _empty_year():
+    """
+    Returns list of twelve months without orders.
+    """
+    return [
+        {
+            'month_name': month_name[month],
+            'number of orders': 0,
+            'month cost': 0,
+        }
+        for month in range(1, 13)
+    ]
+
+
+def year_summary(user_name, year):
+    """
+    Returns number of orders and cost for every month of user's year
+    from monthly billing.
+    """
+    rows = db.session.query(
+        MonthlyBilling.month,
+        func.sum(MonthlyBilling.orders_count),
+        func.sum(MonthlyBilling.total_cost),
+    ).filter(
+        and_(
+            MonthlyBilling.user_name == user_name,
+            MonthlyBilling.year == year,
+        )
+    ).group_by(MonthlyBilling.month).all()
+    year_data = _empty_year()
+    for month_number, number_of_orders, month_cost in rows:
+        monthly_data = year_data[month_number - 1]
+        monthly_data['number of orders'] = number_of_orders
+        monthly_data['month cost'] = month_cost or 0
+    return year_data
+
+
+def company_costs(year, month):
+    """
+    Returns cost of month's orders keyed by company.
+    """
+    return dict(
+        db.session.query(
+            MonthlyBilling.company,
+            func.sum(MonthlyBilling.total_cost),
+        ).filter(
+            and_(
+                MonthlyBilling.year == year,
+                MonthlyBilling.month == month,
+            )
+        ).group_by(MonthlyBilling.company)
+    )
+
+
+def pizza_summary(event_id):
+    """
+    Returns pizzas ordered during pizza event grouped by pizza and size
+    with number of pizzas and users who ordered them.
+    """
+    users = {}
+    for pizza, size, user_name in db.session.query(
+            PizzaOrder.pizza,
+            PizzaOrder.size,
+            PizzaOrder.user_name,
+    ).filter(
+        PizzaOrder.event_id == event_id,
+    ).order_by(PizzaOrder.user_name):
+        users.setdefault((pizza, size), []).append(user_name)
+    rows = db.session.query(
+        PizzaOrder.pizza,
+        PizzaOrder.size,
+        func.count(PizzaOrder.id),
+    ).filter(
+        PizzaOrder.event_id == event_id,
+    ).group_by(
+        PizzaOrder.pizza,
+        PizzaOrder.size,
+    ).order_by(
+        func.count(PizzaOrder.id).desc(),
+        PizzaOrder.pizza,
+        PizzaOrder.size,
+    ).all()
+    return [
+        {
+            'pizza': pizza,
+            'size': size,
+            'count': count,
+            'users': users.get((pizza, size), []),
+        }
+        for pizza, size, count in rows
+    ]
+
+
+def daily_reminder_recipients(day):
+    """
+    Returns usernames of users who want daily reminder and did not order
+    anything on given day, computed as anti join in database.
+    """
+    ordered = Order.for_day(
+        day,
+        query=db.session.query(Order.id),
+    ).filter(Order.user_name == User.username)
+    return [
+        username for username, in db.session.query(
+            User.username,
+        ).filter(
+            and_(
+                User.i_want_daily_reminder,
+                ~ordered.exists(),
+            )
+        ).order_by(User.username)
+    ]
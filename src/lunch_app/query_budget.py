@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Counting of SQL queries and query budgets of views.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from .main import app, db
+
+
+class QueryCounter(object):
+    """
+    SQL statements executed while counting.
+    """
+
+    def __init__(self):
+        """
+        Inits empty counter.
+        """
+        self.statements = []
+
+    @property
+    def count(self):
+        """
+        Returns number of executed statements.
+        """
+        return len(self.statements)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        """
+        Records statement about to be executed.
+        """
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Counts SQL statements executed by engine inside the block.
+    """
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(
+        engine,
+        'before_cursor_execute',
+        counter.before_cursor_execute,
+    )
+    try:
+        yield counter
+    finally:
+        event.remove(
+            engine,
+            'before_cursor_execute',
+            counter.before_cursor_execute,
+        )
+
+
+def query_budget(budget):
+    """
+    Declares maximal number of queries of single request to view,
+    it must not depend on number of rows.
+    """
+    def decorator(func):
+        """
+        Marks view with its budget.
+        """
+        func.query_budget = budget
+        return func
+    return decorator
+
+
+def view_query_budgets():
+    """
+    Returns query budgets of views keyed by endpoint.
+    """
+    return {
+        endpoint: view.query_budget
+        for endpoint, view in app.view_functions.items()
+        if hasattr(view, 'query_budget')
+    }
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Daily reminder for users who did not order lunch.
+"""
+import datetime
+import logging
+
+from flask.ext.mail import Message
+
+from .cache import get_mail_text
+from .main import app, db
+from .outbox import send_mail
+from .queries import daily_reminder_recipients
+from .scheduler import run_scheduled, WORKING_DAYS
+
+log = logging.getLogger(__name__)
+
+REMINDER_TIMES = ('10:30',)
+REMINDER_WEEKDAYS = WORKING_DAYS
+
+
+def mail_daily_reminder(day=None):
+    """
+    Mails daily reminder to users without order on given day.
+    Returns list of recipients.
+    """
+    day = day or datetime.date.today()
+    emails = daily_reminder_recipients(day)
+    if not emails:
+        return emails
+    message_text = get_mail_text()
+    msg = Message(
+        '{} {}'.format(message_text.daily_reminder_subject, day),
+        recipients=emails,
+    )
+    msg.body = message_text.daily_reminder
+    send_mail(msg)
+    db.session.commit()
+    log.info('Daily reminder sent to %s users', len(emails))
+    return emails
+
+
+def run_scheduler(once=False):
+    """
+    Sends daily reminder at DAILY_REMINDER_TIMES on DAILY_REMINDER_WEEKDAYS
+    until stopped.
+    """
+    if once:
+        return mail_daily_reminder()
+    return run_scheduled(
+        mail_daily_reminder,
+        app.config.get('DAILY_REMINDER_TIMES', REMINDER_TIMES),
+        app.config.get('DAILY_REMINDER_WEEKDAYS', REMINDER_WEEKDAYS),
+    )
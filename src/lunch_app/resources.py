@@ -1,17 +1,257 @@
 # -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
 """
 Resources for RESTful API.
 """
+import datetime
+import json
 
-from flask.ext import restful
+from flask import request
+from flask.ext import login, restful
+from flask.ext.login import current_user
+from sqlalchemy import and_, or_
+from werkzeug.datastructures import MultiDict
+
+from . import models
+from .billing import bill_order_rows
+from .cache import get_ordering_info, orders_snapshot
+from .events import log_order_event, order_data
+from .forms import OrderForm
+from .main import db
+from .permissions import user_is_admin
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_BULK_SIZE = 500
+ORDER_COLUMNS = (
+    models.Order.id,
+    models.Order.user_name,
+    models.Order.company,
+    models.Order.arrival_time,
+    models.Order.description,
+    models.Order.cost,
+    models.Order.date,
+)
+ORDER_FIELDS = tuple(column.key for column in ORDER_COLUMNS)
+
+
+def serialize_row(row):
+    """
+    Returns order selected as tuple of ORDER_COLUMNS as dict.
+    """
+    order = dict(zip(ORDER_FIELDS, row))
+    order['date'] = order['date'].isoformat() if order['date'] else None
+    return order
+
+
+def make_cursor(row):
+    """
+    Returns cursor pointing after order row.
+    """
+    return '{},{}'.format(row.date.isoformat(), row.id)
+
+
+def parse_cursor(cursor):
+    """
+    Returns date and id stored in cursor.
+    """
+    date, order_id = cursor.rsplit(',', 1)
+    for date_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return (
+                datetime.datetime.strptime(date, date_format),
+                int(order_id),
+            )
+        except ValueError:
+            continue
+    raise ValueError(cursor)
+
+
+def parse_date(value):
+    """
+    Returns date from YYYY-MM-DD string.
+    """
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def validate_order(data):
+    """
+    Returns errors of order data checked by order form or None.
+    """
+    if not isinstance(data, dict):
+        return {'order': ['Order has to be an object.']}
+    form = OrderForm(MultiDict(data))
+    if not form.validate():
+        return form.errors
+    return None
+
+
+def new_order_row(data, user_name):
+    """
+    Returns validated order data as dict ready for bulk insert.
+    """
+    return {
+        'user_name': user_name,
+        'description': data['description'].strip(),
+        'cost': float(data['cost']),
+        'company': data['company'],
+        'arrival_time': data['arrival_time'],
+        'date': datetime.datetime.now(),
+    }
 
 
 class Order(restful.Resource):
     """
-    Resources for RESTful API.
+    Orders listing and creation.
     """
+    method_decorators = [login.login_required]
+
+    def get(self):
+        """
+        Returns page of orders sorted by date and id. Filters: user_name,
+        company, arrival_time, date_from, date_to (YYYY-MM-DD). Next page
+        starts after next_cursor. Users which are not admins see only
+        their orders.
+        """
+        args = request.args
+        try:
+            limit = int(args.get('limit', PAGE_SIZE))
+            if limit < 1:
+                raise ValueError(limit)
+            limit = min(limit, MAX_PAGE_SIZE)
+            date_from = parse_date(args['date_from']) \
+                if 'date_from' in args else datetime.date.min
+            date_to = parse_date(args['date_to']) \
+                if 'date_to' in args else datetime.date.max
+            cursor = parse_cursor(args['cursor']) \
+                if 'cursor' in args else None
+        except ValueError:
+            return {'message': 'Invalid limit, date or cursor.'}, 400
+        user_name = args.get('user_name')
+        if not current_user.is_admin():
+            user_name = current_user.username
+        query = models.Order.in_range(
+            datetime.datetime.combine(date_from, datetime.time.min),
+            datetime.datetime.combine(date_to, datetime.time.max),
+            query=db.session.query(*ORDER_COLUMNS),
+        )
+        if user_name:
+            query = query.filter(models.Order.user_name == user_name)
+        if 'company' in args:
+            query = query.filter(models.Order.company == args['company'])
+        if 'arrival_time' in args:
+            query = query.filter(
+                models.Order.arrival_time == args['arrival_time'],
+            )
+        if cursor is not None:
+            query = query.filter(
+                or_(
+                    models.Order.date > cursor[0],
+                    and_(
+                        models.Order.date == cursor[0],
+                        models.Order.id > cursor[1],
+                    ),
+                )
+            )
+        rows = query.order_by(
+            models.Order.date,
+            models.Order.id,
+        ).limit(limit + 1).all()
+        next_cursor = make_cursor(rows[limit - 1]) \
+            if len(rows) > limit else None
+        return {
+            'orders': [serialize_row(row) for row in rows[:limit]],
+            'next_cursor': next_cursor,
+        }
+
+    def post(self):
+        """
+        Creates order of current user from JSON object with description,
+        cost, company and arrival_time.
+        """
+        if not current_user.is_active():
+            return {'message': 'User is blocked.'}, 403
+        if not get_ordering_info().is_allowed:
+            return {'message': 'Ordering is blocked.'}, 403
+        data = request.get_json(force=True, silent=True)
+        errors = validate_order(data)
+        if errors:
+            return {'errors': errors}, 400
+        order = models.Order()
+        for key, value in new_order_row(
+                data,
+                current_user.username,
+        ).items():
+            setattr(order, key, value)
+        db.session.add(order)
+        log_order_event('created', order)
+        db.session.commit()
+        return order_data(order), 201
+
+
+class OrderBulk(restful.Resource):
+    """
+    Creating many orders at once.
+    """
+    method_decorators = [user_is_admin, login.login_required]
+
     def post(self):
         """
-        Resources for RESTful API.
+        Creates orders from JSON list of objects with user_name,
+        description, cost, company and arrival_time. Nothing is created
+        when any of orders is invalid.
         """
-        pass
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, list) or not 0 < len(data) <= MAX_BULK_SIZE:
+            return {
+                'message': 'Expected list of 1 to {} orders.'.format(
+                    MAX_BULK_SIZE,
+                ),
+            }, 400
+        errors = {}
+        for number, order in enumerate(data):
+            order_errors = validate_order(order)
+            if not order_errors and (
+                    not order.get('user_name') or
+                    not isinstance(order['user_name'], str)
+            ):
+                order_errors = {'user_name': ['Please choose user.']}
+            if order_errors:
+                errors[number] = order_errors
+        if not errors:
+            user_names = {order['user_name'] for order in data}
+            known = {
+                user_name for user_name, in db.session.query(
+                    models.User.username,
+                ).filter(models.User.username.in_(list(user_names)))
+            }
+            for number, order in enumerate(data):
+                if order['user_name'] not in known:
+                    errors[number] = {'user_name': ['Unknown user.']}
+        if errors:
+            return {'errors': errors}, 400
+        rows = [new_order_row(order, order['user_name']) for order in data]
+        # no unit of work objects, ids are filled into rows
+        db.session.bulk_insert_mappings(
+            models.Order,
+            rows,
+            return_defaults=True,
+        )
+        orders = [
+            serialize_row([row[field] for field in ORDER_FIELDS])
+            for row in rows
+        ]
+        # bulk inserts skip session events which update billing
+        bill_order_rows(rows)
+        db.session.bulk_insert_mappings(models.OrderEvent, [
+            {
+                'kind': 'created',
+                'order_id': order['id'],
+                'data': json.dumps(order),
+            }
+            for order in orders
+        ])
+        db.session.commit()
+        # bulk inserts skip mapper events which invalidate dashboards
+        orders_snapshot.invalidate()
+        return {'orders': orders}, 201
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Running jobs at fixed times of working days.
+"""
+import datetime
+import logging
+import time
+
+from .main import db
+
+log = logging.getLogger(__name__)
+
+WORKING_DAYS = (0, 1, 2, 3, 4)
+
+
+def next_run(now, times, weekdays=WORKING_DAYS):
+    """
+    Returns first datetime after now matching times and weekdays.
+    """
+    times = sorted(
+        datetime.datetime.strptime(run_time, '%H:%M').time()
+        for run_time in times
+    )
+    for days in range(8):
+        day = now.date() + datetime.timedelta(days=days)
+        if day.weekday() not in weekdays:
+            continue
+        for run_time in times:
+            run_at = datetime.datetime.combine(day, run_time)
+            if run_at > now:
+                return run_at
+    return None
+
+
+def run_scheduled(job, times, weekdays=WORKING_DAYS):
+    """
+    Runs job at times on weekdays until stopped.
+    """
+    name = job.__name__
+    while True:
+        run_at = next_run(datetime.datetime.now(), times, weekdays)
+        if run_at is None:
+            log.error('No time configured for %s', name)
+            return
+        log.info('Next %s at %s', name, run_at)
+        time.sleep(
+            max((run_at - datetime.datetime.now()).total_seconds(), 0),
+        )
+        try:
+            job()
+        except Exception:  # pylint: disable=broad-except
+            # scheduler must survive e.g. lost db connection
+            log.exception('%s failed', name)
+            db.session.rollback()
+        finally:
+            db.session.remove()
@@ -4,6 +4,7 @@ Startup utilities.
 """
 # pylint: disable=invalid-name, unused-variable
 
+import glob
 import os
 import subprocess
 from functools import partial
@@ -76,6 +77,9 @@ def _serve(action):
 
     if action in ('fg', 'start'):
         argv += ['--xml', abspath('parts', 'uwsgi', 'uwsgi.xml')]
+        # metrics of workers from previous run
+        for path in glob.glob(abspath('var', 'metrics', '*.json')):
+            os.remove(path)
     if action == 'start':
         argv += ['--daemonize', abspath('var', 'log', 'app.log')]
     if action in ('stop', 'reload'):
@@ -146,6 +150,170 @@ def run():
             elif action == 'upgrade':
                 upgrade()
 
+    def action_mail_worker(interval=('i', 5), once=False, debug=False):
+        """Send queued mail messages.
+        Options:
+        - '--interval' seconds to wait when outbox is empty
+        - '--once' send one batch of messages and exit
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .outbox import run_worker
+        with app.app_context():
+            run_worker(interval=interval, once=once)
+
+    def action_import_menus(once=False, debug=False):
+        """Import restaurant menus at configured times.
+        Options:
+        - '--once' import menus now and exit
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .menu_import import run_scheduler
+        with app.app_context():
+            run_scheduler(once=once)
+
+    def action_daily_reminder(once=False, debug=False):
+        """Mail daily reminder at configured times.
+        Options:
+        - '--once' send reminder now and exit
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .reminders import run_scheduler
+        with app.app_context():
+            run_scheduler(once=once)
+
+    def action_rebuild_billing(debug=False):
+        """Compute monthly billing again from all orders.
+        Options:
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .billing import rebuild_monthly_billing
+        with app.app_context():
+            print('{} billing rows'.format(rebuild_monthly_billing()))
+
+    def action_loadtest(users=('u', 20), duration=('d', 30), url='',
+                        think_time=0.5, keep_data=False, dashboards=0,
+                        debug=False):
+        """Replay lunchtime traffic and report latency of routes.
+        Synthetic users and meals are added to configured database
+        and removed afterwards.
+        Options:
+        - '--users' number of simulated users
+        - '--duration' seconds of load
+        - '--url' running server to load, it needs LOADTEST_LOGIN = True,
+          local server is started when empty
+        - '--think_time' mean pause between requests of user in seconds
+        - '--keep_data' do not remove synthetic users and their orders
+        - '--dashboards' number of order events streams kept open
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .loadtest import print_report, run_loadtest
+        with app.app_context():
+            print_report(run_loadtest(
+                users=users,
+                duration=duration,
+                url=url,
+                think_time=think_time,
+                keep_data=keep_data,
+                dashboards=dashboards,
+            ))
+
+    def action_seed(users=('u', 10000), days=('d', 60), orders_per_day=5000,
+                    random_seed=0, debug=False):
+        """Fill database with synthetic users, orders, foods, payments
+        and pizza events of given number of past days.
+        Options:
+        - '--users' number of synthetic users
+        - '--days' number of days ending today, weekends get no orders
+        - '--orders_per_day' orders of distinct users every working day
+        - '--random_seed' the same seed generates the same data
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from timeit import default_timer
+        from .seed import seed
+        with app.app_context():
+            start = default_timer()
+            counts = seed(
+                users=users,
+                days=days,
+                orders_per_day=orders_per_day,
+                random_seed=random_seed,
+            )
+            for table, count in counts.items():
+                print('{:<16} {:>10}'.format(table, count))
+            print('Seeded in {:.1f} s'.format(default_timer() - start))
+
+    def action_profile(url, method='GET', user='', limit=30, debug=False):
+        """Profile single request and print the slowest functions.
+        pstats and collapsed stacks are saved in var/profiles.
+        Options:
+        - '--method' HTTP method of request
+        - '--user' username of user making request, anonymous when empty
+        - '--limit' number of functions printed
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .profiling import profile_request
+        with app.app_context():
+            status, filename, stats = profile_request(
+                app,
+                url,
+                method=method.upper(),
+                username=user or None,
+            )
+            print('{} {} -> {}'.format(method.upper(), url, status))
+            stats.sort_stats('cumulative').print_stats(limit)
+            print('Saved {}'.format(filename))
+
+    def action_benchmark(name=('n', 'crawlers'), number=20, debug=False):
+        """Run micro benchmark.
+        Options:
+        - '--name' benchmark to run: crawlers, food_insert
+        - '--number' how many times each case is run
+        - '--debug' use debug configuration
+        """
+        if debug:
+            app = make_debug(with_debug_layer=False)
+        else:
+            app = make_app()
+
+        from .benchmarks import run as run_benchmark
+        with app.app_context():
+            run_benchmark(name, number)
+
     werkzeug.script.run()
 
 
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name, no-member
+"""
+Synthetic data of realistic size for benchmarks.
+"""
+from collections import OrderedDict
+import csv
+import datetime
+import io
+import random
+
+from .billing import rebuild_monthly_billing
+from .cache import menu_cache, orders_snapshot
+from .fixtures import allow_ordering
+from .main import db
+from .menu_import import food_row
+from .models import (
+    Finance,
+    Food,
+    OrderingInfo,
+    Order,
+    Pizza,
+    PizzaOrder,
+    User,
+)
+
+SEED_DOMAIN = 'seed.local'
+# rows generated and inserted at once
+BATCH_SIZE = 10000
+COMPANIES = ('Tomas', 'Pod Koziołkiem')
+ARRIVAL_TIMES = ('12:00', '13:00')
+MEALS = (
+    'Zupa pomidorowa', 'Zupa ogórkowa', 'Żurek', 'Kapuśniak', 'Barszcz',
+    'Schabowy z ziemniakami', 'Pierogi ruskie', 'Gulasz z kaszą',
+    'Kurczak curry z ryżem', 'Naleśniki z serem', 'Placki ziemniaczane',
+    'Spaghetti bolognese', 'Łosoś z warzywami', 'Bigos', 'Gołąbki',
+)
+PIZZAS = ('Margherita', 'Funghi', 'Vesuvio', 'Capriciosa', 'Hawai')
+DAILY_MEALS = 5
+MENU_MEALS = 10
+PAID_RATIO = 0.8
+PIZZA_RATIO = 0.3
+
+
+def seed_username(number):
+    """
+    Returns username of synthetic user.
+    """
+    return 'user{}@{}'.format(number, SEED_DOMAIN)
+
+
+def working_days(days, last_day):
+    """
+    Returns working days among days ending with last day.
+    """
+    return [
+        day for day in (
+            last_day - datetime.timedelta(days=offset)
+            for offset in range(days - 1, -1, -1)
+        )
+        if day.weekday() < 5
+    ]
+
+
+def _csv_value(value):
+    """
+    Returns value written in COPY CSV, None is written as NULL.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    return value
+
+
+def _copy(table, rows):
+    """
+    Loads rows into PostgreSQL table with COPY in current transaction.
+    """
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(row[column]) for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        'COPY "{}" ({}) FROM STDIN WITH CSV'.format(
+            table.name,
+            ', '.join('"{}"'.format(column) for column in columns),
+        ),
+        buffer,
+    )
+
+
+def insert_rows(model, rows):
+    """
+    Inserts dicts as rows of model's table without ORM in batches,
+    PostgreSQL gets COPY. Returns number of rows.
+    """
+    table = model.__table__
+    number_of_rows = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            number_of_rows += _insert_batch(table, batch)
+            batch = []
+    if batch:
+        number_of_rows += _insert_batch(table, batch)
+    return number_of_rows
+
+
+def _insert_batch(table, rows):
+    """
+    Inserts one batch of rows.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        _copy(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+    return len(rows)
+
+
+def user_rows(users, rnd):
+    """
+    Yields synthetic users, few of them are admins or blocked.
+    """
+    for number in range(users):
+        username = seed_username(number)
+        yield {
+            'username': username,
+            'email': username,
+            'name': 'User {}'.format(number),
+            'password': '',
+            'active': rnd.random() > 0.02,
+            'admin': number == 0 or rnd.random() < 0.01,
+            'i_want_daily_reminder': rnd.random() < 0.3,
+        }
+
+
+def day_menu(day, rnd):
+    """
+    Returns rows of daily foods of every company available on day.
+    """
+    return [
+        food_row(
+            company,
+            meal,
+            rnd.choice((4, 10, 11, 12)),
+            'daniednia',
+            day,
+            day,
+        )
+        for company in COMPANIES
+        for meal in rnd.sample(MEALS, DAILY_MEALS)
+    ]
+
+
+def order_rows(day, foods, users, orders_per_day, rnd):
+    """
+    Yields orders of distinct users made in the morning of day.
+    """
+    morning = datetime.datetime.combine(day, datetime.time(9, 0))
+    for number in rnd.sample(range(users), min(orders_per_day, users)):
+        food = rnd.choice(foods)
+        yield {
+            'user_name': seed_username(number),
+            'description': food['description'],
+            'company': food['company'],
+            'cost': food['cost'],
+            'arrival_time': rnd.choice(ARRIVAL_TIMES),
+            'date': morning + datetime.timedelta(
+                seconds=rnd.randrange(2 * 60 * 60),
+            ),
+        }
+
+
+def finance_rows(months, users, rnd):
+    """
+    Yields payment status of every user in every month.
+    """
+    for year, month in months:
+        for number in range(users):
+            yield {
+                'user_name': seed_username(number),
+                'year': year,
+                'month': month,
+                'did_user_pay': rnd.random() < PAID_RATIO,
+                'version_id': 1,
+            }
+
+
+def seed(users=10000, days=60, orders_per_day=None, last_day=None,
+         random_seed=0):
+    """
+    Fills database with synthetic users and their orders, foods,
+    payments and weekly pizza events of working days. Every user
+    orders at most once a day. Returns number of created rows keyed
+    by table.
+    """
+    if User.query.filter(User.username.like('%@' + SEED_DOMAIN)).first():
+        raise ValueError('Database is already seeded.')
+    rnd = random.Random(random_seed)
+    last_day = last_day or datetime.date.today()
+    orders_per_day = users // 2 if orders_per_day is None else orders_per_day
+    if OrderingInfo.query.first() is None:
+        allow_ordering()
+    counts = OrderedDict()
+    counts['user'] = insert_rows(User, user_rows(users, rnd))
+    menu = [
+        food_row(company, meal, 10, 'menu', last_day, last_day)
+        for company in COMPANIES
+        for meal in MEALS[:MENU_MEALS]
+    ]
+    for food in menu:
+        food['date_available_from'] = datetime.datetime(2000, 1, 1)
+        food['date_available_to'] = datetime.datetime(2100, 1, 1)
+    foods = list(menu)
+    counts['order'] = 0
+    pizza_days = []
+    for day in working_days(days, last_day):
+        daily = day_menu(day, rnd)
+        foods.extend(daily)
+        counts['order'] += insert_rows(
+            Order,
+            order_rows(day, daily + menu, users, orders_per_day, rnd),
+        )
+        if day.weekday() == 4:
+            pizza_days.append(day)
+    counts['food'] = insert_rows(Food, foods)
+    months = sorted({
+        (day.year, day.month) for day in working_days(days, last_day)
+    })
+    counts['finance'] = insert_rows(Finance, finance_rows(months, users, rnd))
+    events = []
+    for day in pizza_days:
+        event = Pizza()
+        event.date = datetime.datetime.combine(day, datetime.time(11, 0))
+        event.who_created = seed_username(0)
+        events.append(event)
+    db.session.add_all(events)
+    db.session.flush()
+    counts['pizza'] = len(events)
+    counts['pizza_order'] = insert_rows(PizzaOrder, (
+        {
+            'event_id': event.id,
+            'user_name': seed_username(number),
+            'pizza': rnd.choice(PIZZAS),
+            'size': rnd.choice(('small', 'big')),
+            'date': event.date,
+        }
+        for event in events
+        for number in rnd.sample(range(users), int(users * PIZZA_RATIO))
+    ))
+    db.session.commit()
+    # core inserts skip session events
+    counts['monthly_billing'] = rebuild_monthly_billing()
+    menu_cache.invalidate()
+    orders_snapshot.invalidate()
+    return counts
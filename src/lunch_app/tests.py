@@ -4,23 +4,117 @@ Presence analyzer unit tests.
 """
 # pylint: disable=maybe-no-member, too-many-public-methods, invalid-name
 
-from datetime import datetime, date, timedelta
+import configparser
+from datetime import datetime, date, time, timedelta
+from hashlib import sha1
+import json
 import os.path
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import threading
+from time import sleep
+from timeit import default_timer
 import unittest
 from unittest.mock import patch
 
+import flask_mail
+from flask.ext.login import current_user
+from flask.ext.mail import Message
+from sqlalchemy import create_engine
+from sqlalchemy.sql.expression import Update
+
+try:
+    import aiosmtpd
+except ImportError:
+    aiosmtpd = None
+
 from .main import app, db, mail
-from . import main, utils
-from .fixtures import fill_db, allow_ordering
+from . import benchmarks, main, utils
+from .fixtures import (
+    fill_db,
+    fill_loadtest_db,
+    allow_ordering,
+    loadtest_username,
+)
 from .mocks import (
     MOCK_ADMIN,
     MOCK_DATA_TOMAS,
     MOCK_DATA_KOZIOLEK,
     MOCK_WWW_TOMAS,
     MOCK_WWW_KOZIOLEK,
+    LocalHTTPServer,
+    LocalSMTPServer,
+)
+from .billing import (
+    apply_deltas,
+    bill_order_rows,
+    rebuild_monthly_billing,
+)
+from .cache import (
+    get_mail_text,
+    get_ordering_info,
+    get_menu,
+    menu_cache,
+    orders_snapshot,
+    settings_cache,
+)
+from .events import MAX_STREAMS, stream_slots
+from .export import csv_lines
+from .loadtest import (
+    DASHBOARD_LABEL,
+    LOGIN_HEADER,
+    SCENARIO,
+    SERVER_THREADS,
+    percentile,
+    remove_loadtest_data,
+    run_loadtest,
+)
+from .menu_import import (
+    food_row,
+    import_menus,
+    insert_foods,
+    koziolek_foods,
+    store_foods,
+)
+from .models import (
+    CacheVersion,
+    Order,
+    Food,
+    MailText,
+    User,
+    Finance,
+    OrderingInfo,
+    MailOutbox,
+    MonthlyBilling,
+    OrderEvent,
+    Pizza,
+    PizzaOrder,
+)
+from .outbox import queue_mail, send_queued, send_bulk, run_worker
+from .metrics import exposition, registry, timed
+from .profiling import PROFILE_HEADER, collapsed_stacks, profile_request
+from .queries import (
+    group_orders,
+    daily_reminder_recipients,
+    monthly_billing,
+    pizza_summary,
+    year_summary,
+)
+from .reminders import mail_daily_reminder
+from .query_budget import count_queries, view_query_budgets
+from .scheduler import next_run
+from .seed import seed, seed_username
+from .webcrawler import (
+    lxml,
+    CrawlerError,
+    crawl_all,
+    fetch,
+    get_dania_dnia_from_pod_koziolek,
+    get_week_from_tomas,
 )
-from .models import Order, Food, MailText, User
-from .webcrawler import get_dania_dnia_from_pod_koziolek, get_week_from_tomas
 from .utils import make_datetime
 
 
@@ -235,8 +329,29 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         resp = self.client.get('/day_summary')
         self.assertIn('Maly Gruby Nalesnik', str(resp.data))
         self.assertIn('Duzy Gruby Nalesnik', str(resp.data))
+        self.assertIn('489.0 PLN', str(resp.data))
         db.session.close()
 
+    def test_group_orders(self):
+        """
+        Test grouping orders by company, arrival time and description.
+        """
+        fill_db()
+        day = date.today()
+        summary = group_orders(
+            datetime.combine(day, time(0, 0)),
+            datetime.combine(day, time(23, 59)),
+        )
+        group = summary.group('Pod Koziołkiem', '12:00')
+        self.assertEqual(group['count'], 3)
+        self.assertEqual(group['cost'], 489)
+        self.assertEqual(
+            group['meals'],
+            {'Duzy Gruby Nalesnik': 2, 'Maly Gruby Nalesnik': 1},
+        )
+        self.assertEqual(summary.group('Tomas', '12:00')['count'], 0)
+        self.assertEqual(summary.cost(), 489)
+
     def test_order_list_view(self):
         """
         Test order list page.
@@ -280,6 +395,31 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         self.assertIn('Tomas', str(resp.data))
         self.assertIn('123', str(resp.data))
 
+    def test_year_summary(self):
+        """
+        Test monthly orders number and cost of user's year.
+        """
+        fill_db()
+        order = Order()
+        order.date = datetime(2015, 3, 1, 0, 0)
+        order.description = 'Kebab'
+        order.company = 'Tomas'
+        order.cost = 7
+        order.user_name = 'test_user'
+        order.arrival_time = '12:00'
+        db.session.add(order)
+        db.session.commit()
+        year_data = year_summary('test_user', 2015)
+        self.assertEqual(len(year_data), 12)
+        self.assertEqual(year_data[0]['month_name'], 'January')
+        self.assertEqual(year_data[0]['number of orders'], 1)
+        self.assertEqual(year_data[0]['month cost'], 123)
+        self.assertEqual(year_data[2]['month cost'], 7)
+        resp = self.client.get('/order_list/1/2015')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('March', str(resp.data))
+        self.assertIn('123', str(resp.data))
+
     @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
     def test_edit_order_view(self):
         """
@@ -318,6 +458,203 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         order = Order.query.get(1)
         self.assertTrue(order is None)
 
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def test_export_orders(self):
+        """
+        Test streaming export of orders.
+        """
+        fill_db()
+        resp = self.client.get('/export/orders/2015/1/csv')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        self.assertIn(
+            'filename=orders_2015_01.csv',
+            resp.headers['Content-Disposition'],
+        )
+        lines = resp.data.decode().splitlines()
+        self.assertEqual(
+            lines[0],
+            'id,date,user_name,company,arrival_time,description,cost',
+        )
+        self.assertEqual(
+            lines[1:],
+            ['1,2015-01-05 00:00:00,test_user,Tomas,12:00,'
+             'Duzy Gruby Nalesnik,123.0'],
+        )
+        resp = self.client.get('/export/orders/2015/json?company=Tomas')
+        orders = json.loads(resp.data.decode())
+        self.assertEqual(orders[0]['date'], '2015-01-05T00:00:00')
+        self.assertEqual({order['company'] for order in orders}, {'Tomas'})
+        resp = self.client.get('/export/orders/2014/json')
+        self.assertEqual(json.loads(resp.data.decode()), [])
+        resp = self.client.get('/export/orders/2015/1/xls')
+        self.assertEqual(resp.status_code, 404)
+
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def test_export_user_totals(self):
+        """
+        Test streaming export of users monthly totals.
+        """
+        fill_db()
+        resp = self.client.get('/export/user_totals/2015/1/csv')
+        self.assertEqual(
+            resp.data.decode().splitlines(),
+            [
+                'user_name,year,month,number_of_orders,total_cost,'
+                'did_user_pay',
+                'test_user,2015,1,1,123.0,False',
+            ],
+        )
+        finance = Finance.query.filter(Finance.user_name == 'test_user').one()
+        finance.month = 1
+        db.session.commit()
+        resp = self.client.get('/export/user_totals/2015/json')
+        totals = json.loads(resp.data.decode())
+        self.assertEqual(totals[0]['user_name'], 'test_user')
+        self.assertTrue(totals[0]['did_user_pay'])
+
+    def test_csv_lines_are_streamed_in_chunks(self):
+        """
+        Test if CSV export is yielded in batches of rows.
+        """
+        chunks = list(csv_lines(('a', 'b'), ((i, i) for i in range(5)), 2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks).splitlines()[-1], '4,4')
+
+    @patch('lunch_app.resources.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def test_api_orders(self):
+        """
+        Test creating and listing orders with API.
+        """
+        fill_db()
+        allow_ordering()
+        order = {
+            'description': 'Zamowienie z API',
+            'cost': 11.5,
+            'company': 'Tomas',
+            'arrival_time': '13:00',
+        }
+        resp = self.client.post('/api/v1/order', data=json.dumps(order))
+        self.assertEqual(resp.status_code, 201)
+        created = json.loads(resp.data.decode())
+        self.assertEqual(created['user_name'], 'test_user')
+        self.assertEqual(created['cost'], 11.5)
+        self.assertEqual(Order.query.get(created['id']).company, 'Tomas')
+        order['company'] = 'Pizzeria'
+        resp = self.client.post('/api/v1/order', data=json.dumps(order))
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('company', json.loads(resp.data.decode())['errors'])
+        orders = [
+            dict(order, user_name=user_name, company='Pod Koziołkiem')
+            for user_name in ('x@x.pl', 'test@user.pl') * 3
+        ]
+        resp = self.client.post(
+            '/api/v1/order/bulk',
+            data=json.dumps(orders),
+        )
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(len(json.loads(resp.data.decode())['orders']), 6)
+        self.assertEqual(OrderEvent.query.count(), 7)
+        resp = self.client.post(
+            '/api/v1/order/bulk',
+            data=json.dumps([dict(order, user_name='nobody')]),
+        )
+        self.assertEqual(resp.status_code, 400)
+        ids = []
+        url = '/api/v1/order?limit=4&company=Pod Koziołkiem&date_from={}'
+        url = url.format(date.today().isoformat())
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            page = json.loads(resp.data.decode())
+            self.assertLessEqual(len(page['orders']), 4)
+            ids.extend(order['id'] for order in page['orders'])
+            url = '/api/v1/order?limit=4&company=Pod Koziołkiem' \
+                '&date_from={}&cursor={}'.format(
+                    date.today().isoformat(),
+                    page['next_cursor'],
+                ) if page['next_cursor'] else None
+        self.assertEqual(ids, [
+            order.id for order in Order.query.filter(
+                Order.company == 'Pod Koziołkiem',
+                Order.date >= datetime.combine(date.today(), time(0, 0)),
+            ).order_by(Order.date, Order.id)
+        ])
+        self.assertGreaterEqual(len(ids), 6)
+        resp = self.client.get('/api/v1/order?user_name=x@x.pl')
+        orders = json.loads(resp.data.decode())['orders']
+        self.assertEqual({order['user_name'] for order in orders}, {'x@x.pl'})
+        self.assertEqual(
+            len(orders),
+            Order.query.filter(Order.user_name == 'x@x.pl').count(),
+        )
+        resp = self.client.get('/api/v1/order?date_from=2015-13-01')
+        self.assertEqual(resp.status_code, 400)
+        for limit in ('0', '-1', 'abc', '1.5'):
+            resp = self.client.get('/api/v1/order?limit=' + limit)
+            self.assertEqual(resp.status_code, 400)
+        for user_name in (['x@x.pl'], {'x': 1}, 7):
+            resp = self.client.post(
+                '/api/v1/order/bulk',
+                data=json.dumps([dict(
+                    order,
+                    user_name=user_name,
+                    company='Pod Koziołkiem',
+                )]),
+            )
+            self.assertEqual(resp.status_code, 400)
+            errors = json.loads(resp.data.decode())['errors']
+            self.assertIn('user_name', errors['0'])
+
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def test_order_events(self):
+        """
+        Test streaming order changes as server-sent events.
+        """
+        allow_ordering()
+        app.config['ORDER_EVENTS_TIMEOUT'] = 0
+        resp = self.client.get('/order_events')
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertEqual(resp.data, b'retry: 3000\n\n')
+        data = {
+            'cost': '12',
+            'company': 'Pod Koziołkiem',
+            'description': 'zamowienie na zywo',
+            'send_me_a_copy': 'false',
+            'arrival_time': '12:00',
+        }
+        self.client.post('/order', data=data)
+        data['description'] = 'zmienione na zywo'
+        data['date'] = '2015-01-01'
+        self.client.post('/order_edit/1/', data=data)
+        self.client.post('/delete_order/1')
+        resp = self.client.get('/order_events?cursor=0')
+        events = resp.data.decode().split('\n\n')[1:-1]
+        self.assertEqual(len(events), 3)
+        self.assertEqual(
+            [event.split('\n')[1] for event in events],
+            ['event: created', 'event: edited', 'event: deleted'],
+        )
+        self.assertEqual(events[0].split('\n')[0], 'id: 1')
+        order = json.loads(events[1].split('\n')[2][len('data: '):])
+        self.assertEqual(order['id'], 1)
+        self.assertEqual(order['description'], 'zmienione na zywo')
+        resp = self.client.get(
+            '/order_events',
+            headers={'Last-Event-ID': '2'},
+        )
+        self.assertIn(b'event: deleted', resp.data)
+        self.assertNotIn(b'event: edited', resp.data)
+        # process streaming to enough dashboards sends them away
+        app.config['ORDER_EVENTS_MAX_STREAMS'] = 0
+        resp = self.client.get('/order_events?cursor=0')
+        self.assertEqual(resp.data, b'retry: 30000\n\n')
+        app.config.pop('ORDER_EVENTS_MAX_STREAMS')
+        app.config.pop('ORDER_EVENTS_TIMEOUT')
+
     @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
     def test_company_summary_view(self):
         """
@@ -378,6 +715,7 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         # unpaid user changed to paid test
         data = {
             'did_user_pay_test@user.pl': 'on',
+            'shown_did_user_pay_test@user.pl': 'off',
         }
         resp = self.client.post('/finance/2015/2/2', data=data)
         self.assertEqual(resp.status_code, 302)
@@ -389,6 +727,35 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         self.assertIn('test@user.pl', str(resp.data))
         db.session.close()
 
+    def test_monthly_billing(self):
+        """
+        Test per user monthly orders number, cost and payment status.
+        """
+        fill_db()
+        today = date.today()
+        finance = Finance()
+        finance.user_name = 'x@x.pl'
+        finance.month = today.month
+        finance.year = today.year
+        finance.did_user_pay = True
+        db.session.add(finance)
+        db.session.commit()
+        finance_data = monthly_billing(today.year, today.month)
+        self.assertEqual(len(finance_data), 3)
+        self.assertEqual(
+            finance_data['test@user.pl'],
+            {
+                'username': 'test@user.pl',
+                'number_of_orders': 1,
+                'month_cost': 244,
+                'did_user_pay': False,
+            },
+        )
+        self.assertTrue(finance_data['x@x.pl']['did_user_pay'])
+        finance_data = monthly_billing(2015, 1, username='test_user')
+        self.assertEqual(list(finance_data), ['test_user'])
+        self.assertEqual(finance_data['test_user']['month_cost'], 123)
+
     @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
     def test_finance_mail_text_view(self):
         """
@@ -452,10 +819,53 @@ class LunchBackendViewsTestCase(unittest.TestCase):
             resp = self.client.post('/finance_mail_all', data=data)
             self.assertEquals(resp.status_code, 302)
             self.assertEqual(len(outbox), 2)
+            resp = self.client.get('/finance_mail_all')
+            self.assertIn(b'>2 sent</span>', resp.data)
+            # status is shown only once
+            resp = self.client.get('/finance_mail_all')
+            self.assertNotIn(b'sent</span>', resp.data)
             msg = outbox[0]
             self.assertTrue(msg.subject.startswith('Lunch'))
             self.assertIn('February', msg.body)
 
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def test_finance_mail_all_failures_fit_in_cookie(self):
+        """
+        Test if status of mail to many users does not overflow
+        session cookie.
+        """
+        allow_ordering()
+        for number in range(300):
+            # varied names, session cookie is compressed
+            username = '{}@example.com'.format(
+                sha1(str(number).encode()).hexdigest()[:20],
+            )
+            user = User()
+            user.username = username
+            user.email = username
+            db.session.add(user)
+            order = Order()
+            order.user_name = username
+            order.description = 'Zupa'
+            order.company = 'Tomas'
+            order.cost = 4
+            order.arrival_time = '12:00'
+            db.session.add(order)
+        db.session.commit()
+        with patch(
+            'flask_mail.Connection.send',
+            side_effect=smtplib.SMTPRecipientsRefused({}),
+        ):
+            resp = self.client.post(
+                '/finance_mail_all',
+                data={'send_mail': 'remind_all'},
+            )
+        self.assertEqual(resp.status_code, 302)
+        self.assertLess(len(resp.headers['Set-Cookie']), 4000)
+        resp = self.client.get('/finance_mail_all')
+        self.assertIn(b'>300 failed</span>', resp.data)
+        self.assertIn(b'Other failures are in the log.', resp.data)
+
     @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
     def test_payment_remind_view(self):
         """
@@ -571,6 +981,32 @@ class LunchBackendViewsTestCase(unittest.TestCase):
             self.assertIn('daili1', msg.body)
             self.assertEqual(msg.recipients, ['reminder@user.pl'])
 
+    def test_daily_reminder_recipients(self):
+        """
+        Test users who want reminder and did not order on given day.
+        """
+        fill_db()
+        self.assertEqual(
+            daily_reminder_recipients(date.today()),
+            ['reminder@user.pl'],
+        )
+        self.assertEqual(
+            daily_reminder_recipients(date(2015, 1, 5)),
+            ['reminder@user.pl', 'test@user.pl'],
+        )
+        order = Order()
+        order.description = 'Zupa'
+        order.company = 'Tomas'
+        order.cost = 4
+        order.user_name = 'reminder@user.pl'
+        order.arrival_time = '12:00'
+        db.session.add(order)
+        db.session.commit()
+        self.assertEqual(daily_reminder_recipients(date.today()), [])
+        with mail.record_messages() as outbox:
+            self.assertEqual(mail_daily_reminder(), [])
+            self.assertEqual(len(outbox), 0)
+
     def test_orders_summary_for_tv(self):
         """
         Test orders summary for tv view.
@@ -582,6 +1018,30 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         self.assertIn("Maly Gruby Nalesnik", str(resp.data))
         self.assertIn("Duzy Gruby Nalesnik", str(resp.data))
 
+    def test_orders_summary_for_tv_not_modified(self):
+        """
+        Test if unchanged tv page is answered with 304.
+        """
+        fill_db()
+        resp = self.client.get('/tv')
+        etag = resp.headers['ETag']
+        resp = self.client.get('/tv', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+        order = Order()
+        order.user_name = 'tv_user'
+        order.description = 'Nowe zamowienie'
+        order.company = 'Tomas'
+        order.arrival_time = '12:00'
+        order.cost = 10
+        order.date = datetime.now()
+        db.session.add(order)
+        db.session.commit()
+        resp = self.client.get('/tv', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        self.assertIn('Nowe zamowienie', str(resp.data))
+
     @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
     def test_finance_block_user(self):
         """
@@ -647,6 +1107,11 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         # test blocking
         resp = self.client.get('/finance_block_ordering')
         self.assertEqual(resp.status_code, 302)
+        version_id = OrderingInfo.query.get(1).version_id
+        resp = self.client.get('/finance_block_ordering')
+        self.assertEqual(resp.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual(OrderingInfo.query.get(1).version_id, version_id)
         resp = self.client.get('/order')
         self.assertEqual(resp.status_code, 302)
         self.assertNotIn("Tiramisu", str(resp.data))
@@ -713,6 +1178,9 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         self.assertEqual(food.o_type, "daniednia")
         self.assertEqual(food.date_available_from, make_datetime(date.today()))
         self.assertEqual(food.date_available_to, make_datetime(date.today()))
+        number_of_foods = Food.query.count()
+        resp = self.client.get('/add_daily_koziolek')
+        self.assertEqual(Food.query.count(), number_of_foods)
 
     @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
     @patch(
@@ -823,6 +1291,41 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         resp = self.client.get('/pizza_time/1')
         self.assertIn('You already ordered !', str(resp.data))
         self.assertNotIn('WielkaMargarittaZMisiem', str(resp.data))
+        pizza_orders = PizzaOrder.query.filter_by(event_id=1).all()
+        self.assertEqual(len(pizza_orders), 1)
+        self.assertEqual(pizza_orders[0].user_name, 'test_user')
+
+    def test_pizza_summary(self):
+        """
+        Test pizzas of event grouped by pizza and size.
+        """
+        fill_db()
+        for event_id in (1, 2):
+            event = Pizza()
+            event.id = event_id
+            event.pizza_ordering_is_allowed = True
+            db.session.add(event)
+        for event_id, user_name, pizza, size in (
+                (1, 'test_user', 'Hawai', 'big'),
+                (1, 'test@user.pl', 'Hawai', 'big'),
+                (1, 'x@x.pl', 'Hawai', 'small'),
+                (1, 'reminder@user.pl', 'Funghi', 'big'),
+                (2, 'test_user', 'Hawai', 'big'),
+        ):
+            pizza_order = PizzaOrder()
+            pizza_order.event_id = event_id
+            pizza_order.user_name = user_name
+            pizza_order.pizza = pizza
+            pizza_order.size = size
+            db.session.add(pizza_order)
+        db.session.commit()
+        summary = pizza_summary(1)
+        self.assertEqual(
+            [(row['pizza'], row['size'], row['count']) for row in summary],
+            [('Hawai', 'big', 2), ('Funghi', 'big', 1), ('Hawai', 'small', 1)],
+        )
+        self.assertEqual(summary[0]['users'], ['test@user.pl', 'test_user'])
+        self.assertEqual(pizza_summary(3), [])
 
     @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
     def test_pizza_time_stop(self):
@@ -846,138 +1349,1566 @@ class LunchBackendViewsTestCase(unittest.TestCase):
         self.assertNotIn('WielkaMargarittaZKotem', str(resp.data))
 
 
-class LunchBackendUtilsTestCase(unittest.TestCase):
+class LunchBackendOutboxTestCase(unittest.TestCase):
     """
-    Utils tests.
+    Mail outbox tests.
     """
+
     def setUp(self):
         """
         Before each test, set up a environment.
         """
-        pass
+        self.client = main.app.test_client()
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        app.config['MAIL_OUTBOX'] = True
 
     def tearDown(self):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        app.config['MAIL_OUTBOX'] = False
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
 
-    def test_get_current_date(self):
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    def test_order_mail_is_queued(self):
         """
-        Test current date.
+        Test if order confirmation is queued and sent by worker.
         """
-        self.assertEqual(utils.get_current_date(), date.today())
+        allow_ordering()
+        data = {
+            'cost': '13',
+            'company': 'Pod Koziołkiem',
+            'description': 'Zamowienie z kolejki',
+            'send_me_a_copy': 'true',
+            'arrival_time': '13:00',
+        }
+        with mail.record_messages() as outbox:
+            resp = self.client.post('/order', data=data)
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(len(outbox), 0)
+            queued = MailOutbox.query.one()
+            self.assertEqual(queued.recipients, 'mock@mock.com')
+            self.assertIsNone(queued.sent)
+            self.assertEqual(run_worker(once=True), 1)
+            self.assertEqual(len(outbox), 1)
+            self.assertIn('Zamowienie z kolejki', outbox[0].body)
+        self.assertIsNotNone(MailOutbox.query.one().sent)
+        self.assertEqual(send_queued(), 0)
+
+    def test_failed_mail_is_retried_later(self):
+        """
+        Test if failed message is scheduled with backoff.
+        """
+        queue_mail(Message('Lunch', recipients=['a@a.pl'], body='text'))
+        with patch(
+            'flask_mail.Connection.send',
+            side_effect=smtplib.SMTPRecipientsRefused({}),
+        ):
+            self.assertEqual(send_queued(), 0)
+        queued = MailOutbox.query.one()
+        self.assertEqual(queued.attempts, 1)
+        self.assertIsNone(queued.sent)
+        self.assertGreater(queued.send_after, datetime.utcnow())
+        self.assertEqual(send_queued(), 0)
+        queued.send_after = datetime.utcnow()
+        db.session.commit()
+        with mail.record_messages() as outbox:
+            self.assertEqual(send_queued(), 1)
+            self.assertEqual(outbox[0].recipients, ['a@a.pl'])
 
-    def test_get_current_datetime(self):
+    def test_queued_mail_is_committed_by_caller(self):
         """
-        Test current datetime.
+        Test if queued message is stored only with caller's transaction.
         """
-        self.assertAlmostEqual(
-            utils.get_current_datetime(),
-            datetime.now(),
-            delta=timedelta(microseconds=101),
-        )
+        queue_mail(Message('Lunch', recipients=['a@a.pl'], body='text'))
+        db.session.rollback()
+        self.assertEqual(MailOutbox.query.count(), 0)
+        queue_mail(Message('Lunch', recipients=['a@a.pl'], body='text'))
+        db.session.commit()
+        self.assertEqual(MailOutbox.query.count(), 1)
 
-    def test_make_date(self):
+    def test_bad_message_does_not_stop_others(self):
         """
-        Test make date.
+        Test if message which can not be sent at all is scheduled
+        for retry and the others are sent.
         """
+        queue_mail(Message('Lunch\nBcc: x@x.pl', recipients=['a@a.pl']))
+        queue_mail(Message('Lunch', recipients=['b@b.pl'], body='text'))
+        with mail.record_messages() as outbox:
+            self.assertEqual(send_queued(), 1)
+        self.assertEqual(outbox[0].recipients, ['b@b.pl'])
+        bad, good = MailOutbox.query.order_by(MailOutbox.id).all()
+        self.assertIsNone(bad.sent)
+        self.assertEqual(bad.attempts, 1)
+        self.assertIsNotNone(good.sent)
+
+    def test_sent_mail_is_committed_at_once(self):
+        """
+        Test if sent message is not sent again when worker stops
+        in the middle of batch.
+        """
+        queue_mail(Message('Lunch 1', recipients=['a@a.pl'], body='one'))
+        queue_mail(Message('Lunch 2', recipients=['b@b.pl'], body='two'))
+        send = flask_mail.Connection.send
+
+        def stop_at_second(connection, msg):
+            """
+            Stops worker before sending second message.
+            """
+            if msg.recipients == ['b@b.pl']:
+                raise KeyboardInterrupt()
+            return send(connection, msg)
+
+        with mail.record_messages(), \
+                patch('flask_mail.Connection.send', new=stop_at_second):
+            with self.assertRaises(KeyboardInterrupt):
+                send_queued()
+        db.session.rollback()
+        first, second = MailOutbox.query.order_by(MailOutbox.id).all()
+        self.assertIsNotNone(first.sent)
+        self.assertIsNone(second.sent)
+        with mail.record_messages() as outbox:
+            self.assertEqual(send_queued(), 1)
+        self.assertEqual(outbox[0].recipients, ['b@b.pl'])
+
+    def test_send_bulk_in_batches(self):
+        """
+        Test if bulk mails share connection within batch and failure
+        of one message does not stop others.
+        """
+        app.config['MAIL_OUTBOX'] = False
+        messages = [
+            Message('Lunch', recipients=['{}@a.pl'.format(i)], body='text')
+            for i in range(5)
+        ]
+        send = flask_mail.Connection.send
+
+        def refuse_second(connection, msg):
+            """
+            Refuses second recipient.
+            """
+            if msg.recipients == ['1@a.pl']:
+                raise smtplib.SMTPRecipientsRefused({})
+            return send(connection, msg)
+
+        with mail.record_messages() as outbox, \
+                patch.object(mail, 'connect', wraps=mail.connect) as connect, \
+                patch('flask_mail.Connection.send', new=refuse_second):
+            status = send_bulk(messages, batch_size=2)
+        self.assertEqual(connect.call_count, 3)
+        self.assertEqual(len(outbox), 4)
+        self.assertEqual(list(status), ['{}@a.pl'.format(i) for i in range(5)])
+        self.assertEqual(status['1@a.pl']['status'], 'failed')
+        self.assertEqual(status['0@a.pl'], {'status': 'sent', 'error': None})
+        self.assertEqual(status['4@a.pl']['status'], 'sent')
+
+    def test_send_bulk_queues_messages(self):
+        """
+        Test if bulk mails are queued when outbox is enabled.
+        """
+        status = send_bulk([
+            Message('Lunch', recipients=['a@a.pl'], body='one'),
+            Message('Lunch', recipients=['b@b.pl'], body='two'),
+        ])
+        self.assertEqual(status['b@b.pl']['status'], 'queued')
+        self.assertEqual(MailOutbox.query.count(), 2)
+
+    @unittest.skipIf(aiosmtpd is None, 'aiosmtpd is not installed')
+    def test_send_to_local_smtp_server(self):
+        """
+        Test delivering queued messages through SMTP.
+        """
+        queue_mail(Message('Lunch 1', recipients=['a@a.pl'], body='one'))
+        queue_mail(Message('Lunch 2', recipients=['b@b.pl'], body='two'))
+        with LocalSMTPServer() as smtp_server:
+            self.assertEqual(send_queued(), 2)
         self.assertEqual(
-            utils.make_date(datetime.now()),
-            date.today()
+            [message.rcpt_tos for message in smtp_server.messages],
+            [['a@a.pl'], ['b@b.pl']],
         )
+        self.assertIn(b'two', smtp_server.messages[1].content)
+
+
+# edits mail texts in DATABASE_URI from separate process, like web worker
+EDIT_MAIL_TEXT_SCRIPT = """
+import os
+from lunch_app import tests
+tests.setUp()
+from lunch_app.main import app, db
+from lunch_app.models import MailText
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URI']
+with app.app_context():
+    mail_text = MailText.query.first()
+    mail_text.daily_reminder_subject = os.environ['SUBJECT']
+    mail_text.daily_reminder = os.environ['BODY']
+    db.session.commit()
+"""
 
-    def test_next_month(self):
+# stores food of DAY in DATABASE_URI from separate process
+IMPORT_MENU_SCRIPT = """
+import datetime, os
+from lunch_app import tests
+tests.setUp()
+from lunch_app.main import app
+from lunch_app.menu_import import food_row, store_foods
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URI']
+day = datetime.datetime.strptime(os.environ['DAY'], '%Y-%m-%d')
+with app.app_context():
+    store_foods([food_row('Tomas', 'zupa', 4, 'daniednia', day, day)])
+"""
+
+
+class LunchBackendCacheTestCase(unittest.TestCase):
+    """
+    Settings cache tests.
+    """
+
+    def setUp(self):
         """
-        Test next month function.
+        Before each test, set up a environment.
+        """
+        db.create_all()
+        allow_ordering()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+
+    def test_settings_are_cached(self):
+        """
+        Test if settings are read from db only once.
+        """
+        mail_text = get_mail_text()
+        self.assertEqual(mail_text.daily_reminder, 'daili1')
+        self.assertIs(get_mail_text(), mail_text)
+        self.assertIs(get_ordering_info(), get_ordering_info())
+
+    def test_settings_invalidation(self):
+        """
+        Test if committed settings changes invalidate cache.
         """
+        self.assertTrue(get_ordering_info().is_allowed)
+        ordering_info = OrderingInfo.query.get(1)
+        ordering_info.is_allowed = False
+        db.session.commit()
+        self.assertFalse(get_ordering_info().is_allowed)
+        mail_text = MailText.query.get(1)
+        mail_text.daily_reminder = 'new text'
+        db.session.rollback()
+        self.assertEqual(get_mail_text().daily_reminder, 'daili1')
+        mail_text.daily_reminder = 'new text'
+        db.session.commit()
+        self.assertEqual(get_mail_text().daily_reminder, 'new text')
+
+    def test_menu_cache(self):
+        """
+        Test if daily menu is grouped, cached and invalidated.
+        """
+        for company, o_type in [
+                ('Tomas', 'daniednia'),
+                ('Pod Koziołkiem', 'tygodniowe'),
+                ('Tomas', 'menu'),
+        ]:
+            food = Food()
+            food.company = company
+            food.description = o_type
+            food.cost = 10
+            food.date_available_from = datetime.now() - timedelta(1)
+            food.date_available_to = datetime.now() + timedelta(1)
+            food.o_type = o_type
+            db.session.add(food)
+        db.session.commit()
+        menu = get_menu(date.today())
+        self.assertIs(get_menu(date.today()), menu)
         self.assertEqual(
-            utils.next_month(2015, 12),
-            (2016, 1),
+            [food.description for food in menu.daily('Tomas')],
+            ['daniednia'],
         )
         self.assertEqual(
-            utils.next_month(2015, 6),
-            (2015, 7),
+            [food.description for food in menu.daily('Pod Koziołkiem')],
+            ['tygodniowe'],
+        )
+        self.assertEqual(
+            [food.description for food in menu.standard],
+            ['menu'],
         )
+        self.assertEqual(len(menu.daily_foods), 2)
+        self.assertEqual(get_menu(date.today() + timedelta(5)).daily_foods, [])
+        food = Food.query.get(1)
+        food.description = 'zupa'
+        db.session.commit()
+        menu = get_menu(date.today())
+        self.assertEqual(menu.daily('Tomas')[0].description, 'zupa')
 
-    def test_previous_month(self):
+    def use_database_file(self):
         """
-        Test previous month function.
+        Switches app to database file which other processes can open.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+
+        def restore():
+            """
+            Drops database file and switches back to test database.
+            """
+            db.session.remove()
+            db.drop_all()
+            app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+            shutil.rmtree(tmp_dir)
+
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+            os.path.join(tmp_dir, 'lunch.db'),
+        )
+        self.addCleanup(restore)
+        db.create_all()
+
+    def run_other_process(self, script, **env):
+        """
+        Runs script in separate python process using the same database.
+        """
+        subprocess.check_call(
+            [sys.executable, '-c', script],
+            env=dict(
+                os.environ,
+                PYTHONPATH=os.path.dirname(os.path.dirname(__file__)),
+                DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'],
+                **env
+            ),
+            stderr=subprocess.DEVNULL,
+        )
+
+    def test_invalidation_from_other_process(self):
+        """
+        Test if menu imported by other process, like import_menus
+        daemon, invalidates menu cached by this one.
         """
+        self.use_database_file()
+        self.assertEqual(get_menu(date.today()).daily_foods, [])
+        self.run_other_process(
+            IMPORT_MENU_SCRIPT,
+            DAY=date.today().isoformat(),
+        )
         self.assertEqual(
-            utils.previous_month(2015, 1),
-            (2014, 12),
+            [food.description for food in get_menu(date.today()).daily(
+                'Tomas',
+            )],
+            ['zupa'],
         )
+
+    def test_reminder_sees_mail_text_edited_by_other_process(self):
+        """
+        Test if daily reminder daemon mails text edited in web worker
+        after the daemon cached it.
+        """
+        self.use_database_file()
+        fill_db()
+        db.session.remove()
+        day = date.today()
+        with app.app_context(), mail.record_messages() as outbox:
+            self.assertEqual(mail_daily_reminder(day), ['reminder@user.pl'])
+            db.session.remove()
+            self.run_other_process(
+                EDIT_MAIL_TEXT_SCRIPT,
+                SUBJECT='Order lunch',
+                BODY='Lunch is waiting',
+            )
+            self.assertEqual(mail_daily_reminder(day), ['reminder@user.pl'])
         self.assertEqual(
-            utils.previous_month(2015, 6),
-            (2015, 5),
+            outbox[0].subject,
+            'STX Lunch daili_subject_reminder {}'.format(day),
         )
+        self.assertEqual(outbox[1].subject, 'Order lunch {}'.format(day))
+        self.assertEqual(outbox[1].body, 'Lunch is waiting')
 
 
-class LunchBackendPermissionsTestCase(unittest.TestCase):
+def explain(connection, query):
     """
-    Permissions tests.
+    Returns query plan of ORM query as text.
+    """
+    dialect = connection.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    if dialect.name == 'sqlite':
+        return str(connection.execute(
+            'EXPLAIN QUERY PLAN {}'.format(compiled),
+            tuple(compiled.params[name] for name in compiled.positiontup),
+        ).fetchall())
+    return str(connection.execute(
+        'EXPLAIN {}'.format(compiled),
+        compiled.params,
+    ).fetchall())
+
+
+class LunchBackendIndexesTestCase(unittest.TestCase):
     """
+    Order indexes tests.
+    """
+
     def setUp(self):
         """
         Before each test, set up a environment.
         """
-        self.client = main.app.test_client()
+        db.create_all()
 
     def tearDown(self):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        db.session.remove()
+        db.drop_all()
 
-    def test_permissions(self):
+    def assert_uses_indexes(self, connection):
         """
-        Tests if permissions decorator works properly
+        Checks if Order query helpers hit Order indexes.
         """
-        resp = self.client.get('add_food')
-        self.assertEqual(resp.status_code, 401)
-        resp_2 = self.client.get('day_summary')
-        self.assertEqual(resp_2.status_code, 401)
+        plan = explain(connection, Order.for_day(date.today()))
+        self.assertIn('ix_order_date_company_arrival_time', plan)
+        plan = explain(connection, Order.for_month(2015, 2).filter(
+            Order.company == 'Tomas',
+        ))
+        self.assertIn('ix_order_date_company_arrival_time', plan)
+        plan = explain(connection, Order.for_user_in_range(
+            'test_user',
+            datetime(2015, 1, 1),
+            datetime(2015, 12, 31),
+        ))
+        self.assertIn('ix_order_user_name_date', plan)
 
+    def test_sqlite_indexes(self):
+        """
+        Test if queries use indexes on SQLite.
+        """
+        fill_db()
+        with db.engine.connect() as connection:
+            self.assert_uses_indexes(connection)
 
-class LunchWebCrawlersTestCases(unittest.TestCase):
+    @unittest.skipUnless(
+        os.environ.get('TEST_POSTGRESQL_URI'),
+        'TEST_POSTGRESQL_URI is not set',
+    )
+    def test_postgresql_indexes(self):
+        """
+        Test if queries use indexes on PostgreSQL.
+        """
+        engine = create_engine(os.environ['TEST_POSTGRESQL_URI'])
+        db.metadata.create_all(engine)
+        try:
+            with engine.connect() as connection:
+                # tables are tiny so planer would prefer sequential scan
+                connection.execute('SET enable_seqscan TO off')
+                self.assert_uses_indexes(connection)
+        finally:
+            db.metadata.drop_all(engine)
+
+
+class LunchBackendBillingTestCase(unittest.TestCase):
     """
-    Webcrawlers tests.
+    Monthly billing kept up to date with orders.
     """
+
     def setUp(self):
         """
         Before each test, set up a environment.
         """
-        self.client = main.app.test_client()
+        db.create_all()
 
     def tearDown(self):
         """
         Get rid of unused objects after each test.
         """
-        pass
+        db.session.remove()
+        db.drop_all()
 
-    @patch(
-        'lunch_app.webcrawler.read_webpage',
-        new=MOCK_WWW_KOZIOLEK,
+    @staticmethod
+    def billing_rows():
+        """
+        Returns billing rows as sorted tuples.
+        """
+        return sorted(
+            (
+                row.user_name,
+                row.year,
+                row.month,
+                row.company,
+                row.orders_count,
+                round(row.total_cost, 2),
+            )
+            for row in MonthlyBilling.query.all()
+        )
+
+    def assert_billing_is_rebuilt(self):
+        """
+        Checks if incrementally updated billing equals rebuilt one.
+        """
+        rows = self.billing_rows()
+        rebuild_monthly_billing()
+        self.assertEqual(rows, self.billing_rows())
+
+    def test_billing_follows_orders(self):
+        """
+        Test billing after orders were added, changed and deleted.
+        """
+        fill_db()
+        today = date.today()
+        self.assertIn(
+            ('test_user', 2015, 1, 'Tomas', 1, 123),
+            self.billing_rows(),
+        )
+        self.assert_billing_is_rebuilt()
+        order = Order.query.filter(Order.cost == 123).one()
+        order.cost = 100
+        order.company = 'Pod Koziołkiem'
+        db.session.commit()
+        self.assertIn(
+            ('test_user', 2015, 1, 'Pod Koziołkiem', 1, 100),
+            self.billing_rows(),
+        )
+        self.assert_billing_is_rebuilt()
+        # expired by commit, old values are loaded on change
+        order.date = datetime(2015, 2, 1)
+        order.user_name = 'x@x.pl'
+        db.session.commit()
+        self.assertEqual(
+            [row for row in self.billing_rows() if row[1:3] == (2015, 1)],
+            [],
+        )
+        self.assert_billing_is_rebuilt()
+        for order in Order.for_day(today).all():
+            db.session.delete(order)
+        db.session.commit()
+        self.assertEqual(
+            self.billing_rows(),
+            [('x@x.pl', 2015, 2, 'Pod Koziołkiem', 1, 100)],
+        )
+        self.assert_billing_is_rebuilt()
+
+    def test_billing_rolled_back_with_orders(self):
+        """
+        Test if billing changes are rolled back together with orders.
+        """
+        fill_db()
+        rows = self.billing_rows()
+        order = Order(cost=10, company='Tomas')
+        order.user_name = 'test_user'
+        db.session.add(order)
+        db.session.flush()
+        self.assertNotEqual(rows, self.billing_rows())
+        db.session.rollback()
+        self.assertEqual(rows, self.billing_rows())
+
+    def test_bill_order_rows(self):
+        """
+        Test billing of orders inserted without ORM.
+        """
+        rows = [
+            {
+                'user_name': 'test_user',
+                'company': 'Tomas',
+                'cost': 12.5,
+                'date': datetime(2015, 2, day),
+            }
+            for day in (2, 3)
+        ]
+        db.session.bulk_insert_mappings(Order, rows)
+        bill_order_rows(rows)
+        db.session.commit()
+        self.assertEqual(
+            self.billing_rows(),
+            [('test_user', 2015, 2, 'Tomas', 2, 25)],
+        )
+        self.assert_billing_is_rebuilt()
+
+
+    def test_billing_row_created_concurrently(self):
+        """
+        Test if order is billed when other transaction creates billing
+        row of its month between update and insert.
+        """
+        table = MonthlyBilling.__table__
+        connection = db.session.connection()
+
+        class RacingConnection(object):
+            """
+            Connection inserting competing row right after first update.
+            """
+            raced = False
+
+            def __getattr__(self, name):
+                return getattr(connection, name)
+
+            def execute(self, statement, *args, **kwargs):
+                """
+                Runs statement, then insert of other transaction once.
+                """
+                result = connection.execute(statement, *args, **kwargs)
+                if isinstance(statement, Update) and not self.raced:
+                    self.raced = True
+                    connection.execute(table.insert().values(
+                        user_name='test_user',
+                        year=2015,
+                        month=2,
+                        company='Tomas',
+                        orders_count=1,
+                        total_cost=10,
+                    ))
+                return result
+
+        apply_deltas(
+            RacingConnection(),
+            {('test_user', 2015, 2, 'Tomas'): [1, 12.5]},
+        )
+        db.session.commit()
+        self.assertEqual(
+            self.billing_rows(),
+            [('test_user', 2015, 2, 'Tomas', 2, 22.5)],
+        )
+
+
+class LunchBackendConcurrencyTestCase(unittest.TestCase):
+    """
+    Concurrent requests changing versioned rows.
+    """
+    THREADS = 8
+    YEAR = 2015
+    MONTH = 2
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        db.session.remove()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri
+        shutil.rmtree(self.tmp_dir)
+
+    def usernames(self):
+        """
+        Returns users having orders in tested month.
+        """
+        return [
+            'user{}@concurrency.local'.format(number)
+            for number in range(self.THREADS)
+        ]
+
+    def fill(self, database_uri):
+        """
+        Creates database with orders and unpaid finances of users,
+        allowed ordering and open pizza event.
+        """
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+        db.drop_all()
+        db.create_all()
+        allow_ordering()
+        for number, username in enumerate(self.usernames()):
+            user = User()
+            user.username = username
+            user.email = username
+            db.session.add(user)
+            order = Order()
+            order.user_name = username
+            order.description = 'Zupa'
+            order.company = 'Tomas'
+            order.cost = 10
+            order.arrival_time = '12:00'
+            order.date = datetime(self.YEAR, self.MONTH, 2, 9, number)
+            db.session.add(order)
+            finance = Finance()
+            finance.user_name = username
+            finance.year = self.YEAR
+            finance.month = self.MONTH
+            finance.did_user_pay = False
+            db.session.add(finance)
+        pizza = Pizza()
+        pizza.id = 1
+        pizza.who_created = MOCK_ADMIN.username
+        pizza.pizza_ordering_is_allowed = True
+        db.session.add(pizza)
+        db.session.commit()
+        db.session.remove()
+
+    def finance_form(self, username):
+        """
+        Returns finance form shown with every user unpaid and submitted
+        with only username marked as paid.
+        """
+        data = {
+            'shown_did_user_pay_' + name: 'off'
+            for name in self.usernames()
+        }
+        data['did_user_pay_' + username] = 'on'
+        return data
+
+    def request_concurrently(self, requests):
+        """
+        Makes requests to views from many threads at once, every thread
+        with own client and database session. Returns status codes.
+        """
+        barrier = threading.Barrier(len(requests))
+        codes = []
+
+        def worker(method, url, data):
+            """
+            Makes single request once all threads are ready.
+            """
+            client = app.test_client()
+            barrier.wait()
+            try:
+                codes.append(client.open(
+                    url,
+                    method=method,
+                    data=data,
+                ).status_code)
+            finally:
+                db.session.remove()
+
+        threads = [
+            threading.Thread(target=worker, args=request)
+            for request in requests
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return codes
+
+    def check_no_lost_updates(self, database_uri):
+        """
+        Every admin marks other user as paid at the same time, none of
+        the changes is overwritten by forms of the others.
+        """
+        self.fill(database_uri)
+        url = '/finance/{}/{}/0'.format(self.YEAR, self.MONTH)
+        codes = self.request_concurrently([
+            ('POST', url, self.finance_form(username))
+            for username in self.usernames()
+        ])
+        self.assertEqual(codes, [302] * self.THREADS)
+        finances = Finance.query.order_by(Finance.user_name).all()
+        self.assertEqual(
+            [finance.user_name for finance in finances],
+            self.usernames(),
+        )
+        for finance in finances:
+            self.assertTrue(finance.did_user_pay)
+            self.assertEqual(finance.version_id, 2)
+
+    def check_single_change(self, database_uri):
+        """
+        Admins do the same change at the same time, it is written once
+        and the others see it was already done.
+        """
+        self.fill(database_uri)
+        username = self.usernames()[0]
+        url = '/finance/{}/{}/0'.format(self.YEAR, self.MONTH)
+        codes = self.request_concurrently(
+            [('POST', url, self.finance_form(username))] * self.THREADS +
+            [('GET', '/finance_block_ordering', None)] * self.THREADS +
+            [('GET', '/pizza_time_stop/1', None)] * self.THREADS
+        )
+        self.assertEqual(codes, [302] * self.THREADS * 3)
+        finance = Finance.query.filter(Finance.user_name == username).one()
+        self.assertTrue(finance.did_user_pay)
+        self.assertEqual(finance.version_id, 2)
+        ordering_info = OrderingInfo.query.get(1)
+        self.assertFalse(ordering_info.is_allowed)
+        self.assertEqual(ordering_info.version_id, 2)
+        pizza = Pizza.query.get(1)
+        self.assertFalse(pizza.pizza_ordering_is_allowed)
+        self.assertEqual(pizza.version_id, 2)
+
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    def test_no_lost_updates_sqlite(self):
+        """
+        Test concurrent finance, ordering and pizza changes on SQLite
+        file shared by threads.
+        """
+        database_uri = 'sqlite:///{}'.format(
+            os.path.join(self.tmp_dir, 'lunch.db'),
+        )
+        self.check_no_lost_updates(database_uri)
+        self.check_single_change(database_uri)
+
+    @unittest.skipUnless(
+        os.environ.get('TEST_POSTGRESQL_URI'),
+        'TEST_POSTGRESQL_URI is not set',
     )
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    def test_no_lost_updates_postgresql(self):
+        """
+        Test concurrent finance, ordering and pizza changes on PostgreSQL.
+        """
+        database_uri = os.environ['TEST_POSTGRESQL_URI']
+        self.check_no_lost_updates(database_uri)
+        self.check_single_change(database_uri)
+
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    def test_stale_finance_form(self):
+        """
+        Test if form shown before other admin's change does not
+        overwrite it.
+        """
+        self.fill(self.database_uri)
+        first, second = self.usernames()[:2]
+        client = app.test_client()
+        url = '/finance/{}/{}/0'.format(self.YEAR, self.MONTH)
+        resp = client.post(url, data=self.finance_form(first))
+        self.assertEqual(resp.status_code, 302)
+        # the same page submitted again, first user unchecked
+        data = self.finance_form(second)
+        data['did_user_pay_' + first] = 'off'
+        resp = client.post(url, data=data)
+        self.assertEqual(resp.status_code, 302)
+        # the same page submitted again, first user checked again
+        resp = client.post(url, data=self.finance_form(first))
+        self.assertEqual(resp.status_code, 302)
+        resp = client.get(url)
+        self.assertIn('was changed by someone else', str(resp.data))
+        paid = {
+            finance.user_name: finance.did_user_pay
+            for finance in Finance.query.all()
+        }
+        self.assertTrue(paid[first])
+        self.assertTrue(paid[second])
+
+
+class LunchBackendLoadTestTestCase(unittest.TestCase):
+    """
+    Load test harness tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        db.create_all()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        app.config['LOADTEST_LOGIN'] = False
+        app.config.pop('LOADTEST_ALLOWED_IPS', None)
+        db.session.remove()
+        db.drop_all()
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri
+        shutil.rmtree(self.tmp_dir)
+
+    def test_percentile(self):
+        """
+        Test nearest rank percentiles.
+        """
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_loadtest_login(self):
+        """
+        Test if only synthetic users log in by header, only when load
+        test login is enabled and only from allowed addresses.
+        """
+        fill_db()
+        fill_loadtest_db(2)
+
+        def login_by_header(username, remote_addr='127.0.0.1', **headers):
+            """
+            Returns user logged in by request with login header.
+            """
+            headers[LOGIN_HEADER] = username
+            with app.test_request_context(
+                    headers=headers,
+                    environ_base={'REMOTE_ADDR': remote_addr},
+            ):
+                return current_user._get_current_object()
+
+        self.assertTrue(login_by_header(loadtest_username(1)).is_anonymous())
+        app.config['LOADTEST_LOGIN'] = True
+        self.assertEqual(
+            login_by_header(loadtest_username(1)).username,
+            loadtest_username(1),
+        )
+        self.assertTrue(login_by_header('test_user').is_anonymous())
+        self.assertTrue(login_by_header(loadtest_username(0), '::1').admin)
+        # admin of load test can not be used from other hosts
+        self.assertTrue(
+            login_by_header(loadtest_username(0), '10.0.0.1').is_anonymous()
+        )
+        self.assertTrue(login_by_header(
+            loadtest_username(0),
+            X_Forwarded_For='10.0.0.1',
+        ).is_anonymous())
+        app.config['LOADTEST_ALLOWED_IPS'] = ('10.0.0.1',)
+        self.assertTrue(login_by_header(loadtest_username(0), '10.0.0.1').admin)
+
+    def test_run_loadtest(self):
+        """
+        Test short load of local server shared database file.
+        """
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+            os.path.join(self.tmp_dir, 'loadtest.db'),
+        )
+        db.create_all()
+        report = run_loadtest(
+            users=3,
+            duration=1,
+            think_time=0,
+            keep_data=True,
+        )
+        self.assertEqual(
+            list(report),
+            [label for label, _, _, _, _ in SCENARIO],
+        )
+        self.assertGreater(
+            sum(row['requests'] for row in report.values()),
+            0,
+        )
+        for row in report.values():
+            if row['requests']:
+                self.assertGreaterEqual(row['p99'], row['p50'])
+        self.assertEqual(User.query.count(), 3)
+        versions = dict(
+            db.session.query(CacheVersion.name, CacheVersion.token)
+        )
+        remove_loadtest_data()
+        # other processes see the change through versions in db
+        changed = dict(
+            db.session.query(CacheVersion.name, CacheVersion.token)
+        )
+        for name in ('menu_version', 'orders_version'):
+            self.assertNotEqual(changed[name], versions[name])
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Order.query.count(), 0)
+        self.assertEqual(MonthlyBilling.query.count(), 0)
+
+    def test_loadtest_with_dashboards(self):
+        """
+        Test if orders are served while more dashboards stream order
+        events than server has threads.
+        """
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(
+            os.path.join(self.tmp_dir, 'loadtest.db'),
+        )
+        db.create_all()
+        app.config['ORDER_EVENTS_TIMEOUT'] = 5
+        try:
+            report = run_loadtest(
+                users=2,
+                duration=2,
+                think_time=0,
+                dashboards=SERVER_THREADS + 2,
+            )
+        finally:
+            app.config.pop('ORDER_EVENTS_TIMEOUT')
+        self.assertEqual(
+            report[DASHBOARD_LABEL]['requests'],
+            SERVER_THREADS + 2,
+        )
+        self.assertEqual(report[DASHBOARD_LABEL]['errors'], 0)
+        self.assertGreater(report['POST /order']['requests'], 0)
+        self.assertEqual(report['POST /order']['errors'], 0)
+        # waiting for thread held by stream would take its whole timeout
+        self.assertLess(report['POST /order']['p99'], 2)
+        # streams over the limit reconnect after duration of load
+        for _ in range(100):
+            if not stream_slots.count:
+                break
+            sleep(0.1)
+        self.assertEqual(stream_slots.count, 0)
+
+
+class LunchBackendProfilingTestCase(unittest.TestCase):
+    """
+    Request profiling tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+        self.tmp_dir = tempfile.mkdtemp()
+        app.config['PROFILE_DIR'] = self.tmp_dir
+        app.config['LOADTEST_LOGIN'] = True
+        db.create_all()
+        fill_db()
+        fill_loadtest_db(2)
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        app.config['PROFILE_REQUESTS'] = False
+        app.config['LOADTEST_LOGIN'] = False
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_export(self, number, headers=None):
+        """
+        Requests orders export as synthetic user of given number.
+        """
+        headers = dict(headers or {})
+        headers[LOGIN_HEADER] = loadtest_username(number)
+        resp = self.client.get('/export/orders/2015/csv', headers=headers)
+        resp.get_data()
+        # server closes sent response, profile is saved then
+        resp.close()
+        return resp
+
+    def test_profile_header(self):
+        """
+        Test if only requests of admins asking for it are profiled.
+        """
+        self.assertEqual(self.get_export(0).status_code, 200)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        resp = self.get_export(1, {PROFILE_HEADER: '1'})
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        resp = self.get_export(0, {PROFILE_HEADER: '1'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, self.get_export(0).data)
+        files = sorted(os.listdir(self.tmp_dir))
+        self.assertEqual(len(files), 2)
+        self.assertRegex(
+            files[0],
+            r'-GET-export_orders_2015_csv-\d+ms\.collapsed$',
+        )
+        self.assertEqual(files[1], files[0].replace('.collapsed', '.prof'))
+        with open(os.path.join(self.tmp_dir, files[0])) as collapsed:
+            self.assertIn('(export_orders)', collapsed.read())
+
+    def test_profile_requests(self):
+        """
+        Test if every request is profiled when enabled in configuration.
+        """
+        app.config['PROFILE_REQUESTS'] = True
+        self.assertEqual(self.get_export(1).status_code, 401)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 2)
+
+    def test_profile_streamed_response(self):
+        """
+        Test if streamed response is sent while being profiled.
+        """
+        app.config['ORDER_EVENTS_TIMEOUT'] = 10
+        try:
+            start = default_timer()
+            resp = self.client.get('/order_events', headers={
+                LOGIN_HEADER: loadtest_username(0),
+                PROFILE_HEADER: '1',
+            })
+            self.assertEqual(next(iter(resp.response)), b'retry: 3000\n\n')
+            self.assertLess(default_timer() - start, 5)
+            self.assertEqual(os.listdir(self.tmp_dir), [])
+            resp.close()
+        finally:
+            app.config.pop('ORDER_EVENTS_TIMEOUT')
+        files = sorted(os.listdir(self.tmp_dir))
+        self.assertEqual(len(files), 2)
+        self.assertRegex(files[0], r'-GET-order_events-\d+ms\.collapsed$')
+
+    def test_profile_request(self):
+        """
+        Test profiling of single request made as given user.
+        """
+        app.config['LOADTEST_LOGIN'] = False
+        status, filename, stats = profile_request(
+            app,
+            '/export/orders/2015/csv?company=Tomas',
+            username=loadtest_username(0),
+        )
+        self.assertEqual(status, 200)
+        self.assertTrue(os.path.exists(filename))
+        self.assertRegex(
+            filename,
+            r'-GET-export_orders_2015_csv-\d+ms\.prof$',
+        )
+        self.assertTrue(any(
+            name == 'export_orders' for _, _, name in stats.stats
+        ))
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 2)
+        with self.assertRaises(ValueError):
+            profile_request(app, '/', username='nobody')
+
+    def test_collapsed_stacks(self):
+        """
+        Test if time of function is split among its callers.
+        """
+        main_func = ('app.py', 1, 'main')
+        left = ('app.py', 5, 'left')
+        right = ('app.py', 9, 'right')
+        work = ('~', 0, 'work')
+        stats = {
+            main_func: (1, 1, 0.001, 0.01, {}),
+            left: (1, 1, 0.001, 0.004, {main_func: (1, 1, 0.001, 0.004)}),
+            right: (1, 1, 0.001, 0.005, {main_func: (1, 1, 0.001, 0.005)}),
+            work: (2, 2, 0.007, 0.007, {
+                left: (1, 1, 0.003, 0.003),
+                right: (1, 1, 0.004, 0.004),
+            }),
+        }
+        self.assertEqual(collapsed_stacks(stats), {
+            'app.py:1(main)': 1000,
+            'app.py:1(main);app.py:5(left)': 1000,
+            'app.py:1(main);app.py:5(left);work': 3000,
+            'app.py:1(main);app.py:9(right)': 1000,
+            'app.py:1(main);app.py:9(right);work': 4000,
+        })
+
+
+class LunchBackendMetricsTestCase(unittest.TestCase):
+    """
+    Runtime metrics tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+        self.tmp_dir = tempfile.mkdtemp()
+        registry.values.clear()
+        db.create_all()
+        fill_db()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        app.config['METRICS_DIR'] = None
+        registry.values.clear()
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_metrics_view(self):
+        """
+        Test if requests, queries and cache lookups are exposed.
+        """
+        self.assertEqual(self.client.get('/info').status_code, 200)
+        self.client.get('/order')
+        self.client.get('/order')
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        text = resp.data.decode()
+        self.assertIn('# TYPE lunch_http_request_duration_seconds histogram',
+                      text)
+        self.assertIn(
+            'lunch_http_requests_total{endpoint="info",method="GET",'
+            'status="200"} 1\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_http_request_duration_seconds_count'
+            '{endpoint="create_order"} 2',
+            text,
+        )
+        self.assertIn(
+            'lunch_http_request_duration_seconds_bucket'
+            '{endpoint="create_order",'
+            'le="+Inf"} 2\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_sql_queries_per_request_count{endpoint="info"} 1\n',
+            text,
+        )
+        self.assertIn('lunch_sql_queries_total{endpoint="info"} ', text)
+        self.assertIn(
+            'lunch_cache_requests_total{cache="settings",result="hit"} ',
+            text,
+        )
+        resp = self.client.get(
+            '/metrics',
+            environ_base={'REMOTE_ADDR': '10.0.0.1'},
+        )
+        self.assertEqual(resp.status_code, 403)
+
+    def test_timed(self):
+        """
+        Test if duration and status of block is observed.
+        """
+        with timed('lunch_smtp_send_duration_seconds'):
+            pass
+        with self.assertRaises(ValueError):
+            with timed('lunch_smtp_send_duration_seconds'):
+                raise ValueError()
+        with timed('lunch_crawler_fetch_duration_seconds', host='a') as labels:
+            labels['status'] = 'not_modified'
+        text = exposition(registry.collect())
+        self.assertIn(
+            'lunch_smtp_send_duration_seconds_count{status="ok"} 1\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_smtp_send_duration_seconds_count{status="error"} 1\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_crawler_fetch_duration_seconds_bucket{host="a",'
+            'status="not_modified",le="0.005"} 1\n',
+            text,
+        )
+
+    def test_metrics_of_workers(self):
+        """
+        Test if metrics written by other processes are merged.
+        """
+        app.config['METRICS_DIR'] = self.tmp_dir
+        registry.inc('lunch_sql_queries_total', {'endpoint': 'test'}, 2)
+        registry.observe(
+            'lunch_smtp_send_duration_seconds',
+            {'status': 'ok'},
+            0.2,
+        )
+        registry.flush()
+        os.rename(
+            registry.path(self.tmp_dir),
+            os.path.join(self.tmp_dir, '1.json'),
+        )
+        # other worker starts
+        registry.values.clear()
+        registry.inc('lunch_sql_queries_total', {'endpoint': 'test'})
+        registry.observe(
+            'lunch_smtp_send_duration_seconds',
+            {'status': 'ok'},
+            3,
+        )
+        text = exposition(registry.collect())
+        self.assertIn('lunch_sql_queries_total{endpoint="test"} 3\n', text)
+        self.assertIn(
+            'lunch_smtp_send_duration_seconds_bucket{status="ok",le="0.25"} '
+            '1\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_smtp_send_duration_seconds_bucket{status="ok",le="5"} '
+            '2\n',
+            text,
+        )
+        self.assertIn(
+            'lunch_smtp_send_duration_seconds_sum{status="ok"} 3.2\n',
+            text,
+        )
+        registry.flush()
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir)),
+            sorted(['1.json', os.path.basename(
+                registry.path(self.tmp_dir),
+            )]),
+        )
+
+
+class LunchBackendSeedTestCase(unittest.TestCase):
+    """
+    Synthetic data generator tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        db.create_all()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+
+    def test_seed(self):
+        """
+        Test if seeded orders, payments and billing are consistent.
+        """
+        # monday to sunday of two weeks
+        counts = seed(
+            users=20,
+            days=14,
+            orders_per_day=5,
+            last_day=date(2015, 2, 15),
+        )
+        self.assertEqual(counts['user'], 20)
+        self.assertEqual(counts['order'], 10 * 5)
+        self.assertEqual(counts['pizza'], 2)
+        self.assertEqual(counts['pizza_order'], 2 * 6)
+        self.assertEqual(Order.query.count(), 50)
+        self.assertEqual(Finance.query.filter(Finance.month == 2).count(), 20)
+        self.assertEqual(
+            db.session.query(Order.user_name, Order.date).filter(
+                Order.date >= datetime(2015, 2, 9),
+                Order.date < datetime(2015, 2, 10),
+            ).distinct().count(),
+            5,
+        )
+        self.assertEqual(
+            Order.query.filter(Order.date >= datetime(2015, 2, 14)).count(),
+            0,
+        )
+        self.assertEqual(
+            sum(row.orders_count for row in MonthlyBilling.query),
+            50,
+        )
+        self.assertTrue(User.query.get(1).admin)
+        self.assertEqual(
+            User.query.get(1).username,
+            seed_username(0),
+        )
+        with self.assertRaises(ValueError):
+            seed(users=1, days=1)
+
+
+class LunchBackendQueryBudgetTestCase(unittest.TestCase):
+    """
+    Query budgets of views tests.
+    """
+    # pages of views with query budget
+    BUDGET_URLS = {
+        'index': '/',
+        'overview': '/overview',
+        'create_order': '/order',
+        'day_summary': '/day_summary',
+        'my_orders': '/my_orders',
+        'info': '/info',
+        'order_details': '/order_details/1',
+        'edit_order': '/order_edit/1/',
+        'order_list': '/order_list',
+        'order_list_year_view': '/order_list/2/{year}',
+        'order_list_month_view': '/order_list/2/{year}/{month}',
+        'company_summary_view': '/company_summary',
+        'company_summary_month_view': '/company_summary/{year}/{month}',
+        'finance': '/finance/{year}/{month}/0',
+        'export_orders': '/export/orders/{year}/csv',
+        'export_user_totals': '/export/user_totals/{year}/{month}/json',
+        'finance_mail_text': '/finance_mail_text',
+        'finance_mail_all': '/finance_mail_all',
+        'finance_search_view': '/finance_search',
+        'orders_summary_for_tv': '/tv',
+        'finance_block_user': '/finance_block_user',
+        'pizza_time_view': '/pizza_time/1',
+    }
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+        db.create_all()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+
+    @patch('lunch_app.views.current_user', new=MOCK_ADMIN)
+    @patch('lunch_app.permissions.current_user', new=MOCK_ADMIN)
+    def count_view_queries(self):
+        """
+        Returns number of queries of every view with budget, requested
+        with empty caches.
+        """
+        today = date.today()
+        counts = {}
+        for endpoint, url in sorted(self.BUDGET_URLS.items()):
+            for cache in (menu_cache, orders_snapshot, settings_cache):
+                cache.invalidate()
+            with count_queries() as counter:
+                resp = self.client.get(
+                    url.format(year=today.year, month=today.month),
+                )
+            self.assertEqual(resp.status_code, 200, endpoint)
+            counts[endpoint] = counter.count
+        return counts
+
+    def test_count_queries(self):
+        """
+        Test if only queries of block are counted.
+        """
+        fill_db()
+        with count_queries() as counter:
+            User.query.all()
+            Order.query.count()
+        User.query.all()
+        self.assertEqual(counter.count, 2)
+        self.assertIn('FROM user', counter.statements[0])
+
+    def test_query_budgets(self):
+        """
+        Test if views stay within their query budgets and number of
+        their queries does not grow with data.
+        """
+        budgets = view_query_budgets()
+        self.assertEqual(set(budgets), set(self.BUDGET_URLS))
+        seed(users=10, days=14, orders_per_day=5, last_day=date.today())
+        small = self.count_view_queries()
+        for endpoint, count in small.items():
+            self.assertLessEqual(count, budgets[endpoint], endpoint)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        seed(users=60, days=42, orders_per_day=40, last_day=date.today())
+        self.assertEqual(self.count_view_queries(), small)
+
+
+class LunchBackendUtilsTestCase(unittest.TestCase):
+    """
+    Utils tests.
+    """
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        pass
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        pass
+
+    def test_get_current_date(self):
+        """
+        Test current date.
+        """
+        self.assertEqual(utils.get_current_date(), date.today())
+
+    def test_get_current_datetime(self):
+        """
+        Test current datetime.
+        """
+        self.assertAlmostEqual(
+            utils.get_current_datetime(),
+            datetime.now(),
+            delta=timedelta(microseconds=101),
+        )
+
+    def test_make_date(self):
+        """
+        Test make date.
+        """
+        self.assertEqual(
+            utils.make_date(datetime.now()),
+            date.today()
+        )
+
+    def test_next_month(self):
+        """
+        Test next month function.
+        """
+        self.assertEqual(
+            utils.next_month(2015, 12),
+            (2016, 1),
+        )
+        self.assertEqual(
+            utils.next_month(2015, 6),
+            (2015, 7),
+        )
+
+    def test_previous_month(self):
+        """
+        Test previous month function.
+        """
+        self.assertEqual(
+            utils.previous_month(2015, 1),
+            (2014, 12),
+        )
+        self.assertEqual(
+            utils.previous_month(2015, 6),
+            (2015, 5),
+        )
+
+
+class LunchBackendPermissionsTestCase(unittest.TestCase):
+    """
+    Permissions tests.
+    """
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        pass
+
+    def test_permissions(self):
+        """
+        Tests if permissions decorator works properly
+        """
+        resp = self.client.get('add_food')
+        self.assertEqual(resp.status_code, 401)
+        resp_2 = self.client.get('day_summary')
+        self.assertEqual(resp_2.status_code, 401)
+
+
+class LunchWebCrawlersTestCases(unittest.TestCase):
+    """
+    Webcrawlers tests.
+    """
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.client = main.app.test_client()
+        self.cache_dir = tempfile.mkdtemp()
+        self.config = dict(app.config)
+        app.config['CRAWLER_CACHE_DIR'] = self.cache_dir
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        app.config.clear()
+        app.config.update(self.config)
+        shutil.rmtree(self.cache_dir)
+
     def test_get_dania_dnia_from_pod_koziolek(self):
         """
         Tests web crawling functions works properly Koziolek add meal of a day
         """
-        data = get_dania_dnia_from_pod_koziolek()
+        with LocalHTTPServer(MOCK_WWW_KOZIOLEK) as server:
+            app.config['URL_POD_KOZIOLKIEM'] = server.url
+            data = get_dania_dnia_from_pod_koziolek()
         self.assertGreaterEqual(len(data), 2)
         self.assertGreaterEqual(len(data["zupa_dnia"]), 1)
         self.assertGreaterEqual(len(data['danie_dania_1']), 1)
 
-    @patch(
-        'lunch_app.webcrawler.read_webpage',
-        new=MOCK_WWW_TOMAS,
-    )
     def test_get_week_from_tomas(self):
         """
         Tests web crawling functions works properly for Tomas add weak
         """
-        data = get_week_from_tomas()
+        with LocalHTTPServer(MOCK_WWW_TOMAS) as server:
+            app.config['URL_TOMAS'] = server.url
+            data = get_week_from_tomas()
         self.assertEqual(len(data), 6)
         self.assertGreaterEqual(len(data['diet']), 1)
         for i in range(1, 6):
@@ -999,6 +2930,258 @@ class LunchWebCrawlersTestCases(unittest.TestCase):
                 msg="ERROR IN {}".format(i),
             )
 
+    @unittest.skipIf(lxml is None, 'lxml is not installed')
+    def test_parsers_give_same_menu(self):
+        """
+        Tests if menus parsed by lxml and html.parser are the same.
+        """
+        with open(MOCK_WWW_KOZIOLEK, 'rb') as koziolek, \
+                open(MOCK_WWW_TOMAS, 'rb') as tomas:
+            pages = koziolek.read(), tomas.read()
+        menus = []
+        for parser in ('lxml', 'html.parser'):
+            app.config['CRAWLER_PARSER'] = parser
+            menus.append((
+                get_dania_dnia_from_pod_koziolek(pages[0]),
+                get_week_from_tomas(pages[1]),
+            ))
+        self.assertEqual(menus[0], menus[1])
+        self.assertEqual(
+            menus[0][1]['dzien_1']['zupy'],
+            ['żurek', 'kapuśniak'],
+        )
+
+    def test_benchmark(self):
+        """
+        Tests if crawler benchmark measures every case.
+        """
+        results = benchmarks.crawler_parsing(number=1)
+        self.assertIn('menu nodes, html.parser', results)
+        self.assertTrue(all(seconds > 0 for seconds in results.values()))
+
+    def test_conditional_get(self):
+        """
+        Tests if unchanged page is served from cache after 304.
+        """
+        with LocalHTTPServer(MOCK_WWW_TOMAS) as server:
+            page = fetch(server.url)
+            self.assertEqual(page, server.content)
+            self.assertEqual(fetch(server.url), page)
+        self.assertEqual(len(server.requests), 2)
+        self.assertNotIn('If-None-Match', server.requests[0])
+        self.assertEqual(server.requests[1]['If-None-Match'], server.etag)
+        self.assertEqual(
+            server.requests[1]['If-Modified-Since'],
+            server.last_modified,
+        )
+
+    def test_fetch_timeout(self):
+        """
+        Tests if slow page raises crawler error.
+        """
+        with LocalHTTPServer(MOCK_WWW_TOMAS, delay=0.5) as server:
+            with self.assertRaises(CrawlerError):
+                fetch(server.url, timeout=0.1)
+
+    def test_crawl_all_concurrently(self):
+        """
+        Tests if restaurants are crawled at the same time.
+        """
+        with LocalHTTPServer(MOCK_WWW_KOZIOLEK, delay=0.5) as koziolek, \
+                LocalHTTPServer(MOCK_WWW_TOMAS, delay=0.5) as tomas:
+            app.config['URL_POD_KOZIOLKIEM'] = koziolek.url
+            app.config['URL_TOMAS'] = tomas.url
+            start = default_timer()
+            menus, errors = crawl_all()
+            duration = default_timer() - start
+        self.assertEqual(errors, {})
+        self.assertLess(duration, 0.9)
+        self.assertIn('zupa_dnia', menus['Pod Koziołkiem'])
+        self.assertEqual(len(menus['Tomas']), 6)
+
+    def test_crawl_all_reports_errors(self):
+        """
+        Tests if unreachable restaurant does not stop others.
+        """
+        with LocalHTTPServer(MOCK_WWW_TOMAS) as tomas:
+            app.config['URL_TOMAS'] = tomas.url
+            app.config['URL_POD_KOZIOLKIEM'] = 'http://127.0.0.1:1/'
+            menus, errors = crawl_all()
+        self.assertEqual(list(menus), ['Tomas'])
+        self.assertIsInstance(errors['Pod Koziołkiem'], CrawlerError)
+
+
+class LunchMenuImportTestCase(unittest.TestCase):
+    """
+    Scheduled menu import tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        db.create_all()
+        # menus cached by previous tests are not in new db
+        menu_cache.invalidate()
+        self.config = dict(app.config)
+        app.config['CRAWLER_CACHE_DIR'] = None
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        app.config.clear()
+        app.config.update(self.config)
+        db.session.remove()
+        db.drop_all()
+
+    def test_import_menus(self):
+        """
+        Test importing menus of all restaurants without duplicates.
+        """
+        wednesday = date(2015, 2, 11)
+        with LocalHTTPServer(MOCK_WWW_KOZIOLEK) as koziolek, \
+                LocalHTTPServer(MOCK_WWW_TOMAS) as tomas:
+            app.config['URL_POD_KOZIOLKIEM'] = koziolek.url
+            app.config['URL_TOMAS'] = tomas.url
+            number_of_foods, errors = import_menus(wednesday)
+            self.assertEqual(errors, {})
+            self.assertEqual(Food.query.count(), number_of_foods)
+            self.assertEqual(import_menus(wednesday), (0, {}))
+        self.assertEqual(Food.query.count(), number_of_foods)
+        koziolek_food = Food.query.filter(
+            Food.company == 'Pod Koziołkiem',
+        ).first()
+        self.assertEqual(
+            koziolek_food.date_available_from,
+            datetime(2015, 2, 11),
+        )
+        diet = Food.query.filter(Food.o_type == 'tygodniowe').first()
+        self.assertEqual(diet.date_available_from, datetime(2015, 2, 9))
+        self.assertEqual(diet.date_available_to, datetime(2015, 2, 13))
+        self.assertEqual(
+            len(get_menu(date(2015, 2, 11)).daily('Pod Koziołkiem')),
+            Food.query.filter(Food.company == 'Pod Koziołkiem').count(),
+        )
+
+    def test_store_foods_skips_known_foods(self):
+        """
+        Test if only new foods are inserted.
+        """
+        rows = koziolek_foods(
+            {'zupa_dnia': 'Zupa', 'danie_dania_1': '1.Kotlet'},
+            date(2015, 2, 11),
+        )
+        self.assertEqual(store_foods(rows[:1]), 1)
+        self.assertEqual(store_foods(rows + rows), 1)
+        self.assertEqual(Food.query.count(), 2)
+
+    def test_insert_foods(self):
+        """
+        Test bulk insert of foods.
+        """
+        day = date(2015, 2, 11)
+        self.assertEqual(get_menu(day).daily_foods, [])
+        rows = [
+            food_row('Tomas', 'Danie {}'.format(i), 10, 'daniednia', day, day)
+            for i in range(400)
+        ]
+        self.assertEqual(insert_foods(rows), 400)
+        self.assertEqual(insert_foods([]), 0)
+        self.assertEqual(Food.query.count(), 400)
+        self.assertEqual(len(get_menu(day).daily('Tomas')), 400)
+        food = Food.query.order_by(Food.id.desc()).first()
+        self.assertEqual(food.description, 'Danie 399')
+        self.assertEqual(food.date_available_to, datetime(2015, 2, 11))
+
+    def test_food_insert_benchmark(self):
+        """
+        Test if food insert benchmark measures every case.
+        """
+        results = benchmarks.food_insert(number=1, rows=10)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(Food.query.count(), 0)
+
+    def test_next_run(self):
+        """
+        Test computing next import time.
+        """
+        friday = datetime(2015, 2, 13, 8, 0)
+        self.assertEqual(
+            next_run(friday, ('10:00', '07:30')),
+            datetime(2015, 2, 13, 10, 0),
+        )
+        self.assertEqual(
+            next_run(friday.replace(hour=11), ('10:00', '07:30')),
+            datetime(2015, 2, 16, 7, 30),
+        )
+        self.assertIsNone(next_run(friday, ('10:00',), ()))
+
+
+def uwsgi_options():
+    """
+    Returns uWSGI options written by buildout uwsgi recipe, each line
+    of multi-line value is separate option.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(os.path.join(
+        os.path.dirname(__file__), '..', '..', 'buildout.cfg',
+    ))
+    options = []
+    for key, value in parser.items('uwsgi'):
+        if not key.startswith('xml-'):
+            continue
+        for line in value.strip().splitlines():
+            options.append((key[len('xml-'):], line.strip()))
+    return options
+
+
+class LunchBackendDeploymentTestCase(unittest.TestCase):
+    """
+    Deployment configuration tests.
+    """
+    # uWSGI ignores unknown elements of xml config without any error
+    UWSGI_OPTIONS = {
+        'http', 'master', 'enable-threads', 'processes', 'threads',
+        'single-interpreter', 'pidfile', 'attach-daemon', 'attach-daemon2',
+        'wsgi-file', 'static-map', 'pythonpath', 'env',
+    }
+
+    def test_uwsgi_options_are_known(self):
+        """
+        Test if generated uWSGI config uses only supported options.
+        """
+        for key, _ in uwsgi_options():
+            self.assertIn(key, self.UWSGI_OPTIONS)
+
+    def test_uwsgi_attaches_daemons(self):
+        """
+        Test if generated uWSGI config starts every daemon.
+        """
+        commands = [
+            value for key, value in uwsgi_options()
+            if key in ('attach-daemon', 'attach-daemon2')
+        ]
+        for action in ('mail_worker', 'import_menus', 'daily_reminder'):
+            self.assertEqual(
+                len([
+                    command for command in commands
+                    if command.endswith('/bin/flask-ctl ' + action)
+                ]),
+                1,
+                action,
+            )
+
+    def test_uwsgi_threads_outlast_streams(self):
+        """
+        Test if order events streams leave threads for other requests
+        and load test server has threads of uWSGI process.
+        """
+        options = dict(uwsgi_options())
+        self.assertGreater(int(options['threads']), MAX_STREAMS)
+        self.assertEqual(int(options['threads']), SERVER_THREADS)
+        self.assertGreater(int(options['processes']), 1)
+
 
 def suite():
     """
@@ -1006,9 +3189,21 @@ def suite():
     """
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(LunchBackendViewsTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendOutboxTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendCacheTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendIndexesTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendBillingTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendConcurrencyTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendLoadTestTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendSeedTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendProfilingTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendMetricsTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendQueryBudgetTestCase))
+    base_suite.addTest(unittest.makeSuite(LunchBackendDeploymentTestCase))
     base_suite.addTest(unittest.makeSuite(LunchBackendUtilsTestCase))
     base_suite.addTest(unittest.makeSuite(LunchBackendPermissionsTestCase))
     base_suite.addTest(unittest.makeSuite(LunchWebCrawlersTestCases))
+    base_suite.addTest(unittest.makeSuite(LunchMenuImportTestCase))
     return base_suite
 
 
@@ -2,6 +2,7 @@
 """
 helper functions for jinjna.
 """
+from calendar import monthrange
 import datetime
 
 
@@ -74,3 +75,36 @@ def previous_month(year, month):
     else:
         month -= 1
     return year, month
+
+
+def day_begin_end(day):
+    """
+    Returns first and last moment of day used by daily queries.
+    """
+    day_begin = datetime.datetime.combine(day, datetime.time(0, 0))
+    day_end = datetime.datetime.combine(day, datetime.time(23, 59))
+    return day_begin, day_end
+
+
+def month_begin_end(year, month):
+    """
+    Returns first and last moment of month used by monthly queries.
+    """
+    month_begin = datetime.datetime(
+        year=year,
+        month=month,
+        day=1,
+        hour=0,
+        minute=0,
+        second=1
+    )
+    day = monthrange(year, month)[1]
+    month_end = datetime.datetime(
+        year=year,
+        month=month,
+        day=day,
+        hour=23,
+        minute=59,
+        second=59
+    )
+    return month_begin, month_end
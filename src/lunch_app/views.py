@@ -3,19 +3,48 @@
 """
 Defines views.
 """
-from calendar import monthrange, month_name
+from calendar import month_name
 from collections import Counter
 import datetime
 from random import choice
 
 
-from flask import redirect, render_template, request, flash, url_for, jsonify
+from flask import (
+    redirect,
+    render_template,
+    request,
+    flash,
+    url_for,
+    jsonify,
+    make_response,
+    Response,
+    stream_with_context,
+    abort,
+    session,
+)
 from flask.ext import login
 from flask.ext.login import current_user
 from flask.ext.mail import Message
 from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 
-from .main import app, db, mail
+from .cache import (
+    get_mail_text,
+    get_ordering_info,
+    get_menu,
+    get_orders_snapshot,
+)
+from .concurrency import ConflictError, retry_on_conflict
+from .events import last_event_id, log_order_event, stream_order_events
+from .export import (
+    EXPORT_FORMATS,
+    ORDER_HEADER,
+    USER_TOTALS_HEADER,
+    export_lines,
+    order_rows,
+    user_total_rows,
+)
+from .main import app, db
 from .forms import (
     OrderForm,
     AddFood,
@@ -28,21 +57,61 @@ from .forms import (
     FinanceBlockUserForm,
     PizzaChooseForm,
 )
-from .models import Order, Food, User, Finance, MailText, Pizza, OrderingInfo
+from .metrics import METRICS_CONTENT_TYPE, exposition, registry
+from .menu_import import (
+    food_row,
+    insert_foods,
+    store_foods,
+    koziolek_foods,
+    tomas_foods,
+)
+from .models import (
+    Order,
+    Food,
+    User,
+    Finance,
+    MailText,
+    Pizza,
+    PizzaOrder,
+    OrderingInfo,
+)
+from .outbox import send_mail, send_bulk
 from .permissions import user_is_admin
-from .utils import next_month, previous_month
-from .webcrawler import get_dania_dnia_from_pod_koziolek, get_week_from_tomas
+from .queries import (
+    company_costs,
+    group_orders,
+    monthly_billing,
+    pizza_summary,
+    year_summary,
+)
+from .query_budget import query_budget
+from .reminders import mail_daily_reminder
+from .utils import (
+    next_month,
+    previous_month,
+    day_begin_end,
+    month_begin_end,
+)
+from .webcrawler import (
+    CrawlerError,
+    get_dania_dnia_from_pod_koziolek,
+    get_week_from_tomas,
+)
 
 import logging
 
 log = logging.getLogger(__name__)
 
+# failures of mail to all shown after redirect, session cookie is small
+MAIL_STATUS_FAILURES = 10
+MAIL_STATUS_ERROR_LENGTH = 100
+
 
 def ordering_is_active():
     """
     Returns value true if ordering is active for jinja.
     """
-    ordering_is_allowed = OrderingInfo.query.get(1)
+    ordering_is_allowed = get_ordering_info()
     return ordering_is_allowed.is_allowed
 
 
@@ -55,6 +124,7 @@ def server_url():
 
 
 @app.route('/')
+@query_budget(0)
 def index():
     """
     Main page.
@@ -70,6 +140,7 @@ def index():
 
 @app.route('/overview', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(1)
 def overview():
     """
     Overview page.
@@ -86,39 +157,28 @@ def overview():
 
 @app.route('/order', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(3)
 def create_order():
     """
     Create new order page.
     """
     if not current_user.is_active():
-        texts = MailText.query.get(1)
+        texts = get_mail_text()
         msg = texts.blocked_user_text
         flash(msg)
         return redirect('overview')
-    ordering_is_allowed = OrderingInfo.query.get(1)
-    if not ordering_is_allowed.is_allowed:
-        texts = MailText.query.get(1)
+    if not ordering_is_active():
         msg = "Sorry you were too late ordering is blocked now"
         flash(msg)
         return redirect('overview')
     form = OrderForm(request.form)
-    day = datetime.date.today()
-    today_from = datetime.datetime.combine(day, datetime.time(23, 59))
-    today_to = datetime.datetime.combine(day, datetime.time(0, 0))
-    foods = Food.query.filter(
-        and_(
-            Food.date_available_from <= today_from,
-            Food.date_available_to >= today_to,
-        )
-    ).all()
     if request.method == 'POST' and form.validate():
         order = Order()
         form.populate_obj(order)
         order.user_name = current_user.username
         order.description = order.description.strip()
         db.session.add(order)
-        db.session.commit()
-        flash('Order created')
+        log_order_event('created', order)
         if form.send_me_a_copy.data:
             msg = Message(
                 'Lunch order - {}'.format(datetime.date.today()),
@@ -128,10 +188,18 @@ def create_order():
                        "from {order.company} ({order.cost} PLN).\n" \
                        "It should be delivered at " \
                        "{order.arrival_time}".format(order=order)
-            mail.send(msg)
+            # queued copy is committed together with order
+            send_mail(msg)
+        db.session.commit()
+        flash('Order created')
+        if form.send_me_a_copy.data:
             flash('Mail send')
         return redirect('order')
-    return render_template('order.html', form=form, foods=foods)
+    return render_template(
+        'order.html',
+        form=form,
+        menu=get_menu(datetime.date.today()),
+    )
 
 
 @app.route('/add_food', methods=['GET', 'POST'])
@@ -154,18 +222,17 @@ def add_food():
             and request.form['add_meal'] == 'bulk':
         foods = form.description.data
         foods = foods.replace('\r', '').split('\n')
-        number_of_foods_aded = 0
-        for food in foods:
-            meal = Food()
-            meal.company = form.company.data
-            meal.description = food
-            meal.cost = form.cost.data
-            meal.date_available_from = form.date_available_from.data
-            meal.date_available_to = form.date_available_to.data
-            meal.o_type = form.o_type.data
-            db.session.add(meal)
-            number_of_foods_aded += 1
-        db.session.commit()
+        number_of_foods_aded = insert_foods([
+            food_row(
+                form.company.data,
+                food,
+                form.cost.data,
+                form.o_type.data,
+                form.date_available_from.data,
+                form.date_available_to.data,
+            )
+            for food in foods
+        ])
         flash('{} foods added'.format(number_of_foods_aded))
         return redirect('add_food')
     return render_template('add_food.html', form=form)
@@ -174,116 +241,30 @@ def add_food():
 @app.route('/day_summary', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(4)
 def day_summary():
     """
     Day orders summary.
     """
     day = datetime.date.today()
-    today_beg = datetime.datetime.combine(day, datetime.time(00, 00))
-    today_end = datetime.datetime.combine(day, datetime.time(23, 59))
-
-    orders_t_12 = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-            Order.company == 'Tomas',
-            Order.arrival_time == '12:00',
-        )
-    ).all()
-    orders_t_12_cost = sum(order.cost for order in orders_t_12)
-
-    orders_t_13 = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-            Order.company == 'Tomas',
-            Order.arrival_time == '13:00',
-        )
-    ).all()
-    orders_t_13_cost = sum(order.cost for order in orders_t_13)
-
-    orders_pk_12 = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-            Order.company == 'Pod Koziołkiem',
-            Order.arrival_time == '12:00',
-        )
-    ).all()
-    orders_pk_12_cost = sum(order.cost for order in orders_pk_12)
-
-    orders_pk_13 = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-            Order.company == 'Pod Koziołkiem',
-            Order.arrival_time == '13:00',
-        )
-    ).all()
-    orders_pk_13_cost = sum(order.cost for order in orders_pk_13)
-
-    orders = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-        )
-    ).all()
-    new_orders = {
-        'tomas_12': {},
-        'tomas_13': {},
-        'pod_koziolkiem_12': {},
-        'pod_koziolkiem_13': {},
-    }
+    orders = Order.for_day(day).order_by(Order.id).all()
+    orders_details = {}
     for order in orders:
-        order.description = order.description.strip('\n')
-        order.description = order.description.strip('\r')
-        if order.company == 'Tomas':
-            if order.arrival_time == '12:00':
-                try:
-                    new_orders['tomas_12'][order.description] += 1
-                    new_orders['tomas_12']['cost'] += order.cost
-                except KeyError:
-                    new_orders['tomas_12'][order.description] = 1
-                    new_orders['tomas_12']['cost'] = order.cost
-            elif order.arrival_time == '13:00':
-                try:
-                    new_orders['tomas_13'][order.description] += 1
-                    new_orders['tomas_13']['cost'] += order.cost
-                except KeyError:
-                    new_orders['tomas_13'][order.description] = 1
-                    new_orders['tomas_13']['cost'] = order.cost
-        elif order.company == 'Pod Koziołkiem':
-            if order.arrival_time == '12:00':
-                try:
-                    new_orders['pod_koziolkiem_12'][order.description] += 1
-                    new_orders['pod_koziolkiem_12']['cost'] += order.cost
-                except KeyError:
-                    new_orders['pod_koziolkiem_12'][order.description] = 1
-                    new_orders['pod_koziolkiem_12']['cost'] = order.cost
-            elif order.arrival_time == '13:00':
-                try:
-                    new_orders['pod_koziolkiem_13'][order.description] += 1
-                    new_orders['pod_koziolkiem_13']['cost'] += order.cost
-                except KeyError:
-                    new_orders['pod_koziolkiem_13'][order.description] = 1
-                    new_orders['pod_koziolkiem_13']['cost'] = order.cost
+        orders_details.setdefault(
+            (order.company, order.arrival_time),
+            [],
+        ).append(order)
 
     return render_template(
         'day_summary.html',
-        orders_t_12=orders_t_12,
-        orders_t_12_cost=orders_t_12_cost,
-        orders_t_13=orders_t_13,
-        orders_t_13_cost=orders_t_13_cost,
-        orders_pk_12=orders_pk_12,
-        orders_pk_12_cost=orders_pk_12_cost,
-        orders_pk_13=orders_pk_13,
-        orders_pk_13_cost=orders_pk_13_cost,
-        new_orders=new_orders,
+        summary=group_orders(*day_begin_end(day)),
+        orders_details=orders_details,
     )
 
 
 @app.route('/my_orders', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(1)
 def my_orders():
     """
     Renders all of current user orders.
@@ -299,11 +280,12 @@ def my_orders():
 
 @app.route('/info', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(2)
 def info():
     """
     Renders info page.
     """
-    texts = MailText.query.get(1)
+    texts = get_mail_text()
     temp = "{}".format(texts.info_page_text)
     info = temp.split('\n')
     if len(info) < 2:
@@ -313,6 +295,7 @@ def info():
 
 @app.route('/order_details/<int:order_id>', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(1)
 def order_details(order_id):
     """
     Renders orders detail page.
@@ -324,6 +307,7 @@ def order_details(order_id):
 @app.route('/order_edit/<int:order_id>/', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(1)
 def edit_order(order_id):
     """
     Renders order edit page.
@@ -332,6 +316,7 @@ def edit_order(order_id):
     form = OrderEditForm(formdata=request.form, obj=order)
     if request.method == 'POST' and form.validate():
         form.populate_obj(order)
+        log_order_event('edited', order)
         db.session.commit()
         flash('Order changed')
         return redirect('day_summary')
@@ -346,6 +331,7 @@ def delete_order(order_id):
     Deletes order.
     """
     order = Order.query.get(order_id)
+    log_order_event('deleted', order)
     db.session.delete(order)
     db.session.commit()
     return redirect('day_summary')
@@ -353,6 +339,7 @@ def delete_order(order_id):
 
 @app.route('/order_list', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(1)
 def order_list():
     """
     Renders order list page form.
@@ -382,65 +369,13 @@ def order_list():
 
 @app.route('/order_list/<int:user_id>/<int:year>', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(2)
 def order_list_year_view(year, user_id):
     """
     Renders order year list page.
     """
-    year_begin = datetime.datetime(
-        year=year,
-        month=1,
-        day=1,
-        hour=0,
-        minute=0,
-        second=1
-    )
-    year_end = datetime.datetime(
-        year=year,
-        month=12,
-        day=31,
-        hour=23,
-        minute=59,
-        second=59
-    )
     user = User.query.filter(User.id == user_id).first()
-    orders = Order.query.filter(
-        and_(
-            Order.date >= year_begin,
-            Order.date <= year_end,
-            Order.user_name == user.username,
-        )
-    ).all()
-    year_data = []
-    for month in range(1, 13):
-        monthly_data = {
-            'month_name': month_name[month],
-            'number of orders': 0,
-            'month cost': 0,
-        }
-        for order in orders:
-            month_begin = datetime.datetime(
-                year=year,
-                month=month,
-                day=1,
-                hour=0,
-                minute=0,
-                second=1
-            )
-
-            day = monthrange(year, month)[1]
-            month_end = datetime.datetime(
-                year=year,
-                month=month,
-                day=day,
-                hour=23,
-                minute=59,
-                second=59
-            )
-            if month_begin <= order.date <= month_end:
-                monthly_data['number of orders'] += 1
-                monthly_data['month cost'] += order.cost
-
-        year_data.append(monthly_data)
+    year_data = year_summary(user.username, year)
 
     return render_template(
         'orders_list_year_view.html',
@@ -455,36 +390,16 @@ def order_list_year_view(year, user_id):
     'POST'
 ])
 @login.login_required
+@query_budget(2)
 def order_list_month_view(year, month, user_id):
     """
     Renders order month list page.
     """
-    month_begin = datetime.datetime(
-        year=year,
-        month=month,
-        day=1,
-        hour=0,
-        minute=0,
-        second=1
-    )
-
-    day = monthrange(year, month)[1]
-    month_end = datetime.datetime(
-        year=year,
-        month=month,
-        day=day,
-        hour=23,
-        minute=59,
-        second=59
-    )
     pub_date = {'year': year, 'month': month_name[month]}
     user = User.query.filter(User.id == user_id).first()
-    orders = Order.query.filter(
-        and_(
-            Order.date >= month_begin,
-            Order.date <= month_end,
-            Order.user_name == user.username,
-        )
+    orders = Order.for_user_in_range(
+        user.username,
+        *month_begin_end(year, month)
     ).all()
     orders_cost = sum(order.cost for order in orders)
     return render_template(
@@ -499,6 +414,7 @@ def order_list_month_view(year, month, user_id):
 @app.route('/company_summary', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(0)
 def company_summary_view():
     """
     Renders company query page form.
@@ -516,50 +432,22 @@ def company_summary_view():
 @app.route('/company_summary/<int:year>/<int:month>', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(1)
 def company_summary_month_view(year, month):
     """
     Renders companies month list page.
     """
-    month_begin = datetime.datetime(
-        year=year,
-        month=month,
-        day=1,
-        hour=0,
-        minute=0,
-        second=1
-    )
-
-    day = monthrange(year, month)[1]
-    month_end = datetime.datetime(
-        year=year,
-        month=month,
-        day=day,
-        hour=23,
-        minute=59,
-        second=59
-    )
     pub_date = {'year': year, 'month': month_name[month]}
-    orders_tomas = Order.query.filter(
-        and_(
-            Order.date >= month_begin,
-            Order.date <= month_end,
-            Order.company == 'Tomas',
-        )
-    ).all()
-    orders_koziol = Order.query.filter(
-        and_(
-            Order.date >= month_begin,
-            Order.date <= month_end,
-            Order.company == 'Pod Koziołkiem',
-        )
-    ).all()
-    orders_tomas_cost = sum(order.cost for order in orders_tomas)
-    orders_koziol_cost = sum(order.cost for order in orders_koziol)
+    costs = company_costs(year, month)
+    orders_tomas_cost = costs.get('Tomas', 0)
+    orders_koziol_cost = costs.get('Pod Koziołkiem', 0)
     return render_template(
         'company_summary_month_view.html',
         orders_tomas_cost=orders_tomas_cost,
         orders_koziol_cost=orders_koziol_cost,
         pub_date=pub_date,
+        year=year,
+        month=month,
     )
 
 
@@ -569,6 +457,7 @@ def company_summary_month_view(year, month):
 ])
 @login.login_required
 @user_is_admin
+@query_budget(1)
 def finance(year, month, did_pay):
     """
     Renders finance page.
@@ -576,95 +465,79 @@ def finance(year, month, did_pay):
     did_pay = 1 - filter only paid
     did_pay = 2 - filter only unpaid
     """
-    month_begin = datetime.datetime(
-        year=year,
-        month=month,
-        day=1,
-        hour=0,
-        minute=0,
-        second=1
-    )
-    day = monthrange(year, month)[1]
-    month_end = datetime.datetime(
-        year=year,
-        month=month,
-        day=day,
-        hour=23,
-        minute=59,
-        second=59
-    )
-    users = User.query.all()
-    orders = Order.query.filter(
-        and_(
-            Order.date >= month_begin,
-            Order.date <= month_end,
-        )
-    ).all()
-    finances = Finance.query.filter(
-        and_(
-            Finance.month == month,
-            Finance.year == year,
-        )
-    ).all()
-    finance_data = {}
-    finance_user_list = []
-    for user in users:
-        finance_data[user.username] = {
-            'username': user.username,
-            'number_of_orders': 0,
-            'month_cost': 0,
-            'did_user_pay': False,
-        }
-        for order in orders:
-            if user.username == order.user_name:
-                finance_data[user.username]['number_of_orders'] += 1
-                finance_data[user.username]['month_cost'] += order.cost
-        for finance_query in finances:
-            finance_user_list.append(finance_query.user_name)
-            if finance_query.user_name == user.username \
-                    and finance_query.did_user_pay:
-                finance_data[user.username]['did_user_pay'] = True
+    finance_data = monthly_billing(year, month)
+    for username, row in list(finance_data.items()):
         should_drop = (
-            # user didn't bought anything
-            finance_data[user.username]['month_cost'] == 0 or
             # show paid user and user did not pay
-            (
-                did_pay == 1 and
-                not finance_data[user.username]['did_user_pay']
-            ) or
+            (did_pay == 1 and not row['did_user_pay']) or
             # show unpaid user and user paid
-            (
-                did_pay == 2 and
-                (
-                    finance_data[user.username]['did_user_pay']
-                )
-            )
+            (did_pay == 2 and row['did_user_pay'])
         )
         if should_drop:
-            del finance_data[user.username]
+            del finance_data[username]
 
     pub_date = {'year': year, 'month': month_name[month]}
 
-    finance_record = Finance()
-
     if request.method == 'POST':
-        for row in finance_data.values():
-            finance_record.did_user_pay = request.form.get(
-                'did_user_pay_'+row['username'],
-                'off',
-            ) == 'on'
-            finance_record.month = month
-            finance_record.year = year
-            finance_record.user_name = row['username']
-            do_not_update = True
+
+        def update_finances():
+            """
+            Stores payment status of users whose checkbox was changed.
+            Users changed by someone else since the page was shown are
+            left alone and returned.
+            """
+            finances = Finance.query.filter(
+                and_(
+                    Finance.month == month,
+                    Finance.year == year,
+                )
+            ).all()
+            records = {}
             for record in finances:
-                if record.user_name == row['username']:
-                    record.did_user_pay = finance_record.did_user_pay
-                    do_not_update = False
-            if do_not_update:
-                db.session.add(finance_record)
-        db.session.commit()
-        flash('Finances changes submitted successfully')
+                records.setdefault(record.user_name, []).append(record)
+            conflicts = []
+            for row in finance_data.values():
+                shown = request.form.get(
+                    'shown_did_user_pay_'+row['username'],
+                )
+                if shown is None:
+                    continue
+                did_user_pay = request.form.get(
+                    'did_user_pay_'+row['username'],
+                    'off',
+                ) == 'on'
+                was_paid = shown == 'on'
+                if did_user_pay == was_paid:
+                    continue
+                user_records = records.get(row['username'], [])
+                is_paid = any(record.did_user_pay for record in user_records)
+                if is_paid != was_paid:
+                    conflicts.append(row['username'])
+                    continue
+                for record in user_records:
+                    record.did_user_pay = did_user_pay
+                if not user_records:
+                    finance_record = Finance()
+                    finance_record.did_user_pay = did_user_pay
+                    finance_record.month = month
+                    finance_record.year = year
+                    finance_record.user_name = row['username']
+                    db.session.add(finance_record)
+            return conflicts
+
+        try:
+            conflicts = retry_on_conflict(update_finances)
+            if conflicts:
+                flash(
+                    'Payment status of {} was changed by someone else '
+                    'meanwhile, please check it again'.format(
+                        ', '.join(conflicts),
+                    )
+                )
+            else:
+                flash('Finances changes submitted successfully')
+        except ConflictError as error:
+            flash(str(error))
         return redirect(url_for(
             'finance',
             year=year,
@@ -678,6 +551,18 @@ def finance(year, month, did_pay):
             url_for('finance', year=p_year, month=p_month, did_pay=did_pay),
         'next_month':
             url_for('finance', year=n_year, month=n_month, did_pay=did_pay),
+        'export_csv': url_for(
+            'export_user_totals',
+            year=year,
+            month=month,
+            export_format='csv',
+        ),
+        'export_json': url_for(
+            'export_user_totals',
+            year=year,
+            month=month,
+            export_format='json',
+        ),
     }
     return render_template(
         'finance.html',
@@ -687,9 +572,63 @@ def finance(year, month, did_pay):
     )
 
 
+def _export_response(export_format, name, header, rows):
+    """
+    Returns streamed export or 404 for unknown format.
+    """
+    if export_format not in EXPORT_FORMATS:
+        abort(404)
+    response = Response(
+        stream_with_context(export_lines(export_format, header, rows)),
+        mimetype=EXPORT_FORMATS[export_format],
+    )
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.{}'.format(name, export_format)
+    return response
+
+
+@app.route('/export/orders/<int:year>/<string:export_format>')
+@app.route('/export/orders/<int:year>/<int:month>/<string:export_format>')
+@login.login_required
+@user_is_admin
+@query_budget(1)
+def export_orders(year, export_format, month=None):
+    """
+    Streams orders of month or year, optionally of one company.
+    """
+    return _export_response(
+        export_format,
+        'orders_{}'.format(year) if month is None else
+        'orders_{}_{:02}'.format(year, month),
+        ORDER_HEADER,
+        order_rows(year, month, request.args.get('company')),
+    )
+
+
+@app.route('/export/user_totals/<int:year>/<string:export_format>')
+@app.route(
+    '/export/user_totals/<int:year>/<int:month>/<string:export_format>',
+)
+@login.login_required
+@user_is_admin
+@query_budget(1)
+def export_user_totals(year, export_format, month=None):
+    """
+    Streams monthly number of orders, cost and payment status of users.
+    """
+    return _export_response(
+        export_format,
+        'user_totals_{}'.format(year) if month is None else
+        'user_totals_{}_{:02}'.format(year, month),
+        USER_TOTALS_HEADER,
+        user_total_rows(year, month),
+    )
+
+
 @app.route('/finance_mail_text', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(1)
 def finance_mail_text():
     """
     Renders mail all page.
@@ -717,66 +656,15 @@ def finance_mail_text():
 @app.route('/finance_mail_all', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(3)
 def finance_mail_all():
     """
     Renders mail to all page.
     """
     this_month = datetime.date.today()
-    month_begin = datetime.datetime(
-        year=this_month.year,
-        month=this_month.month,
-        day=1,
-        hour=0,
-        minute=0,
-        second=1
-    )
-    day = monthrange(this_month.year, this_month.month)[1]
-    month_end = datetime.datetime(
-        year=this_month.year,
-        month=this_month.month,
-        day=day,
-        hour=23,
-        minute=59,
-        second=59
-    )
-    users = User.query.all()
-    orders = Order.query.filter(
-        and_(
-            Order.date >= month_begin,
-            Order.date <= month_end,
-        )
-    ).all()
-    finances = Finance.query.filter(
-        and_(
-            Finance.month == this_month.month,
-            Finance.year == this_month.year,
-        )
-    ).all()
-    finance_data = {}
-    finance_user_list = []
-    for user in users:
-        finance_data[user.username] = {
-            'username': user.username,
-            'number_of_orders': 0,
-            'month_cost': 0,
-            'did_user_pay': False,
-        }
-        for order in orders:
-            if user.username == order.user_name:
-                finance_data[user.username]['number_of_orders'] += 1
-                finance_data[user.username]['month_cost'] += order.cost
-        for finance_query in finances:
-            finance_user_list.append(finance_query.user_name)
-            if finance_query.user_name == user.username \
-                    and finance_query.did_user_pay:
-                finance_data[user.username]['did_user_pay'] = True
-        should_drop = (
-            # user didn't bought anything
-            finance_data[user.username]['month_cost'] == 0
-        )
-        if should_drop:
-            del finance_data[user.username]
-    message_text = MailText.query.first()
+    finance_data = monthly_billing(this_month.year, this_month.month)
+    message_text = get_mail_text()
+    messages = []
     if request.method == 'POST' and request.form['send_mail'] == 'all':
         for record in finance_data.values():
             msg = Message(
@@ -790,8 +678,7 @@ def finance_mail_all():
                 record['month_cost'],
                 message_text.monthly_pay_summary,
                 )
-            mail.send(msg)
-            flash('Mail send')
+            messages.append(msg)
     if request.method == 'POST' and request.form['send_mail'] == 'remind_all':
         for record in finance_data.values():
             if not record['did_user_pay']:
@@ -805,11 +692,44 @@ def finance_mail_all():
                     record['month_cost'],
                     message_text.pay_reminder,
                     )
-                mail.send(msg)
-                flash('Mail send')
-        return redirect('finance_mail_all')
-
-    return render_template('finance_mail_all.html', finance_data=finance_data)
+                messages.append(msg)
+    if request.method == 'POST':
+        mail_status = send_bulk(messages) if messages else {}
+        db.session.commit()
+        counts = Counter(
+            status['status'] for status in mail_status.values()
+        )
+        failures = [
+            [recipients, status['error'][:MAIL_STATUS_ERROR_LENGTH]]
+            for recipients, status in mail_status.items()
+            if status['status'] == 'failed'
+        ]
+        if failures:
+            flash('Mail send, {} of {} failed'.format(
+                len(failures),
+                len(mail_status),
+            ))
+        elif mail_status:
+            flash('Mail send')
+        # shown once by the page we redirect to, all failures are logged
+        session['mail_status'] = {
+            'counts': dict(counts),
+            'failures': failures[:MAIL_STATUS_FAILURES],
+        }
+        return redirect(url_for('finance_mail_all'))
+    summary = session.pop('mail_status', None)
+    mail_status = {}
+    if summary is not None:
+        mail_status = {
+            recipients: {'status': 'failed', 'error': error}
+            for recipients, error in summary['failures']
+        }
+    return render_template(
+        'finance_mail_all.html',
+        finance_data=finance_data,
+        mail_status=mail_status,
+        summary=summary,
+    )
 
 
 @app.route('/payment_remind/<string:username>/<int:slack>', methods=[
@@ -823,7 +743,7 @@ def payment_remind(username, slack=0):
     Sends mail to user with reminder or slack reminder.
     """
     this_month = datetime.date.today()
-    message_text = MailText.query.first()
+    message_text = get_mail_text()
     msg = Message(
         'Lunch {} / {} payment reminder'.format(
             month_name[this_month.month],
@@ -835,7 +755,20 @@ def payment_remind(username, slack=0):
         msg.body = message_text.pay_slacker_reminder
     else:
         msg.body = message_text.pay_reminder
-    mail.send(msg)
+    record = monthly_billing(
+        this_month.year,
+        this_month.month,
+        username=username,
+    ).get(username)
+    if record is not None:
+        msg.body = "In {} you ordered {} meals for {} PLN.\n{}".format(
+            month_name[this_month.month],
+            record['number_of_orders'],
+            record['month_cost'],
+            msg.body,
+        )
+    send_mail(msg)
+    db.session.commit()
     flash('Mail send')
     return redirect('finance')
 
@@ -843,6 +776,7 @@ def payment_remind(username, slack=0):
 @app.route('/finance_search', methods=['GET', 'POST'])
 @login.login_required
 @user_is_admin
+@query_budget(0)
 def finance_search_view():
     """
     Renders company query page form.
@@ -865,29 +799,18 @@ def random_food(courage):
     Orders random meal.
     """
     day = datetime.date.today()
-    today_from = datetime.datetime.combine(day, datetime.time(23, 59))
-    today_to = datetime.datetime.combine(day, datetime.time(0, 0))
-    foods = Order.query.filter(
-        and_(
-            Order.date <= today_from,
-            Order.date >= today_to,
-        )
-    ).all()
+    foods = Order.for_day(day).all()
     food_dict = Counter(foods)
     food_dict = food_dict.most_common()
     if len(food_dict) > 3:
         foods = [food_dict[0][0], food_dict[1][0], food_dict[2][0]]
     else:
-        foods = Food.query.filter(
-            and_(
-                Food.date_available_from <= today_from,
-                Food.date_available_to >= today_to,
-                Food.o_type != 'menu',
-            )
-        ).all()
+        foods = get_menu(day).daily_foods
     food = choice(foods)
-    if food.description.startswith('!RANDOM O'):
-        food.description = food.description[15:]
+    # cached foods and today's orders must not be modified
+    description = food.description
+    if description.startswith('!RANDOM O'):
+        description = description[15:]
     if courage >= 1:
         order = Order()
         if courage == 1:
@@ -897,15 +820,16 @@ def random_food(courage):
         order.company = food.company
         order.cost = food.cost
         order.description = '!RANDOM ORDER!\n'
-        order.description += food.description
+        order.description += description
         order.user_name = current_user.username
         db.session.add(order)
+        log_order_event('created', order)
         db.session.commit()
         flash('! Random meal ordered !')
         return redirect('order')
     elif courage == 0:
         random_order = {
-            "description": food.description,
+            "description": description,
             "cost": food.cost,
             "arrival_time": '12:00',
             "company": food.company
@@ -921,56 +845,71 @@ def send_daily_reminder():
     """
     Sends daili reminder to all users.
     """
-    day = datetime.date.today()
-    today_beg = datetime.datetime.combine(day, datetime.time(00, 00))
-    today_end = datetime.datetime.combine(day, datetime.time(23, 59))
-    orders = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-        )
-    ).all()
-    users = User.query.filter(User.i_want_daily_reminder).all()
-    message_text = MailText.query.first()
-    emails = ([])
-    order_list = ([])
-    for order in orders:
-        order_list.append(order.user_name)
-    for user in users:
-        if user.username not in order_list:
-            emails.append(user.username)
-    msg = Message(
-        '{} {}'.format(
-            message_text.daily_reminder_subject,
-            datetime.date.today()
-        ),
-        recipients=emails,
-    )
-    msg.body = message_text.daily_reminder
-    mail.send(msg)
+    mail_daily_reminder()
     return redirect('overview')
 
 
 @app.route('/tv', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(2)
 def orders_summary_for_tv():
     """
     View for TV showing all orders and reveling hard random orders.
+    Page is rendered again only when orders changed, unchanged page
+    is answered with 304.
     """
     day = datetime.date.today()
-    today_beg = datetime.datetime.combine(day, datetime.time(00, 00))
-    today_end = datetime.datetime.combine(day, datetime.time(23, 59))
-    orders = Order.query.filter(
-        and_(
-            Order.date >= today_beg,
-            Order.date <= today_end,
-        )
-    ).all()
-    return render_template('tv.html', orders=orders)
+    etag, body = get_orders_snapshot(
+        day,
+        lambda: render_template(
+            'tv.html',
+            orders=Order.for_day(day).order_by(Order.id).all(),
+        ),
+    )
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/order_events')
+@login.login_required
+def order_events():
+    """
+    Streams order changes as server-sent events. Stream starts after
+    Last-Event-ID or cursor argument, otherwise with next change.
+    """
+    cursor = request.headers.get('Last-Event-ID') or \
+        request.args.get('cursor')
+    cursor = int(cursor) if cursor and cursor.isdigit() else last_event_id()
+    response = Response(
+        stream_with_context(stream_order_events(cursor)),
+        mimetype='text/event-stream',
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    # tell nginx in front of uWSGI not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Exposes metrics of all workers to Prometheus scraping from
+    addresses listed in METRICS_ALLOWED_IPS.
+    """
+    if request.remote_addr not in app.config.get(
+            'METRICS_ALLOWED_IPS', ('127.0.0.1',)):
+        abort(403)
+    return Response(
+        exposition(registry.collect()),
+        content_type=METRICS_CONTENT_TYPE,
+    )
 
 
 @app.route('/finance_block_user', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(1)
 def finance_block_user():
     """
     Allows to block specific user from ordering.
@@ -1010,16 +949,38 @@ def finance_block_user():
     )
 
 
+def set_ordering_allowed(is_allowed):
+    """
+    Blocks or unblocks ordering for everyone. Returns false when
+    ordering already was in that state.
+    """
+
+    def change():
+        """
+        Updates ordering availability unless it is up to date.
+        """
+        ordering_info = OrderingInfo.query.get(1)
+        if ordering_info.is_allowed == is_allowed:
+            return False
+        ordering_info.is_allowed = is_allowed
+        return True
+
+    return retry_on_conflict(change)
+
+
 @app.route('/finance_block_ordering', methods=['GET', 'POST'])
 @login.login_required
 def finance_block_ordering():
     """
     Allows to block ordering for everyone.
     """
-    ordering_is_allowed = OrderingInfo.query.get(1)
-    ordering_is_allowed.is_allowed = False
-    db.session.commit()
-    flash('Now users can NOT order !')
+    try:
+        if set_ordering_allowed(False):
+            flash('Now users can NOT order !')
+        else:
+            flash('Ordering was already blocked')
+    except ConflictError as error:
+        flash(str(error))
     return redirect('day_summary')
 
 
@@ -1029,10 +990,13 @@ def finance_unblock_ordering():
     """
     Allows to unblock ordering for everyone.
     """
-    ordering_is_allowed = OrderingInfo.query.get(1)
-    ordering_is_allowed.is_allowed = True
-    db.session.commit()
-    flash('Now users can order :)')
+    try:
+        if set_ordering_allowed(True):
+            flash('Now users can order :)')
+        else:
+            flash('Ordering was already unblocked')
+    except ConflictError as error:
+        flash(str(error))
     return redirect('day_summary')
 
 
@@ -1042,19 +1006,17 @@ def add_daily_koziolek():
     """
     Adds meal of a day from koziolek
     """
-    food = get_dania_dnia_from_pod_koziolek()
-    for meal in food.values():
-        new_meal = Food()
-        new_meal.cost = 2 if 'zupa' in meal.lower() else 11
-        new_meal.description = "Danie dnia Koziołek: "
-        new_meal.description += meal
-        new_meal.company = "Pod Koziołkiem"
-        new_meal.o_type = "daniednia"
-        new_meal.date_available_from = datetime.date.today()
-        new_meal.date_available_to = datetime.date.today()
-        db.session.add(new_meal)
-    db.session.commit()
-    flash('Meals of a day from Pod Koziolek have been added.')
+    try:
+        food = get_dania_dnia_from_pod_koziolek()
+    except CrawlerError as error:
+        flash('Could not get meals from Pod Koziolek: {}'.format(error))
+        return redirect('add_food')
+    number_of_foods = store_foods(
+        koziolek_foods(food, datetime.date.today()),
+    )
+    flash('{} meals of a day from Pod Koziolek have been added.'.format(
+        number_of_foods,
+    ))
     return redirect('add_food')
 
 
@@ -1064,50 +1026,15 @@ def get_week_from_tomas_view():
     """
     Adds weak meals from Tomas ! use only on mondays !
     """
-    foods = get_week_from_tomas()
-    for meal in foods['diet']:
-        new_meal = Food()
-        new_meal.cost = 12
-        new_meal.description = meal
-        new_meal.company = "Tomas"
-        new_meal.o_type = "tygodniowe"
-        new_meal.date_available_from = datetime.date.today()
-        new_meal.date_available_to = \
-            datetime.date.today() + \
-            datetime.timedelta(days=4)
-        db.session.add(new_meal)
-    for i in range(1, 6):
-        food = foods['dzien_{}'.format(i)]
-        day_dif = datetime.date.today() + datetime.timedelta(days=i-1)
-        for meal in food['zupy']:
-            new_meal = Food()
-            new_meal.cost = 4
-            new_meal.description = meal
-            new_meal.company = "Tomas"
-            new_meal.o_type = "daniednia"
-            new_meal.date_available_from = day_dif
-            new_meal.date_available_to = day_dif
-            db.session.add(new_meal)
-        for meal in food['dania']:
-            new_meal = Food()
-            new_meal.cost = 10
-            new_meal.description = meal
-            new_meal.company = "Tomas"
-            new_meal.o_type = "daniednia"
-            new_meal.date_available_from = day_dif
-            new_meal.date_available_to = day_dif
-            db.session.add(new_meal)
-        for meal in food['zupa_i_dania']:
-            new_meal = Food()
-            new_meal.cost = 12
-            new_meal.description = meal
-            new_meal.company = "Tomas"
-            new_meal.o_type = "daniednia"
-            new_meal.date_available_from = day_dif
-            new_meal.date_available_to = day_dif
-            db.session.add(new_meal)
-    db.session.commit()
-    flash('Weak of meals from Tomas have been added.')
+    try:
+        foods = get_week_from_tomas()
+    except CrawlerError as error:
+        flash('Could not get meals from Tomas: {}'.format(error))
+        return redirect('add_food')
+    number_of_foods = store_foods(tomas_foods(foods, datetime.date.today()))
+    flash('{} meals of weak from Tomas have been added.'.format(
+        number_of_foods,
+    ))
     return redirect('add_food')
 
 
@@ -1120,10 +1047,9 @@ def order_pizza_for_everybody():
     new_event = Pizza()
     new_event.who_created = current_user.username
     new_event.pizza_ordering_is_allowed = True
-    new_event.users_already_ordered = ""
     db.session.add(new_event)
-    db.session.commit()
-    new_event = Pizza.query.all()[-1]
+    # event and its queued mails are committed together
+    db.session.flush()
     new_event_id = new_event.id
     event_url = server_url() + url_for(
         "pizza_time_view",
@@ -1144,19 +1070,21 @@ def order_pizza_for_everybody():
     )
     msg.body = '{} ordered pizza for everyone ! \n order it here:\n\n' \
                '{}\n\n and thank him!'.format(current_user.username, event_url)
-    mail.send(msg)
+    send_mail(msg)
     msg = Message(
         'Lunch app PIZZA TIME',
         recipients=[current_user.username],
     )
     msg.body = text
-    mail.send(msg)
+    send_mail(msg)
+    db.session.commit()
     flash(text)
     return redirect(url_for("pizza_time_view", happening=new_event_id))
 
 
 @app.route('/pizza_time/<int:happening>', methods=['GET', 'POST'])
 @login.login_required
+@query_budget(3)
 def pizza_time_view(happening):
     """
     Shows pizza menu, order Form and orders summary.
@@ -1167,36 +1095,22 @@ def pizza_time_view(happening):
         if not pizzas_db.pizza_ordering_is_allowed:
             flash('Pizza time finished !')
             return redirect(url_for('pizza_time_view', happening=happening))
-        if current_user.username in pizzas_db.users_already_ordered:
+        pizza_order = PizzaOrder()
+        pizza_order.event_id = happening
+        pizza_order.user_name = current_user.username
+        pizza_order.pizza = form.description.data.strip()
+        pizza_order.size = form.pizza_size.data
+        db.session.add(pizza_order)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # unique event and user, also when two requests race
+            db.session.rollback()
             flash('You already ordered !')
             return redirect(url_for('pizza_time_view', happening=happening))
-        pizza = form.description.data
-        pizza = pizza.strip()
-        size = form.pizza_size.data
-        try:
-            try:
-                pizzas_db.ordered_pizzas[pizza][size]\
-                    += current_user.username
-            except KeyError:
-                try:
-                    pizzas_db.ordered_pizzas[pizza] += {
-                        size: current_user.username
-                    }
-                except KeyError:
-                    pizzas_db.ordered_pizzas[pizza] = {
-                        size: current_user.username
-                    }
-        except TypeError:
-            pizzas_db.ordered_pizzas = {
-                form.description.data: {
-                    form.pizza_size.data: current_user.username,
-                    }
-            }
-        pizzas_db.users_already_ordered += current_user.username + " "
-        db.session.commit()
         flash('You successfully ordered a pizza ;-)')
         return redirect(url_for('pizza_time_view', happening=happening))
-    pizzas_ordered = pizzas_db.ordered_pizzas
+    pizzas_ordered = pizza_summary(happening)
     pizzas_active = pizzas_db.pizza_ordering_is_allowed
     return render_template(
         'pizza_time.html',
@@ -1216,6 +1130,20 @@ def pizza_time_stop(happening):
     if current_user.username != pizzas_db.who_created:
         flash('! Only event creator can stop the event !')
         return redirect(url_for('pizza_time_view', happening=happening))
-    pizzas_db.pizza_ordering_is_allowed = False
-    db.session.commit()
+
+    def stop():
+        """
+        Closes pizza event unless it is closed.
+        """
+        event = Pizza.query.get(happening)
+        if not event.pizza_ordering_is_allowed:
+            return False
+        event.pizza_ordering_is_allowed = False
+        return True
+
+    try:
+        if not retry_on_conflict(stop):
+            flash('Pizza time was already stopped')
+    except ConflictError as error:
+        flash(str(error))
     return redirect(url_for('pizza_time_view', happening=happening))
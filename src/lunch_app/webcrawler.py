@@ -3,9 +3,37 @@
 """
 Webrcrawlers functions
 """
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from http.client import HTTPException
+import json
+import logging
+import os
+import re
+import tempfile
 from urllib import request
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup, SoupStrainer
 from .main import app
+from .metrics import timed
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+log = logging.getLogger(__name__)
+
+TIMEOUT = 10
+
+
+class CrawlerError(Exception):
+    """
+    Restaurant web page could not be fetched.
+    """
 
 
 def read_webpage(webpage):
@@ -15,67 +43,218 @@ def read_webpage(webpage):
     return webpage.read()
 
 
-def get_dania_dnia_from_pod_koziolek():
+def _cache_paths(url):
     """
-    Returns data for new meal of a day.
+    Returns paths of cached headers and content of url or None
+    when cache is not configured.
+    """
+    cache_dir = app.config.get('CRAWLER_CACHE_DIR')
+    if not cache_dir:
+        return None
+    name = sha1(url.encode()).hexdigest()
+    return (
+        os.path.join(cache_dir, name + '.json'),
+        os.path.join(cache_dir, name + '.html'),
+    )
+
+
+def _read_cache(paths):
+    """
+    Returns cached headers and content, or (None, None).
+    """
+    if paths is None:
+        return None, None
+    try:
+        with open(paths[0]) as headers_file:
+            headers = json.load(headers_file)
+        with open(paths[1], 'rb') as content_file:
+            content = content_file.read()
+    except (OSError, ValueError):
+        return None, None
+    return headers, content
+
+
+def _write_file(path, data, mode):
+    """
+    Replaces file atomically so other workers never read half of it.
+    """
+    directory = os.path.dirname(path)
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(file_descriptor, mode) as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_cache(paths, url, response, content):
+    """
+    Stores validators and content of response.
+    """
+    headers = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    if paths is None or not (headers['etag'] or headers['last_modified']):
+        return
+    try:
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        _write_file(paths[1], content, 'wb')
+        _write_file(paths[0], json.dumps(headers), 'w')
+    except OSError as error:
+        log.warning('Could not cache %s: %s', url, error)
+
+
+def fetch(url, timeout=None):
+    """
+    Returns content of web page. Uses conditional GET when page is in
+    CRAWLER_CACHE_DIR, so unchanged page is not downloaded again.
+    """
+    timeout = timeout or app.config.get('CRAWLER_TIMEOUT', TIMEOUT)
+    paths = _cache_paths(url)
+    headers, content = _read_cache(paths)
+    webpage_request = request.Request(url)
+    if headers is not None:
+        if headers.get('etag'):
+            webpage_request.add_header('If-None-Match', headers['etag'])
+        if headers.get('last_modified'):
+            webpage_request.add_header(
+                'If-Modified-Since',
+                headers['last_modified'],
+            )
+    with timed(
+            'lunch_crawler_fetch_duration_seconds',
+            host=urlsplit(url).hostname or '',
+    ) as labels:
+        try:
+            with request.urlopen(webpage_request, timeout=timeout) as webpage:
+                new_content = read_webpage(webpage)
+                _write_cache(paths, url, webpage, new_content)
+                return new_content
+        except HTTPError as error:
+            if error.code == 304 and content is not None:
+                labels['status'] = 'not_modified'
+                return content
+            raise CrawlerError('{}: {}'.format(url, error))
+        except (URLError, HTTPException, OSError) as error:
+            # timeouts, refused connections and broken responses
+            raise CrawlerError('{}: {}'.format(url, error))
+
+
+def fetch_all(urls, timeout=None):
     """
-    url = app.config['URL_POD_KOZIOLKIEM']
-    webpage = request.urlopen(url)
-    magic_soup = BeautifulSoup(read_webpage(webpage))
-    list_of_meals = []
-    menu = magic_soup.find_all(
-        "span",
-        {
-            "style": "color: #ffffff; font-family: 'Segoe Print',"
-                     " sans-serif; font-size: medium; line-height: 1.3em;"
-        },
+    Fetches web pages concurrently.
+    Returns content of fetched pages and errors of failed ones,
+    both keyed by url.
+    """
+    pages = {}
+    errors = {}
+    if not urls:
+        return pages, errors
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        futures = {
+            url: executor.submit(fetch, url, timeout) for url in urls
+        }
+        for url, future in futures.items():
+            try:
+                pages[url] = future.result()
+            except CrawlerError as error:
+                log.warning('Crawling failed: %s', error)
+                errors[url] = error
+    return pages, errors
+
+
+def parser():
+    """
+    Returns name of BeautifulSoup parser set by CRAWLER_PARSER,
+    lxml when it is installed or builtin html.parser.
+    """
+    return app.config.get('CRAWLER_PARSER') or (
+        'lxml' if lxml is not None else 'html.parser'
     )
-    for meal in menu:
+
+
+def make_soup(page, parse_only=None):
+    """
+    Returns soup of page, only parts matching parse_only are kept.
+    """
+    return BeautifulSoup(page, parser(), parse_only=parse_only)
+
+
+KOZIOLEK_MEALS = SoupStrainer(
+    "span",
+    {
+        "style": "color: #ffffff; font-family: 'Segoe Print',"
+                 " sans-serif; font-size: medium; line-height: 1.3em;"
+    },
+)
+TOMAS_MEALS = SoupStrainer("td", {"class": "biala"})
+TOMAS_MARKUP = re.compile(
+    '[\n\t]|<span class="biala">|<span class="dzien">|</span>'
+)
+SKIPPED_ITEMS = frozenset(("<br/>", "\xa0", ":):)"))
+
+
+def get_dania_dnia_from_pod_koziolek(page=None):
+    """
+    Returns data for new meal of a day.
+    """
+    if page is None:
+        page = fetch(app.config['URL_POD_KOZIOLKIEM'])
+    magic_soup = make_soup(page, KOZIOLEK_MEALS)
+    list_of_meals = deque()
+    for meal in magic_soup.find_all(KOZIOLEK_MEALS):
         for food in meal:
-            itme = "{}".format(food)
-            itme = itme.strip("\xa0")
-            if itme != "<br/>" and itme and itme != "\xa0" \
-                    and itme != ":):)":
+            itme = str(food).strip("\xa0")
+            if itme and itme not in SKIPPED_ITEMS:
                 list_of_meals.append(itme)
     meal_of_a_day = {}
-    list_of_meals.pop(0)
+    list_of_meals.popleft()
     soup_of_a_day = list_of_meals[0]
     if not list_of_meals[1].startswith("1."):
         if "zupa" in list_of_meals[1]:
             soup_of_a_day_2 = list_of_meals[1]
             if not list_of_meals[2].startswith("1."):
                 soup_of_a_day += list_of_meals[2]
-                list_of_meals.pop(2)
+                del list_of_meals[2]
             meal_of_a_day["zupa_dnia_2"] = soup_of_a_day_2
-            list_of_meals.pop(1)
+            del list_of_meals[1]
         else:
             soup_of_a_day += list_of_meals[1]
-            list_of_meals.pop(1)
-    list_of_meals.pop(0)
+            del list_of_meals[1]
+    list_of_meals.popleft()
     meal_of_a_day["zupa_dnia"] = soup_of_a_day
-    meal_of_a_day_1 = ""
+    meal_of_a_day_1 = []
     while not list_of_meals[0].startswith("2.") and list_of_meals[0]:
-        meal_of_a_day_1 += list_of_meals[0]
-        meal_of_a_day_1 += " "
-        list_of_meals.pop(0)
-    meal_of_a_day_1 = meal_of_a_day_1.strip(" ")
-    meal_of_a_day["danie_dania_1"] = meal_of_a_day_1
+        meal_of_a_day_1.append(list_of_meals.popleft())
+    meal_of_a_day["danie_dania_1"] = ' '.join(meal_of_a_day_1).strip(" ")
     if list_of_meals[0]:
-        meal_of_a_day_2 = ' '.join(line for line in list_of_meals)
+        meal_of_a_day_2 = ' '.join(list_of_meals)
         meal_of_a_day_2 = meal_of_a_day_2.strip(" ")
         meal_of_a_day["danie_dania_2"] = meal_of_a_day_2
     return meal_of_a_day
 
 
-def get_week_from_tomas():
+def tomas_tokens(page):
+    """
+    Returns text items of Tomas menu cells without markup.
+    """
+    tokens = deque()
+    for meal in make_soup(page, TOMAS_MEALS).find_all(TOMAS_MEALS):
+        for food in meal:
+            item = TOMAS_MARKUP.sub("", str(food))
+            item = item.strip("\xa0").strip()
+            if item and item not in SKIPPED_ITEMS:
+                tokens.append(item)
+    return tokens
+
+
+def get_week_from_tomas(page=None):
     """
     Returns weak of meals from Tomas ! use only on mondays !.
     """
-    url = app.config['URL_TOMAS']
-    webpage = request.urlopen(url)
-    magic_soup = BeautifulSoup(read_webpage(webpage))
-    menu = magic_soup.find_all("td", {"class": "biala"})
-    alist = []
+    if page is None:
+        page = fetch(app.config['URL_TOMAS'])
+    tokens = tomas_tokens(page)
     tomas_menu = {
         'diet': [],
         'dzien_1': {},
@@ -84,46 +263,31 @@ def get_week_from_tomas():
         'dzien_4': {},
         'dzien_5': {},
     }
-    for meal in menu:
-        for food in meal:
-            item = "{}".format(food)
-            item = item.replace("\n", "")
-            item = item.replace("\t", "")
-            item = item.replace('<span class="biala">', "")
-            item = item.replace('<span class="dzien">', "")
-            item = item.replace('</span>', "")
-            item = item.strip("\xa0")
-            item = item.strip()
-            if item != "<br/>" and item and item != "\xa0" \
-                    and item != ":):)":
-                alist.append(item)
-    while "kcal" in str(alist) and alist[0]:
-        meal = alist[0]
-        alist.pop(0)
-        while "kcal" not in alist[0] and alist[0] != 'ZUPA DNIA:' and alist[0]:
-            meal += " "
-            meal += alist[0]
-            alist.pop(0)
-        tomas_menu['diet'].append(meal)
+    # diet meals end with calories, rest of the menu is split into days
+    diet_left = sum("kcal" in token for token in tokens)
+    while diet_left and tokens[0]:
+        meal = [tokens.popleft()]
+        diet_left -= "kcal" in meal[0]
+        while "kcal" not in tokens[0] and tokens[0] != 'ZUPA DNIA:' \
+                and tokens[0]:
+            meal.append(tokens.popleft())
+        tomas_menu['diet'].append(' '.join(meal))
     for i in range(1, 6):
         day_manu = {
             'zupy': [],
             'dania': [],
             'zupa_i_dania': [],
         }
-        if alist[0] == 'ZUPA DNIA:':
-            alist.pop(0)
-        soups = alist[0].split(',')
-        for soup in soups:
+        if tokens[0] == 'ZUPA DNIA:':
+            tokens.popleft()
+        for soup in tokens.popleft().split(','):
             soup = soup.strip()
             soup = soup.strip('.')
             day_manu['zupy'].append(soup)
-        alist.pop(0)
-        if alist[0] == 'DANIE DNIA:':
-            alist.pop(0)
-        while alist and alist[0] != 'ZUPA DNIA:':
-            day_manu['dania'].append(alist[0])
-            alist.pop(0)
+        if tokens[0] == 'DANIE DNIA:':
+            tokens.popleft()
+        while tokens and tokens[0] != 'ZUPA DNIA:':
+            day_manu['dania'].append(tokens.popleft())
         for soup in day_manu['zupy']:
             for meal in day_manu['dania']:
                 sopu_and_meal = soup + " + " + meal
@@ -131,3 +295,35 @@ def get_week_from_tomas():
         tomas_menu['dzien_{}'.format(i)] = day_manu
 
     return tomas_menu
+
+
+CRAWLERS = {
+    'Pod Koziołkiem': ('URL_POD_KOZIOLKIEM', get_dania_dnia_from_pod_koziolek),
+    'Tomas': ('URL_TOMAS', get_week_from_tomas),
+}
+
+
+def crawl_all(timeout=None):
+    """
+    Fetches menus of all restaurants concurrently.
+    Returns menus and errors of restaurants which failed keyed by company.
+    """
+    urls = {
+        company: app.config[url_key]
+        for company, (url_key, crawler) in CRAWLERS.items()
+    }
+    pages, fetch_errors = fetch_all(list(set(urls.values())), timeout)
+    menus = {}
+    errors = {}
+    for company, url in urls.items():
+        if url in fetch_errors:
+            errors[company] = fetch_errors[url]
+            continue
+        try:
+            menus[company] = CRAWLERS[company][1](pages[url])
+        except (IndexError, KeyError) as error:
+            log.warning('Parsing menu of %s failed: %s', company, error)
+            errors[company] = CrawlerError(
+                '{}: menu could not be parsed'.format(url),
+            )
+    return menus, errors